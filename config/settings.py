@@ -40,11 +40,13 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    "gallery.middleware.StaticFilesMiddleware",  # WhiteNoise, ASGI-friendly
+    "gallery.middleware.RequestTimingMiddleware",
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    "gallery.middleware.ProfilingMiddleware",
     'django.contrib.messages.middleware.MessageMiddleware',
     "gallery.middleware.LoginRequiredMiddleware",
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
@@ -80,6 +82,53 @@ DATABASES = {
 }
 
 
+# Cache
+# A file cache is shared by every gunicorn worker on the box (unlike locmem),
+# which the home stats and the tag index version stamp rely on.
+# e.g. CACHE_URL=redis://127.0.0.1:6379/1 or locmemcache:// for a single process.
+
+CACHES = {
+    "default": env.cache("CACHE_URL", default=f"filecache://{BASE_DIR / 'cache'}"),
+    # Version stamps (gallery.versions) have no timeout and everything cached is keyed
+    # on them, so they live where grid fragments can't crowd them out. With a shared
+    # CACHE_URL (redis, memcached) they default to the same server.
+    "versions": env.cache(
+        "VERSIONS_CACHE_URL",
+        default=env("CACHE_URL", default=f"filecache://{BASE_DIR / 'cache' / 'versions'}"),
+    ),
+}
+# The file cache culls a third of its entries at random once it holds MAX_ENTRIES
+# (300 unless set). Grid fragments are per URL and per user, so allow for plenty;
+# the stamps are one per photo with comments and one per user.
+for _alias, _max_entries in (("default", 50_000), ("versions", 1_000_000)):
+    if CACHES[_alias]["BACKEND"].endswith("FileBasedCache"):
+        CACHES[_alias].setdefault("OPTIONS", {}).setdefault("MAX_ENTRIES", _max_entries)
+
+# Home page counts from PostgreSQL's planner estimates instead of COUNT(*).
+GALLERY_STATS_ESTIMATES = env.bool("GALLERY_STATS_ESTIMATES", default=False)
+
+# Request timing (gallery.middleware.RequestTimingMiddleware): requests slower than
+# this are logged and listed at /staff/timings/; Server-Timing can be turned off.
+GALLERY_SLOW_REQUEST_MS = env.int("GALLERY_SLOW_REQUEST_MS", default=500)
+GALLERY_SERVER_TIMING = env.bool("GALLERY_SERVER_TIMING", default=True)
+
+# Request profiling (gallery.profiling): staff add ?profile=1, or one request in
+# GALLERY_PROFILE_SAMPLE_RATE is sampled (0 = never). Profiles are listed in the admin.
+GALLERY_PROFILE_DIR = env("GALLERY_PROFILE_DIR", default=str(BASE_DIR / "profiles"))
+GALLERY_PROFILE_SAMPLE_RATE = env.int("GALLERY_PROFILE_SAMPLE_RATE", default=0)
+GALLERY_PROFILE_KEEP = env.int("GALLERY_PROFILE_KEEP", default=200)
+
+# ZIP downloads (gallery.downloads): archives streamed at once per worker process,
+# and the most photos one archive may hold.
+GALLERY_DOWNLOAD_SLOTS = env.int("GALLERY_DOWNLOAD_SLOTS", default=2)
+GALLERY_DOWNLOAD_MAX_PHOTOS = env.int("GALLERY_DOWNLOAD_MAX_PHOTOS", default=10_000)
+
+# publish_derivatives: the S3-compatible bucket (R2) that import_photos --base-url
+# serves from. Credentials come from AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY.
+GALLERY_PUBLISH_BUCKET = env("GALLERY_PUBLISH_BUCKET", default="")
+GALLERY_PUBLISH_ENDPOINT_URL = env("GALLERY_PUBLISH_ENDPOINT_URL", default="")
+
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -127,3 +176,8 @@ if USE_R2_MEDIA:
     MEDIA_URL = "https://pub-fdbd187eb3a7403284ee1f08f2d4f82f.r2.dev/"
 else:
     MEDIA_URL = "/media/"
+
+# Local /media/ (gallery.media.serve): "x-accel-redirect" behind nginx, "x-sendfile"
+# behind Apache/lighttpd, or empty to send files from Django.
+GALLERY_MEDIA_ACCEL = env("GALLERY_MEDIA_ACCEL", default="")
+GALLERY_MEDIA_ACCEL_PREFIX = env("GALLERY_MEDIA_ACCEL_PREFIX", default="/protected-media/")
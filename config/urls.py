@@ -7,9 +7,9 @@ urlpatterns = [
     path("", include("gallery.urls")),
 ]
 
-# DEV ONLY:
 from django.conf import settings
-from django.conf.urls.static import static
+from gallery import views
 
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+if not settings.USE_R2_MEDIA:
+    # Behind the login like every page; see gallery.media for proxy offload.
+    urlpatterns += [path("media/<path:path>", views.media_file, name="media")]
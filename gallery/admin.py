@@ -1,5 +1,10 @@
+import uuid
+
 from django.contrib import admin
-from .models import Album, Photo, Comment, Tag
+from django.utils.html import format_html
+from . import profiling, search, versions
+from .models import Album, Photo, Comment, RequestProfile, Tag
+from .pagination import EstimatedCountPaginator
 
 
 @admin.register(Album)
@@ -14,30 +19,69 @@ class TagAdmin(admin.ModelAdmin):
     search_fields = ("name", "slug")
     prepopulated_fields = {"slug": ("name",)}
 
+
+# Photos and comments run to 100k+ rows. Their changelists have no sidebar
+# filters that list every value (search instead), don't count the whole table
+# a second time, and their forms pick related rows by autocomplete rather
+# than rendering every photo, album or tag as an <option>.
+
 @admin.register(Photo)
 class PhotoAdmin(admin.ModelAdmin):
     list_display = ("id", "album", "title", "created_at")
-    list_filter = ("album", "title", "tags")
-    search_fields = ("id",)
-    filter_horizontal = ("tags",)  # makes a nice multi-select UI
+    list_select_related = ("album",)
+    search_fields = ("title", "album__title")
+    autocomplete_fields = ("album", "tags")
+    ordering = ("-created_at", "-id")
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        # The search index covers titles, tags and albums; LIKE over every row
+        # (or a tags join, which needs DISTINCT) doesn't scale. Also used by
+        # the photo autocomplete on comments.
+        search_term = search_term.strip()
+        try:
+            return queryset.filter(pk=uuid.UUID(search_term)), False
+        except ValueError:
+            pass
+        if not search_term or not search.is_supported():
+            return super().get_search_results(request, queryset, search_term)
+        return search.matching(queryset, search_term), False
 
 
 @admin.register(Comment)
 class CommentAdmin(admin.ModelAdmin):
     list_display = ("created_at", "user", "photo_link", "is_visible", "short_text")
     list_filter = ("is_visible", "created_at")
-    search_fields = ("text", "user__username", "photo__id", "photo__album__title")
+    list_select_related = ("user", "photo__album")
+    search_fields = ("text", "user__username", "=photo__id", "photo__album__title")
+    autocomplete_fields = ("photo", "user")
     ordering = ("-created_at",)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     actions = ["hide_comments", "show_comments"]
 
     @admin.action(description="Hide selected comments")
     def hide_comments(self, request, queryset):
-        queryset.update(is_visible=False)
+        self._set_visible(queryset, False)
 
     @admin.action(description="Show selected comments")
     def show_comments(self, request, queryset):
-        queryset.update(is_visible=True)
+        self._set_visible(queryset, True)
+
+    def _set_visible(self, queryset, is_visible):
+        # Read the photos first: under the is_visible filter the rows no longer
+        # match the queryset once they are updated.
+        photo_ids = set(queryset.values_list("photo_id", flat=True))
+        queryset.update(is_visible=is_visible)
+        self._bump_comment_versions(photo_ids)
+
+    def _bump_comment_versions(self, photo_ids):
+        # update() sends no signals; photo_detail's ETag and search must still change.
+        for photo_id in photo_ids:
+            versions.bump(versions.comments_key(photo_id))
+        search.reindex(photo_ids)
 
     @admin.display(description="Photo")
     def photo_link(self, obj):
@@ -46,4 +90,37 @@ class CommentAdmin(admin.ModelAdmin):
     @admin.display(description="Comment")
     def short_text(self, obj):
         t = obj.text.strip().replace("\n", " ")
-        return (t[:60] + "…") if len(t) > 60 else t
\ No newline at end of file
+        return (t[:60] + "…") if len(t) > 60 else t
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ("created_at", "method", "path", "view_name", "status_code", "duration_ms", "trigger", "user")
+    list_filter = ("trigger", "view_name", "status_code")
+    search_fields = ("path", "view_name", "user__username")
+    ordering = ("-created_at",)
+    fields = (
+        "created_at", "method", "path", "view_name", "user", "status_code", "duration_ms", "trigger",
+        "file_name", "top_cumulative", "top_own_time",
+    )
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def delete_model(self, request, obj):
+        profiling.delete_profiles([obj])
+
+    def delete_queryset(self, request, queryset):
+        profiling.delete_profiles(list(queryset))
+
+    @admin.display(description="Top functions by cumulative time")
+    def top_cumulative(self, obj):
+        return format_html("<pre>{}</pre>", profiling.top_functions(obj.file_name, sort="cumulative"))
+
+    @admin.display(description="Top functions by own time")
+    def top_own_time(self, obj):
+        return format_html("<pre>{}</pre>", profiling.top_functions(obj.file_name, sort="tottime"))
@@ -0,0 +1,183 @@
+"""
+ZIP downloads of many photos' web images at once (an album, a
+photo_browser filter, a user's favorites).
+
+The archive is written while it is sent: entries are stored, not
+compressed (JPEGs don't shrink), and each file is copied through in
+CHUNK_SIZE pieces from MEDIA_ROOT or the object store. Nothing is built in
+memory or in a temp file, so memory does not grow with the images. What
+does grow is a few hundred bytes per photo: the rows fetched up front and
+the ZIP central directory, which is only written at the end. That is what
+GALLERY_DOWNLOAD_MAX_PHOTOS bounds.
+
+A download holds one of GALLERY_DOWNLOAD_SLOTS per worker process until
+the response is closed; with none free the view answers 503 rather than
+tie up a worker that page views need.
+"""
+import logging
+import threading
+import zipfile
+from pathlib import PurePosixPath
+from urllib.parse import unquote, urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import content_disposition_header
+
+from .media import open_media
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 256 * 1024
+RETRY_AFTER = 30  # seconds, on a 503 when every slot is taken
+# ZIP timestamps can't go back further than this.
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+_slots = None
+_slots_lock = threading.Lock()
+
+
+def _download_slots():
+    global _slots
+    with _slots_lock:
+        if _slots is None:
+            _slots = threading.BoundedSemaphore(settings.GALLERY_DOWNLOAD_SLOTS)
+        return _slots
+
+
+class _Sink:
+    """Write-only stream zipfile writes into; the generator hands the bytes on."""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        if self._parts:
+            data = b"".join(self._parts)
+            self._parts = []
+            yield data
+
+
+def archive_names(urls):
+    """A unique file name inside the archive for each image URL, in order."""
+    seen = set()
+    for url in urls:
+        name = PurePosixPath(unquote(urlsplit(url).path)).name or "photo.jpg"
+        stem, suffix, n = PurePosixPath(name).stem, PurePosixPath(name).suffix, 1
+        while name.lower() in seen:
+            n += 1
+            name = f"{stem} ({n}){suffix}"
+        seen.add(name.lower())
+        yield name
+
+
+class ZipStream:
+    """
+    Iterable of the archive's bytes for rows of (image URL, created_at).
+    close() (called by the response) releases the download slot.
+    """
+
+    def __init__(self, rows, slot):
+        self.rows = rows
+        self._slot = slot
+        self._chunks = None
+
+    def __iter__(self):
+        self._chunks = self._generate()
+        return self._chunks
+
+    def _generate(self):
+        sink = _Sink()
+        skipped = []
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as archive:
+            for name, (url, created_at) in zip(archive_names(url for url, _ in self.rows), self.rows):
+                try:
+                    source = open_media(url)
+                except OSError as exc:
+                    logger.debug("ZIP download: can't open %s: %s", url, exc)
+                    skipped.append(f"{name}: {'not found' if isinstance(exc, FileNotFoundError) else 'unreadable'}")
+                    continue
+                info = zipfile.ZipInfo(name, date_time=max(timezone.localtime(created_at).timetuple()[:6], ZIP_EPOCH))
+                with source, archive.open(info, "w") as entry:
+                    try:
+                        while data := source.read(CHUNK_SIZE):
+                            entry.write(data)
+                            yield from sink.drain()
+                    except OSError as exc:
+                        # Headers are long gone: keep what arrived and say so.
+                        logger.debug("ZIP download: reading %s failed: %s", url, exc)
+                        skipped.append(f"{name}: incomplete")
+                yield from sink.drain()
+            if skipped:
+                logger.warning("ZIP download left out %d of %d files", len(skipped), len(self.rows))
+                archive.writestr("MISSING.txt", "Could not be included:\n" + "\n".join(skipped) + "\n")
+        yield from sink.drain()
+
+    def close(self):
+        if self._chunks is not None:
+            try:
+                self._chunks.close()
+            except ValueError:
+                pass  # an ASGI client left while a worker thread was reading; that thread finishes the read
+        if self._slot is not None:
+            self._slot.release()
+            self._slot = None
+
+
+class _AsyncZipStream:
+    """
+    ZipStream for ASGI. StreamingHttpResponse would read a sync iterator
+    into a list first; this reads one chunk at a time in a worker thread.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    async def __aiter__(self):
+        chunks = iter(self._stream)
+        read = sync_to_async(next, thread_sensitive=False)
+        while (data := await read(chunks, None)) is not None:
+            yield data
+
+    def close(self):
+        self._stream.close()
+
+
+def zip_response(request, photos, filename):
+    """
+    A streamed ZIP of photos' image_web files, named filename + ".zip".
+    photos is a Photo queryset in the order the archive should list them.
+    """
+    slot = _download_slots()
+    if not slot.acquire(blocking=False):
+        response = HttpResponse("Too many downloads in progress; try again shortly.", status=503)
+        response["Retry-After"] = str(RETRY_AFTER)
+        return response
+    try:
+        limit = settings.GALLERY_DOWNLOAD_MAX_PHOTOS
+        rows = list(photos.values_list("image_web", "created_at")[:limit + 1])
+    except BaseException:
+        slot.release()
+        raise
+    if len(rows) > limit:
+        slot.release()
+        return HttpResponse(f"A download can hold at most {limit} photos; narrow the selection.", status=400)
+
+    stream = ZipStream(rows, slot)
+    response = StreamingHttpResponse(
+        _AsyncZipStream(stream) if isinstance(request, ASGIRequest) else stream,
+        content_type="application/zip",
+    )
+    response["Content-Disposition"] = content_disposition_header(True, f"{filename}.zip")
+    response["Cache-Control"] = "private, no-store"
+    return response
@@ -0,0 +1,127 @@
+"""
+Favorite writes that never read first.
+
+The unique_user_photo_favorite constraint decides what happens, so there is
+no SELECT of the photo or the favorite and no race between checking and
+writing:
+
+    toggle()   one statement on PostgreSQL (a DELETE ... RETURNING feeding an
+               INSERT ... ON CONFLICT DO NOTHING); elsewhere a DELETE, then an
+               INSERT only if nothing was deleted, in one transaction
+    add()      one INSERT ... SELECT ... ON CONFLICT DO NOTHING for any number
+               of photos; ids that are not photos are skipped
+    remove()   one DELETE for any number of photos
+
+Each statement commits on its own; only toggle()'s two-statement form
+needs a transaction around it. None of them send model signals, so each call bumps the user's favorites
+stamp itself (see gallery.versions); inside a transaction the bump waits for
+the commit.
+"""
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from . import versions
+from .models import Favorite, Photo
+
+# Most photos one add()/remove() call accepts.
+MAX_BULK = 500
+
+_TOGGLE_POSTGRESQL = """
+    WITH removed AS (
+        DELETE FROM {favorite} WHERE user_id = %s AND photo_id = %s RETURNING 1
+    )
+    INSERT INTO {favorite} (user_id, photo_id, created_at)
+    SELECT %s, %s, %s WHERE NOT EXISTS (SELECT 1 FROM removed)
+    ON CONFLICT (user_id, photo_id) DO NOTHING
+    RETURNING 1
+"""
+
+_ADD = """
+    INSERT INTO {favorite} (user_id, photo_id, created_at)
+    SELECT %s, id, %s FROM {photo} WHERE id IN ({ids})
+    ON CONFLICT (user_id, photo_id) DO NOTHING
+"""
+
+_REMOVE = "DELETE FROM {favorite} WHERE user_id = %s AND photo_id IN ({ids})"
+
+
+def _changed(user_id):
+    key = versions.favorites_key(user_id)
+    transaction.on_commit(lambda: versions.bump(key))
+
+
+def _db_id(photo_id):
+    # The form a UUIDField is stored in (a 32-char hex string on SQLite).
+    return Photo._meta.pk.get_db_prep_value(photo_id, connection)
+
+
+def _delete(user_id, photo_ids):
+    """DELETE the user's favorites of photo_ids; QuerySet.delete() would SELECT them first for the signal."""
+    sql = _REMOVE.format(favorite=Favorite._meta.db_table, ids=", ".join(["%s"] * len(photo_ids)))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [user_id, *map(_db_id, photo_ids)])
+        return cursor.rowcount
+
+
+def toggle(user_id, photo_id):
+    """
+    Favorite the photo if the user hadn't, unfavorite it if they had.
+    Returns whether it is a favorite now. Raises Photo.DoesNotExist for an
+    unknown photo.
+
+    PostgreSQL does this in one statement. Other databases run a DELETE and
+    then, if nothing was deleted, an INSERT, inside transaction.atomic(): the
+    DELETE takes the write lock (SQLite) or the row lock first, so two
+    concurrent toggles run one after the other instead of both inserting or
+    both deleting.
+    """
+    try:
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    _TOGGLE_POSTGRESQL.format(favorite=Favorite._meta.db_table),
+                    [user_id, _db_id(photo_id), user_id, _db_id(photo_id), timezone.now()],
+                )
+                favorited = cursor.fetchone() is not None
+        else:
+            with transaction.atomic():
+                favorited = not _delete(user_id, [photo_id])
+                if favorited:
+                    Favorite.objects.bulk_create(
+                        [Favorite(user_id=user_id, photo_id=photo_id, created_at=timezone.now())],
+                        ignore_conflicts=True,
+                    )
+    except IntegrityError:
+        # The photo foreign key: there is no such photo.
+        raise Photo.DoesNotExist(photo_id)
+    _changed(user_id)
+    return favorited
+
+
+def add(user_id, photo_ids):
+    """Favorite every photo in photo_ids. Returns how many were not favorites before."""
+    photo_ids = list(photo_ids)[:MAX_BULK]
+    if not photo_ids:
+        return 0
+    sql = _ADD.format(
+        favorite=Favorite._meta.db_table,
+        photo=Photo._meta.db_table,
+        ids=", ".join(["%s"] * len(photo_ids)),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [user_id, timezone.now(), *map(_db_id, photo_ids)])
+        added = cursor.rowcount
+    if added:
+        _changed(user_id)
+    return added
+
+
+def remove(user_id, photo_ids):
+    """Unfavorite every photo in photo_ids. Returns how many were favorites."""
+    photo_ids = list(photo_ids)[:MAX_BULK]
+    if not photo_ids:
+        return 0
+    removed = _delete(user_id, photo_ids)
+    if removed:
+        _changed(user_id)
+    return removed
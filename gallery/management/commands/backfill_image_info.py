@@ -0,0 +1,72 @@
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.request import urlopen
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gallery import stats, versions
+from gallery.management.commands.make_derivatives import image_summary
+from gallery.media import FETCH_TIMEOUT, media_path
+from gallery.models import Photo
+
+
+class Command(BaseCommand):
+    help = "Fill in width, height, dominant color and placeholder for photos imported without them."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=200, help="Photos per query and UPDATE (default: 200)")
+        parser.add_argument("--workers", type=int, default=4, help="Images read in parallel (default: 4)")
+        parser.add_argument("--fetch-remote", action="store_true", help="Download http(s) image_web URLs too")
+        parser.add_argument("--all", action="store_true", help="Recompute photos that already have the fields")
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        if chunk_size < 1:
+            raise CommandError("--chunk-size must be at least 1")
+        self.fetch_remote = options["fetch_remote"]
+
+        photos = Photo.objects.only("id", "image_web").order_by("id")
+        if not options["all"]:
+            photos = photos.filter(width__isnull=True)
+
+        updated = failed = 0
+        last_id = None
+        with ThreadPoolExecutor(max_workers=max(1, options["workers"])) as pool:
+            while True:
+                # Keyset over id: rows that fail stay unfilled but never get re-read.
+                chunk = photos.filter(id__gt=last_id) if last_id else photos
+                chunk = list(chunk[:chunk_size])
+                if not chunk:
+                    break
+                last_id = chunk[-1].id
+
+                done = []
+                for photo, result in zip(chunk, pool.map(self.summarize, chunk)):
+                    if isinstance(result, Exception):
+                        failed += 1
+                        self.stdout.write(self.style.WARNING(f"{photo.id} {photo.image_web}: {result}"))
+                        continue
+                    photo.width, photo.height, photo.dominant_color, photo.placeholder = result
+                    done.append(photo)
+
+                Photo.objects.bulk_update(done, ["width", "height", "dominant_color", "placeholder"])
+                updated += len(done)
+                self.stdout.write(f"Updated {updated} ({failed} failed)")
+
+        if updated:
+            # bulk_update sends no signals: drop cached grids and the home page.
+            versions.bump("catalog")
+            stats.invalidate()
+        self.stdout.write(self.style.SUCCESS(f"Done. {updated} updated, {failed} failed."))
+
+    def summarize(self, photo):
+        try:
+            path = media_path(photo.image_web)
+            if path is not None:
+                return image_summary(path)
+            if not self.fetch_remote:
+                return ValueError("not under /media/ (use --fetch-remote)")
+            with urlopen(photo.image_web, timeout=FETCH_TIMEOUT) as response:
+                return image_summary(BytesIO(response.read()))
+        except Exception as exc:
+            return exc
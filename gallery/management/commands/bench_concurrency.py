@@ -0,0 +1,164 @@
+import http.client
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from gallery.management.commands.bench_views import BENCH_USERNAME
+from gallery.models import Album, Photo
+
+SERVERS = {
+    # Same worker count for both, so both hold about the same memory.
+    "sync": ["gunicorn", "config.wsgi:application", "--worker-class", "sync"],
+    "async": ["gunicorn", "config.asgi:application", "--worker-class", "uvicorn_worker.UvicornWorker"],
+}
+
+
+def tree_rss_mb(pid):
+    """Resident memory of a process and all its children, from /proc (Linux only)."""
+    total_kb = 0
+    pending = [pid]
+    while pending:
+        p = pending.pop()
+        try:
+            for line in Path(f"/proc/{p}/status").read_text().splitlines():
+                if line.startswith("VmRSS:"):
+                    total_kb += int(line.split()[1])
+            for task in Path(f"/proc/{p}/task").iterdir():
+                pending += [int(c) for c in (task / "children").read_text().split()]
+        except OSError:
+            continue
+    return total_kb / 1024
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve the read-heavy views from gunicorn sync workers and from uvicorn (ASGI) workers, "
+        "with the same number of processes, and compare throughput and latency as concurrency rises."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=2, help="Server processes for each mode (default: 2)")
+        parser.add_argument(
+            "--concurrency", default="1,8,32,64", help="Comma-separated client counts (default: 1,8,32,64)"
+        )
+        parser.add_argument("--seconds", type=float, default=10, help="Load per step (default: 10)")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--only", choices=sorted(SERVERS), help="Run one mode only")
+
+    def handle(self, *args, **options):
+        if sys.platform != "linux":
+            self.stdout.write(self.style.WARNING("Memory is read from /proc and will show as 0 here."))
+        levels = [int(n) for n in options["concurrency"].split(",")]
+        paths = self.paths()
+        cookie = f"{settings.SESSION_COOKIE_NAME}={self.session_key()}"
+
+        self.stdout.write(f"{len(paths)} URLs, {options['workers']} worker(s) per mode, {options['seconds']}s per step")
+        self.stdout.write(f"{'mode':<6} {'clients':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7} {'RSS MB':>8}")
+        for mode, argv in SERVERS.items():
+            if options["only"] and mode != options["only"]:
+                continue
+            server = self.start(argv, options["workers"], options["port"])
+            try:
+                self.load(options["port"], paths, cookie, 2, 1)  # warm every worker
+                for clients in levels:
+                    count, latencies, errors = self.load(options["port"], paths, cookie, clients, options["seconds"])
+                    rss = tree_rss_mb(server.pid)
+                    p50 = statistics.median(latencies) if latencies else 0
+                    p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else p50
+                    self.stdout.write(
+                        f"{mode:<6} {clients:>7} {count / options['seconds']:>8.0f} {p50:>8.1f} {p95:>8.1f} "
+                        f"{errors:>7} {rss:>8.0f}"
+                    )
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+
+    def paths(self):
+        album = Album.objects.filter(photo_count__gt=0).order_by("-photo_count").first()
+        photos = list(Photo.objects.order_by("-created_at").values_list("id", flat=True)[:20])
+        if album is None or not photos:
+            raise CommandError("No photos to request; run seed_gallery first.")
+        paths = [reverse("photo_browser"), reverse("favorites"), reverse("recent_comments")]
+        paths.append(reverse("album_detail", args=[album.pk]))
+        paths += [reverse("photo_detail", args=[pk]) for pk in photos]
+        return paths
+
+    def session_key(self):
+        """A logged-in session for the bench user, as the servers will see it."""
+        user = get_user_model().objects.filter(username=BENCH_USERNAME).first()
+        if user is None:
+            raise CommandError(f"Run bench_views once first; it creates {BENCH_USERNAME}.")
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = "django.contrib.auth.backends.ModelBackend"
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        return session.session_key
+
+    def start(self, argv, workers, port):
+        server = subprocess.Popen(
+            argv + ["--workers", str(workers), "--bind", f"127.0.0.1:{port}", "--log-level", "warning"],
+            env={**os.environ, "GALLERY_SLOW_REQUEST_MS": "100000"},
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                return server
+            except OSError:
+                if server.poll() is not None:
+                    raise CommandError(f"{argv[1]} exited with {server.returncode}")
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError(f"{argv[1]} did not start listening on port {port}")
+
+    def load(self, port, paths, cookie, clients, seconds):
+        """Each client requests the paths in turn over one keep-alive connection until time is up."""
+        deadline = time.monotonic() + seconds
+        lock = threading.Lock()
+        latencies = []
+        errors = [0]
+
+        def client(offset):
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+            mine = []
+            i = offset
+            while time.monotonic() < deadline:
+                path = paths[i % len(paths)]
+                i += 1
+                start = time.perf_counter()
+                try:
+                    conn.request("GET", path, headers={"Cookie": cookie, "Host": "localhost"})
+                    response = conn.getresponse()
+                    response.read()
+                    ok = response.status == 200
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+                    ok = False
+                if ok:
+                    mine.append((time.perf_counter() - start) * 1000)
+                else:
+                    with lock:
+                        errors[0] += 1
+            conn.close()
+            with lock:
+                latencies.extend(mine)
+
+        threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return len(latencies), latencies, errors[0]
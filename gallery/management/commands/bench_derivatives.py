@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import multiprocessing
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image, ImageOps
+
+from gallery.management.commands.make_derivatives import (
+    JPEG_QUALITY,
+    WEB_MAX_W,
+    save_jpeg_resized,
+)
+
+FORMATS = {"jpg": "JPEG", "png": "PNG", "tif": "TIFF"}
+
+
+def naive_resize(src_path: Path, dst_path: Path, max_width: int) -> None:
+    """The original full-decode path, kept here as the baseline to compare against."""
+    with Image.open(src_path) as im:
+        im = ImageOps.exif_transpose(im)
+        if im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+        w, h = im.size
+        if w > max_width:
+            im = im.resize((max_width, round(h * (max_width / w))), Image.Resampling.LANCZOS)
+        im.save(dst_path, format="JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+
+
+def _max_rss_mb() -> float:
+    import resource
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS reports bytes.
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def _run_case(fn_name: str, src: str, dst: str, max_width: int) -> tuple[float, float, float]:
+    """Runs in a fresh process so peak RSS belongs to this case alone."""
+    fn = {"bounded": save_jpeg_resized, "naive": naive_resize}[fn_name]
+    base = _max_rss_mb()
+    start = time.perf_counter()
+    fn(Path(src), Path(dst), max_width)
+    elapsed = time.perf_counter() - start
+    peak = _max_rss_mb()
+    return elapsed, peak, peak - base
+
+
+def make_sample(path: Path, size: tuple[int, int], fmt: str) -> None:
+    # Smooth gradients plus a little noise: compresses like a scan, not like static.
+    r = Image.linear_gradient("L").resize(size)
+    g = Image.radial_gradient("L").resize(size)
+    b = Image.effect_noise(size, 40)
+    Image.merge("RGB", (r, g, b)).save(path, format=FORMATS[fmt])
+
+
+class Command(BaseCommand):
+    help = "Benchmark derivative decoding: wall time and peak RSS per input format and size."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            default="3000x2000,7200x4800",
+            help="Comma-separated WxH source sizes (e.g. 9600x7200 for a 600dpi 16x12 scan)",
+        )
+        parser.add_argument("--formats", default="jpg,png,tif", help="Comma-separated: jpg, png, tif")
+        parser.add_argument("--max-width", type=int, default=WEB_MAX_W, help="Output width")
+        parser.add_argument("--workdir", help="Where to write samples (default: a temp folder)")
+
+    def handle(self, *args, **options):
+        if sys.platform == "win32":
+            raise CommandError("bench_derivatives needs the resource module (Linux/macOS).")
+
+        try:
+            sizes = [tuple(int(n) for n in s.lower().split("x")) for s in options["sizes"].split(",")]
+        except ValueError:
+            raise CommandError(f"Bad --sizes value: {options['sizes']}")
+        formats = [f.strip().lower() for f in options["formats"].split(",")]
+        unknown = [f for f in formats if f not in FORMATS]
+        if unknown:
+            raise CommandError(f"Unknown format(s): {', '.join(unknown)}")
+
+        with tempfile.TemporaryDirectory(dir=options["workdir"]) as tmp:
+            tmp = Path(tmp)
+            # Every case (and every sample) gets a fresh interpreter. Linux carries
+            # the peak RSS across fork/exec, so this process must never hold a
+            # full-size image or it would inflate every measurement.
+            ctx = multiprocessing.get_context("spawn")
+
+            self.stdout.write(
+                f"{'format':<6} {'size':>11} {'path':<8} {'wall s':>8} {'peak MB':>9} {'+MB':>8}"
+            )
+            for w, h in sizes:
+                for fmt in formats:
+                    src = tmp / f"sample_{w}x{h}.{fmt}"
+                    with ctx.Pool(1) as pool:
+                        pool.apply(make_sample, (src, (w, h), fmt))
+                    for fn_name in ("naive", "bounded"):
+                        dst = tmp / f"out_{fn_name}.jpg"
+                        with ctx.Pool(1) as pool:
+                            elapsed, peak, delta = pool.apply(
+                                _run_case, (fn_name, str(src), str(dst), options["max_width"])
+                            )
+                        self.stdout.write(
+                            f"{fmt:<6} {f'{w}x{h}':>11} {fn_name:<8} {elapsed:>8.2f} {peak:>9.1f} {delta:>8.1f}"
+                        )
+                    src.unlink()
@@ -0,0 +1,56 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from gallery import versions
+from gallery.models import Album
+
+
+class Command(BaseCommand):
+    help = "Compare cold vs warm renders of the cached photo grids (photo_browser, album_detail, favorites)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--username", required=True, help="User to render the pages as")
+        parser.add_argument("--runs", type=int, default=20, help="Requests per page and mode (default: 20)")
+
+    def handle(self, *args, **options):
+        user = get_user_model().objects.filter(username=options["username"]).first()
+        if user is None:
+            raise CommandError(f"No user named {options['username']!r}")
+
+        client = Client(HTTP_HOST="localhost")
+        client.force_login(user)
+
+        urls = [reverse("photo_browser"), reverse("favorites")]
+        album = Album.objects.order_by("-created_at").first()
+        if album:
+            urls.append(reverse("album_detail", args=[album.id]))
+
+        runs = options["runs"]
+        self.stdout.write(f"{'page':<48} {'cold ms':>9} {'warm ms':>9} {'cold q':>7} {'warm q':>7}")
+        for url in urls:
+            # Cold: a new catalog stamp before every request forces a fresh render.
+            cold_ms, cold_q = self._time(client, url, runs, before_each=lambda: versions.bump("catalog"))
+            client.get(url)  # prime
+            warm_ms, warm_q = self._time(client, url, runs)
+            self.stdout.write(f"{url:<48} {cold_ms:>9.1f} {warm_ms:>9.1f} {cold_q:>7} {warm_q:>7}")
+
+    def _time(self, client, url, runs, before_each=None):
+        total = 0.0
+        queries = 0
+        for _ in range(runs):
+            if before_each:
+                before_each()
+            with CaptureQueriesContext(connection) as ctx:
+                start = time.perf_counter()
+                response = client.get(url)
+                total += time.perf_counter() - start
+            if response.status_code != 200:
+                raise CommandError(f"{url} returned {response.status_code}")
+            queries = len(ctx)
+        return total / runs * 1000, queries
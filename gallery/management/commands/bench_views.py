@@ -0,0 +1,269 @@
+import statistics
+import time
+from urllib.parse import urlencode
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from gallery import stats, urls, versions
+from gallery.management.commands.seed_gallery import PREFIX
+from gallery.models import Album, Favorite, Photo, Tag
+
+# Most queries one request may issue with every cache cold. Each starts from the
+# session and user lookups (2), then counts what the view itself needs. None of
+# them grows with the page size: a list page is one query for its rows plus one
+# per prefetched relation. A view going over usually means an N+1 crept into the
+# view or its template; raise a budget only with a reason written here.
+QUERY_BUDGETS = {
+    # Four table counts (stats, cached between edits), the newest albums and photos.
+    "home": 8,
+    # The albums; photo_count and the cover thumbnail are stored on the album row.
+    "album_list": 3,
+    # Tags for the filter bar, a keyset page of photos, their tags, the total.
+    "photo_browser": 6,
+    # As photo_browser, but the tag index supplies the page's ids and the total.
+    "photo_browser?tags": 5,
+    # The album, a page of its photos.
+    "album_detail": 4,
+    # The photo, its tags, whether it is a favorite, its comments with their users.
+    "photo_detail": 6,
+    # As photo_detail, plus the newer and the older photo in the album.
+    "photo_detail?next=album": 8,
+    # As photo_detail, plus the tag slugs and both neighbours (ids from the tag index) in one query.
+    "photo_detail?next=tags": 8,
+    # DELETE then INSERT, in BEGIN/COMMIT; on PostgreSQL one statement, so 3.
+    "toggle_favorite": 6,
+    # A page of the user's favorites, their tags.
+    "favorites": 4,
+    # A page of comments with photo and user joined.
+    "recent_comments": 3,
+    # The empty search form reads nothing.
+    "search": 2,
+    # A capped match count, the page's ids from the full-text index, those photos.
+    "search?q": 5,
+    # A static page.
+    "uploading_photos": 2,
+    # The photo, its current tags, every tag for the checkboxes.
+    "edit_photo_tags": 5,
+    # This worker's timings are kept in memory, not in the database.
+    "request_timings": 2,
+    "api_toggle_favorite": 6,  # as toggle_favorite
+    # One INSERT ... SELECT for the whole batch, however many photos are in it.
+    "api_favorites": 3,
+    # The album, then its photos' files in one streamed query.
+    "album_download": 4,
+    # The tag slugs, then the matched photos' files in one streamed query.
+    "photo_browser_download": 4,
+    # The favorited photos' files in one streamed query.
+    "favorites_download": 3,
+    # Admin pages over the tables that grow with the library (as a superuser: no
+    # permission queries). A changelist is one count (a planner estimate on
+    # PostgreSQL when unfiltered, never a second full count) and one page of rows
+    # with the foreign keys in list_display joined.
+    "admin:photo_changelist": 4,
+    "admin:photo_changelist?q": 4,
+    # The photo, its tags, the album choices, the tag widget's selected tags.
+    "admin:photo_change": 6,
+    "admin:comment_changelist": 4,
+    # The comment, its user and photo; the autocomplete widgets fetch the selected photo and user again.
+    "admin:comment_change": 7,
+}
+
+# Conditional GET (gallery.views.conditional): a revalidation with the page's
+# ETag must answer 304 from version stamps alone. These are the session and
+# user lookups; the decision itself queries nothing.
+NOT_MODIFIED_BUDGET = 2
+CONDITIONAL = {
+    "album_list", "album_detail", "photo_detail", "photo_browser", "photo_browser?tags",
+    "photo_detail?next=album", "photo_detail?next=tags",
+}
+
+# POSTed to; the toggles are requested an even number of times in all.
+TOGGLES = {"toggle_favorite", "api_toggle_favorite"}
+POSTS = TOGGLES | {"api_favorites"}
+
+BENCH_USERNAME = f"{PREFIX}-user-bench"
+BENCH_FAVORITES = 40
+
+
+class Command(BaseCommand):
+    help = "Request every gallery URL through the test client; report latency and queries, fail over QUERY_BUDGETS."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=20, help="Warm requests per URL (default: 20)")
+        parser.add_argument("--username", help=f"Superuser to request as (default: creates {BENCH_USERNAME})")
+
+    def handle(self, *args, **options):
+        self.setup(options["username"])
+        cases = list(self.cases())
+        for _, method, url, data in cases:
+            self.request(method, url, data)  # build the tag index, open the DB connection, etc.
+
+        self.stdout.write(
+            f"{'view':<24} {'status':>6} {'cold q':>7} {'warm q':>7} {'budget':>7} {'p50 ms':>8} {'p95 ms':>8}"
+        )
+        failures = []
+        for name, method, url, data in cases:
+            self.make_cold()
+            status, cold_queries, _ = self.request(method, url, data)
+            timings = []
+            for _ in range(options["runs"]):
+                _, warm_queries, ms = self.request(method, url, data)
+                timings.append(ms)
+            if name in TOGGLES and (1 + options["runs"]) % 2:
+                self.request(method, url, data)  # leave the favorite as it was
+            p50 = statistics.median(timings)
+            p95 = statistics.quantiles(timings, n=20)[-1] if len(timings) > 1 else p50
+            budget = QUERY_BUDGETS.get(name)
+
+            line = (
+                f"{name:<24} {status:>6} {cold_queries:>7} {warm_queries:>7} {budget or '-':>7} "
+                f"{p50:>8.1f} {p95:>8.1f}"
+            )
+            if status >= 400:
+                failures.append(f"{name}: {url} returned {status}")
+            elif budget is None:
+                failures.append(f"{name}: no entry in QUERY_BUDGETS")
+            elif cold_queries > budget:
+                failures.append(f"{name}: {cold_queries} queries, budget is {budget}")
+            else:
+                self.stdout.write(line)
+                continue
+            self.stdout.write(self.style.ERROR(line))
+
+        failures += self.check_not_modified(cases)
+        if failures:
+            raise CommandError("Over budget:\n  " + "\n  ".join(failures))
+        self.stdout.write(self.style.SUCCESS(f"{len(cases)} URLs within their query budgets."))
+
+    def check_not_modified(self, cases):
+        """
+        Fetch each conditional page in a new session, then again with its
+        ETag: the second must be a 304 within NOT_MODIFIED_BUDGET queries.
+        A new session each time, because its first page is the one that
+        creates the CSRF cookie.
+        """
+        self.stdout.write(f"\n{'conditional GET':<24} {'status':>6} {'queries':>7} {'budget':>7}")
+        failures = []
+        for name, method, url, _ in cases:
+            if method != "get":
+                continue
+            client = Client(HTTP_HOST="localhost")
+            client.force_login(self.user)
+            etag = client.get(url).get("ETag")
+            if etag is None:
+                if name in CONDITIONAL:
+                    failures.append(f"{name}: no ETag on {url}")
+                continue
+            with CaptureQueriesContext(connection) as ctx:
+                status = client.get(url, HTTP_IF_NONE_MATCH=etag).status_code
+            line = f"{name:<24} {status:>6} {len(ctx):>7} {NOT_MODIFIED_BUDGET:>7}"
+            if status != 304:
+                failures.append(f"{name}: revalidating {url} returned {status}, not 304")
+            elif len(ctx) > NOT_MODIFIED_BUDGET:
+                failures.append(f"{name}: 304 took {len(ctx)} queries, budget is {NOT_MODIFIED_BUDGET}")
+            else:
+                self.stdout.write(line)
+                continue
+            self.stdout.write(self.style.ERROR(line))
+        return failures
+
+    def setup(self, username):
+        """Pick the user, album and photo the cases request, and log the client in."""
+        self.user = self.bench_user(username)
+        self.album = Album.objects.filter(photo_count__gt=0).order_by("-photo_count").first()
+        self.photo = Photo.objects.filter(comments__isnull=False).order_by("-created_at").first() or Photo.objects.first()
+        if self.album is None or self.photo is None:
+            raise CommandError("No photos to benchmark; run seed_gallery first.")
+
+        self.client = Client(HTTP_HOST="localhost")
+        self.client.force_login(self.user)
+
+    def bench_user(self, username):
+        User = get_user_model()
+        if username:
+            user = User.objects.filter(username=username).first()
+            if user is None or not user.is_superuser:
+                raise CommandError(f"{username!r} is not a superuser")
+            return user
+        user, created = User.objects.get_or_create(
+            username=BENCH_USERNAME,
+            defaults={"is_staff": True, "is_superuser": True, "password": make_password(None)},
+        )
+        if created:
+            # A full favorites page, like a real user's.
+            Favorite.objects.bulk_create(
+                Favorite(user=user, photo=photo)
+                for photo in Photo.objects.order_by("-created_at")[:BENCH_FAVORITES]
+            )
+        return user
+
+    def cases(self):
+        """(budget name, method, url, JSON body) for every named pattern in gallery.urls, plus filtered variants."""
+        # Re-adding the bench user's own favorites: the full statement runs, nothing changes.
+        bulk = {
+            "action": "add",
+            "photos": [str(pk) for pk in self.user.favorites.values_list("photo_id", flat=True)[:BENCH_FAVORITES]],
+        }
+        tag = Tag.objects.filter(photos__isnull=False).order_by("id").first()
+        for pattern in urls.urlpatterns:
+            kwargs = {}
+            for arg in pattern.pattern.converters:
+                kwargs[arg] = {"album_id": self.album.pk, "photo_id": self.photo.pk}[arg]
+            url = reverse(pattern.name, kwargs=kwargs)
+            if pattern.name == "photo_browser_download" and tag:
+                url += f"?tags={tag.slug}"  # every photo is over GALLERY_DOWNLOAD_MAX_PHOTOS
+            method = "post" if pattern.name in POSTS else "get"
+            yield pattern.name, method, url, bulk if pattern.name == "api_favorites" else None
+
+        if tag:
+            yield "photo_browser?tags", "get", f"{reverse('photo_browser')}?tags={tag.slug}", None
+
+        yield "search?q", "get", f"{reverse('search')}?{urlencode({'q': 'seed photo'})}", None
+
+        yield from self.admin_cases()
+
+        # Opened from a grid: prev/next links in that grid's order.
+        detail = reverse("photo_detail", args=[self.photo.pk])
+        album = reverse("album_detail", args=[self.photo.album_id])
+        yield "photo_detail?next=album", "get", f"{detail}?{urlencode({'next': album})}", None
+        if tag:
+            browser = f"{reverse('photo_browser')}?tags={tag.slug}"
+            yield "photo_detail?next=tags", "get", f"{detail}?{urlencode({'next': browser})}", None
+
+    def admin_cases(self):
+        """Changelists and change forms for the tables that grow with the library."""
+        yield "admin:photo_changelist", "get", reverse("admin:gallery_photo_changelist"), None
+        query = urlencode({"q": self.photo.album.title})
+        yield "admin:photo_changelist?q", "get", f"{reverse('admin:gallery_photo_changelist')}?{query}", None
+        yield "admin:photo_change", "get", reverse("admin:gallery_photo_change", args=[self.photo.pk]), None
+        yield "admin:comment_changelist", "get", reverse("admin:gallery_comment_changelist"), None
+        comment = self.photo.comments.first()
+        if comment:
+            yield "admin:comment_change", "get", reverse("admin:gallery_comment_change", args=[comment.pk]), None
+
+    def make_cold(self):
+        """Invalidate everything the views cache, the way an edit would."""
+        stats.invalidate()
+        for name in ("catalog", "albums", f"comments:{self.photo.pk}", f"favorites:{self.user.pk}"):
+            versions.bump(name)
+
+    def fetch(self, method, url, data=None):
+        """The test client's response, with any streamed body read to the end."""
+        kwargs = {"data": data, "content_type": "application/json"} if data is not None else {}
+        response = getattr(self.client, method)(url, **kwargs)
+        if response.streaming:
+            b"".join(response.streaming_content)  # which closes it: downloads hold a slot until then
+        return response
+
+    def request(self, method, url, data=None):
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            response = self.fetch(method, url, data)
+            ms = (time.perf_counter() - start) * 1000
+        return response.status_code, len(ctx), ms
@@ -1,27 +1,76 @@
-from itertools import count
 from pathlib import Path
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+from gallery.management.commands.make_derivatives import (
+    RENDITION_FORMATS,
+    RENDITION_WIDTHS,
+    file_sha256,
+    image_summary,
+    rendition_stem,
+)
+from gallery import search, stats, versions
+from gallery.media import unversioned_stem
 from gallery.models import Album, Photo
+from gallery.tag_index import bump_version
 from urllib.parse import quote
 
+# Keep IN (...) lists under SQLite's bound-parameter limit.
+LOOKUP_CHUNK = 500
+
+# Photo fields that describe the files, copied as-is when --on-duplicate=link.
+FILE_FIELDS = ("image_web", "image_thumb", "renditions", "width", "height", "dominant_color", "placeholder")
+
 
 class Command(BaseCommand):
     help = "Import derived photos (web + thumbs) into a new album."
 
     def add_arguments(self, parser):
-        parser.add_argument("--title", required=True, help="Album title")
-        parser.add_argument("--web-dir", required=True, help="Path to Derived/web folder")
-        parser.add_argument("--thumb-dir", required=True, help="Path to Derived/thumbs folder")
-        parser.add_argument("--base-url", help="Base URL for web and thumbnail images (e.g. https://bucket.r2.dev)",)
-
+        parser.add_argument("--title", help="Album title")
+        parser.add_argument("--web-dir", help="Path to Derived/web folder")
+        parser.add_argument("--thumb-dir", help="Path to Derived/thumbs folder")
+        parser.add_argument(
+            "--renditions-dir",
+            help="Path to Derived/renditions folder (from make_derivatives); adds srcset widths",
+        )
+        parser.add_argument(
+            "--base-url",
+            help="Base URL for web and thumbnail images (e.g. https://bucket.r2.dev); upload them with publish_derivatives",
+        )
+        parser.add_argument("--batch-size", type=int, default=500, help="Photos per INSERT/transaction (default: 500)")
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Continue an interrupted import into the newest album with this title",
+        )
+        parser.add_argument(
+            "--on-duplicate",
+            choices=("skip", "link"),
+            default="skip",
+            help="For a photo already in the library: skip it, or link the existing files into this album",
+        )
+        parser.add_argument(
+            "--dedupe",
+            action="store_true",
+            help="Report photos that share a content hash across the whole library, then exit",
+        )
 
     def handle(self, *args, **options):
+        if options["dedupe"]:
+            return self.report_duplicates()
+
+        for required in ("title", "web_dir", "thumb_dir"):
+            if not options[required]:
+                raise CommandError(f"--{required.replace('_', '-')} is required")
+
         title = options["title"]
         web_dir = Path(options["web_dir"])
         thumb_dir = Path(options["thumb_dir"])
         base_url = options.get("base_url")
+        batch_size = options["batch_size"]
 
-
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1")
         if not web_dir.exists():
             raise CommandError(f"web-dir not found: {web_dir}")
         if not thumb_dir.exists():
@@ -31,33 +80,193 @@ class Command(BaseCommand):
         if not web_files:
             raise CommandError(f"No .jpg files found in: {web_dir}")
 
-        album = Album.objects.create(title=title)
-        created = 0
-        pairs = list(zip(web_files, thumb_dir.glob("*.jpg")))
-        count = 0
+        # One directory listing instead of a stat per photo (thumb-dir is often a network share).
+        thumb_names = {p.name for p in thumb_dir.glob("*.jpg")}
+        rendition_names = self.list_renditions(options["renditions_dir"])
+
+        album = None
+        already = []
+        if options["resume"]:
+            album = Album.objects.filter(title=title).order_by("-created_at").first()
+            if album:
+                already = list(album.photos.values_list("image_web", "content_hash"))
+                self.stdout.write(f"Resuming '{album.title}': {len(already)} photos already imported.")
+        # --on-duplicate=link rows carry the original's image_web, so only the
+        # content hash recognises them; the URL check just saves hashing the rest.
+        already_urls = {image_web for image_web, _ in already}
+        already_hashes = {content_hash for _, content_hash in already if content_hash}
+
+        rows = []
+        missing_thumb = 0
         for wf in web_files:
-            count += 1
-            if count % 5 == 0 or count == len(pairs):
-                print(f"Imported {count}/{len(pairs)}")
-            base = wf.stem
-            tf = thumb_dir / f"{base}.jpg"
-            if not tf.exists():
+            if wf.name not in thumb_names:
                 self.stdout.write(self.style.WARNING(f"Skipping {wf.name} (missing thumb)"))
+                missing_thumb += 1
+                continue
+
+            image_web = self.media_url(base_url, "web", wf.name)
+            image_thumb = self.media_url(base_url, "thumbs", wf.name)
+
+            if image_web in already_urls:
+                continue
+            content_hash = file_sha256(wf)
+            if content_hash in already_hashes:
+                continue
+            renditions = []
+            # Named rendition_stem(web stem); renditions from before that share the web file's stem.
+            candidates = [rendition_stem(wf.stem), wf.stem]
+            for (width, fmt), names in rendition_names.items():
+                name = next((n for n in (f"{stem}.{fmt}" for stem in candidates) if n in names), None)
+                if name:
+                    url = self.media_url(base_url, f"renditions/{width}", name)
+                    renditions.append({"w": width, "fmt": fmt, "url": url})
+            summary = image_summary(wf)
+            rows.append({
+                "stem": wf.stem,
+                "image_web": image_web,
+                "image_thumb": image_thumb,
+                "content_hash": content_hash,
+                "renditions": renditions,
+                "width": summary.width,
+                "height": summary.height,
+                "dominant_color": summary.color,
+                "placeholder": summary.placeholder,
+            })
+
+        found = len(rows)
+        rows = self.handle_duplicates(rows, options["on_duplicate"])
+        duplicates = found - len(rows)
+
+        created = 0
+        photo_ids = []
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            # Each batch commits on its own, so an interrupted run can be picked up with --resume.
+            with transaction.atomic():
+                if album is None:
+                    album = Album.objects.create(title=title)
+                photos = Photo.objects.bulk_create(
+                    Photo(
+                        album=album,
+                        title=unversioned_stem(row["stem"]).replace("_", " "),
+                        **{name: value for name, value in row.items() if name != "stem"},
+                    )
+                    for row in batch
+                )
+            photo_ids += [p.pk for p in photos]
+            created += len(batch)
+            self.stdout.write(f"Imported {created}/{len(rows)}")
+
+        if album is None:
+            if not duplicates:
+                raise CommandError("Nothing to import (every photo is missing its thumb).")
+            skipped = f", {missing_thumb} skipped for a missing thumb" if missing_thumb else ""
+            self.stdout.write(self.style.SUCCESS(
+                f"Nothing to import: {duplicates} photo(s) are already in the library{skipped}."
+            ))
+            return
+
+        if created:
+            # bulk_create sends no post_save: refresh the album's counters, the
+            # home stats and the search documents here, and tell running sites
+            # to rebuild their tag index.
+            Album.objects.filter(pk=album.pk).refresh_counters()
+            search.reindex(photo_ids)
+            stats.invalidate()
+            versions.bump("catalog")
+            bump_version()
+
+        if already:
+            self.stdout.write(self.style.SUCCESS(
+                f"Resumed album '{album.title}': added {created}, now {len(already) + created} photos."
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Created album '{album.title}' with {created} photos."))
+
+    def handle_duplicates(self, rows, on_duplicate):
+        """
+        Drop (or re-point) rows whose content is already in the library or
+        earlier in this same import.
+        """
+        hashes = [row["content_hash"] for row in rows]
+        existing = {}
+        for start in range(0, len(hashes), LOOKUP_CHUNK):
+            chunk = hashes[start:start + LOOKUP_CHUNK]
+            for photo in (
+                Photo.objects.filter(content_hash__in=chunk)
+                .select_related("album")
+                .order_by("created_at")
+            ):
+                existing.setdefault(photo.content_hash, photo)
+
+        kept = []
+        seen = {}
+        for row in rows:
+            base, content_hash = row["stem"], row["content_hash"]
+            original = existing.get(content_hash)
+            if original:
+                where = f"'{original.album.title}' ({original})"
+                if on_duplicate == "link":
+                    self.stdout.write(f"Linking {base} to existing files from {where}")
+                    row.update({name: getattr(original, name) for name in FILE_FIELDS})
+                    kept.append(row)
+                else:
+                    self.stdout.write(self.style.WARNING(f"Skipping {base} (duplicate of {where})"))
+                continue
+            if content_hash in seen:
+                self.stdout.write(self.style.WARNING(f"Skipping {base} (same image as {seen[content_hash]})"))
                 continue
+            seen[content_hash] = base
+            kept.append(row)
+        return kept
+
+    def media_url(self, base_url, folder, name):
+        if base_url:
+            return f"{base_url}/{folder}/{quote(name)}"
+        return f"/media/{folder}/{name}"
+
+    def list_renditions(self, renditions_dir):
+        """{(width, fmt): {file names}}, one listing per width folder."""
+        if not renditions_dir:
+            return {}
+        renditions_dir = Path(renditions_dir)
+        if not renditions_dir.exists():
+            raise CommandError(f"renditions-dir not found: {renditions_dir}")
+        found = {}
+        for width in RENDITION_WIDTHS:
+            names = {p.name for p in (renditions_dir / str(width)).glob("*")}
+            for fmt in RENDITION_FORMATS:
+                found[(width, fmt)] = {n for n in names if n.endswith(f".{fmt}")}
+        return found
+
+    def report_duplicates(self):
+        dupes = (
+            Photo.objects.exclude(content_hash="")
+            .values("content_hash")
+            .annotate(n=Count("id"))
+            .filter(n__gt=1)
+            .order_by("-n")
+        )
+        groups = {row["content_hash"]: row["n"] for row in dupes}
+        unhashed = Photo.objects.filter(content_hash="").count()
+
+        by_hash = {}
+        hashes = list(groups)
+        for start in range(0, len(hashes), LOOKUP_CHUNK):
+            for photo in (
+                Photo.objects.filter(content_hash__in=hashes[start:start + LOOKUP_CHUNK])
+                .select_related("album")
+                .order_by("created_at")
+            ):
+                by_hash.setdefault(photo.content_hash, []).append(photo)
+
+        for content_hash, n in groups.items():
+            self.stdout.write(f"{content_hash[:12]}  {n} copies")
+            for photo in by_hash.get(content_hash, []):
+                self.stdout.write(f"    {photo.album.title} / {photo} ({photo.id}) {photo.image_web}")
 
-            if base_url:
-                encoded = quote(wf.name)
-                image_web = f"{base_url}/web/{encoded}"
-                image_thumb = f"{base_url}/thumbs/{encoded}"
-            else:
-                image_web = f"/media/web/{wf.name}"
-                image_thumb = f"/media/thumbs/{tf.name}"    
-            Photo.objects.create(
-                album=album,
-                title=base.replace("_", " "),
-                image_web=image_web,
-                image_thumb=image_thumb,)
-
-            created += 1
-
-        self.stdout.write(self.style.SUCCESS(f"Created album '{album.title}' with {created} photos."))
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(groups)} duplicated image(s), {sum(groups.values()) - len(groups)} extra copies."
+        ))
+        if unhashed:
+            self.stdout.write(f"{unhashed} photo(s) have no content hash yet and were not compared.")
@@ -1,40 +1,261 @@
 from __future__ import annotations
 
+import base64
+import hashlib
+import sqlite3
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+from io import BytesIO
 from pathlib import Path
 from shutil import copy2
-from PIL import Image, ImageOps
+from typing import BinaryIO, NamedTuple
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import ExifTags, Image
+
+from gallery.media import versioned_stem
 
 # ----- Settings you can tweak -----
 WEB_MAX_W = 1600
 THUMB_MAX_W = 400
 JPEG_QUALITY = 85
 
+# Responsive renditions for srcset: every width in every format, from one decode.
+RENDITION_WIDTHS = (200, 400, 800, 1600)
+RENDITION_FORMATS = ("jpg", "webp")
+WEBP_QUALITY = 80
+
+# Inline placeholder painted behind each tile until the real image arrives.
+PLACEHOLDER_W = 16
+PLACEHOLDER_QUALITY = 40
+
 SUPPORTED_INPUT_EXTS = {".png", ".jpg", ".jpeg", ".tif", ".tiff", ".webp"}
 
-BATCH_NAME = "batch_011"  # Change this for each new batch
+MANIFEST_NAME = "derivatives.sqlite3"
+HASH_CHUNK = 1024 * 1024
+
+# Modes Pillow can LANCZOS-resize directly, so conversion can wait for the small image.
+RESIZABLE_MODES = {"RGB", "L", "RGBA", "LA"}
+
+# EXIF orientation -> transpose that makes the image display upright.
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+class ImageSummary(NamedTuple):
+    width: int
+    height: int
+    color: str        # "#rrggbb"
+    placeholder: str  # data: URI of a PLACEHOLDER_W px JPEG
+
+
+class FileResult(NamedTuple):
+    name: str
+    ok: bool
+    detail: str
+    digest: str = ""
+    renditions: tuple[str, ...] = ()  # "<width>/<file name>" under the renditions folder
+
+
+def web_params() -> tuple[int, int, int]:
+    """The settings web and thumb files depend on, and nothing else."""
+    return (WEB_MAX_W, THUMB_MAX_W, JPEG_QUALITY)
+
 
+def rendition_params() -> str:
+    widths = ",".join(str(w) for w in RENDITION_WIDTHS)
+    return f"{widths}:{','.join(RENDITION_FORMATS)}:q{JPEG_QUALITY}/{WEBP_QUALITY}"
 
-def save_jpeg_resized(src_path: Path, dst_path: Path, max_width: int) -> None:
+
+def current_params(with_renditions: bool = True) -> tuple[int, int, int, str]:
+    """Everything a manifest row was built with."""
+    return (*web_params(), rendition_params() if with_renditions else "")
+
+
+def output_stem(src: Path, digest: str) -> str:
+    """Name (without extension) of src's web and thumb files: IMG_0001.3f9a2b7c1d4e (see gallery.media)."""
+    return versioned_stem(src.stem, digest, web_params())
+
+
+def rendition_stem(web_stem: str) -> str:
     """
-    Open image, normalize orientation, convert to RGB,
-    resize to max_width preserving aspect ratio (never upscale),
-    and save as JPEG.
+    Name (without extension) of the renditions that go with a web file:
+    IMG_0001.3f9a2b7c1d4e.8c0d5e6f7a8b. Their own token covers the rendition
+    settings, so changing those (or --no-renditions) never renames web and
+    thumb files; the web stem already carries the source's content hash.
     """
-    with Image.open(src_path) as im:
-        im = ImageOps.exif_transpose(im)
+    return versioned_stem(web_stem, web_stem, rendition_params())
+
+
+def file_sha256(path: Path) -> str:
+    """Hash a file in fixed-size chunks so memory stays flat on big scans."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class DerivativeManifest:
+    """
+    SQLite record of what each source looked like the last time its
+    derivatives were built, and with which settings.
+
+    A source whose size, mtime and parameters all match, and whose web,
+    thumb and rendition files are all still there, is skipped without being
+    opened. When only the stat changed (copied, touched) the content hash
+    decides whether a re-encode is really needed.
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS derivatives (
+                source TEXT PRIMARY KEY,
+                folder TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                sha256 TEXT NOT NULL,
+                web_max_w INTEGER NOT NULL,
+                thumb_max_w INTEGER NOT NULL,
+                jpeg_quality INTEGER NOT NULL,
+                renditions TEXT NOT NULL DEFAULT '',
+                web_path TEXT NOT NULL,
+                thumb_path TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                rendition_files TEXT
+            )
+            """
+        )
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(derivatives)")}
+        if "renditions" not in columns:
+            # Manifests written before renditions existed.
+            self.conn.execute("ALTER TABLE derivatives ADD COLUMN renditions TEXT NOT NULL DEFAULT ''")
+        if "rendition_files" not in columns:
+            # NULL: written before rendition files were recorded, so not known to exist.
+            self.conn.execute("ALTER TABLE derivatives ADD COLUMN rendition_files TEXT")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS derivatives_folder ON derivatives (folder)")
+        self.conn.commit()
+        self._dirty = 0
+
+    def rows_under(self, folder: Path) -> dict[str, tuple]:
+        """
+        Manifest rows for sources directly inside folder, keyed by source
+        path: (size, mtime, sha256, *params, rendition files or None).
+        """
+        cur = self.conn.execute(
+            "SELECT source, size, mtime, sha256, web_max_w, thumb_max_w, jpeg_quality, renditions, "
+            "rendition_files FROM derivatives WHERE folder = ?",
+            (str(folder.resolve()),),
+        )
+        return {
+            row[0]: (*row[1:-1], None if row[-1] is None else tuple(filter(None, row[-1].split("\n"))))
+            for row in cur
+        }
+
+    def record(
+        self, src: Path, st, digest: str, params: tuple, web_out: Path, thumb_out: Path, renditions: tuple[str, ...]
+    ) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO derivatives (source, folder, size, mtime, sha256, web_max_w, "
+            "thumb_max_w, jpeg_quality, renditions, web_path, thumb_path, updated_at, rendition_files) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                str(src.resolve()),
+                str(src.resolve().parent),
+                st.st_size,
+                st.st_mtime,
+                digest,
+                *params,
+                str(web_out),
+                str(thumb_out),
+                datetime.now(timezone.utc).isoformat(),
+                "\n".join(renditions),
+            ),
+        )
+        self._dirty += 1
+        # Commit in small batches so an interrupted run keeps most of its progress.
+        if self._dirty >= 100:
+            self.commit()
+
+    def commit(self) -> None:
+        self.conn.commit()
+        self._dirty = 0
+
+    def close(self) -> None:
+        self.commit()
+        self.conn.close()
+
+
+def _upright_resized(im: Image.Image, max_width: int, max_pixels: int | None = None) -> Image.Image:
+    """
+    Normalize orientation, convert to RGB (or L), and resize to max_width
+    preserving aspect ratio (never upscale).
 
-        if im.mode not in ("RGB", "L"):
-            im = im.convert("RGB")
+    Works on as small an image as the output allows: JPEGs are decoded at
+    a reduced DCT scale (draft mode), other formats get an integer reduce()
+    before the LANCZOS pass, and rotation/conversion happen after the
+    resize so no extra full-resolution copies are made.
+    """
+    w, h = im.size
+    if max_pixels and w * h > max_pixels:
+        raise ValueError(f"{w}x{h} is over the {max_pixels:,} pixel budget")
 
+    if im.format == "TIFF":
+        # Pillow's TIFF loader applies the orientation itself while decoding, and
+        # TIFF has no reduced-scale decode anyway: load now and use the upright size.
+        im.load()
         w, h = im.size
+        orientation = 1
+    else:
+        orientation = im.getexif().get(ExifTags.Base.Orientation, 1)
+    swap = orientation in (5, 6, 7, 8)
+    shown_w, shown_h = (h, w) if swap else (w, h)
+
+    target = None
+    if shown_w > max_width:
+        new_w = max_width
+        new_h = round(shown_h * (new_w / shown_w))
+        # Target size in the stored (un-rotated) orientation.
+        target = (new_h, new_w) if swap else (new_w, new_h)
+
+    if target and im.format == "JPEG":
+        # Keep 2x headroom over the target so LANCZOS still has detail to work with.
+        im.draft(im.mode if im.mode in ("RGB", "L") else None, (target[0] * 2, target[1] * 2))
+
+    if im.mode not in RESIZABLE_MODES:
+        im = im.convert("RGB")
+
+    if target:
+        im = im.resize(target, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+    if im.mode not in ("RGB", "L"):
+        im = im.convert("RGB")
 
-        if w > max_width:
-            new_w = max_width
-            new_h = round(h * (new_w / w))
-            im = im.resize((new_w, new_h), Image.Resampling.LANCZOS)
+    if orientation in ORIENTATION_TRANSPOSE:
+        im = im.transpose(ORIENTATION_TRANSPOSE[orientation])
 
-        dst_path.parent.mkdir(parents=True, exist_ok=True)
+    return im
 
+
+def _save(im: Image.Image, dst_path: Path, fmt: str) -> None:
+    dst_path.parent.mkdir(parents=True, exist_ok=True)
+    if fmt == "webp":
+        im.save(dst_path, format="WEBP", quality=WEBP_QUALITY, method=4)
+    else:
         im.save(
             dst_path,
             format="JPEG",
@@ -44,6 +265,74 @@ def save_jpeg_resized(src_path: Path, dst_path: Path, max_width: int) -> None:
         )
 
 
+def save_jpeg_resized(src_path: Path, dst_path: Path, max_width: int, max_pixels: int | None = None) -> None:
+    """
+    Open image, normalize orientation, convert to RGB,
+    resize to max_width preserving aspect ratio (never upscale),
+    and save as JPEG.
+    """
+    with Image.open(src_path) as im:
+        _save(_upright_resized(im, max_width, max_pixels), dst_path, "jpg")
+
+
+def rendition_path(renditions_dir: Path, width: int, stem: str, fmt: str) -> Path:
+    return renditions_dir / str(width) / f"{stem}.{fmt}"
+
+
+def save_renditions(
+    src_path: Path, renditions_dir: Path, max_pixels: int | None = None, stem: str | None = None
+) -> list[Path]:
+    """
+    Write every RENDITION_WIDTHS x RENDITION_FORMATS file for one source,
+    decoding it only once (at the largest width) and scaling down from
+    there. Widths above the source width are skipped. Files are named
+    stem (default: the source's). Returns the files written.
+    """
+    stem = stem or src_path.stem
+    with Image.open(src_path) as im:
+        base = _upright_resized(im, max(RENDITION_WIDTHS), max_pixels)
+
+    written = []
+    for width in sorted(RENDITION_WIDTHS, reverse=True):
+        if width > base.width:
+            continue
+        if width < base.width:
+            sized = base.resize((width, round(base.height * width / base.width)), Image.Resampling.LANCZOS)
+        else:
+            sized = base
+        for fmt in RENDITION_FORMATS:
+            path = rendition_path(renditions_dir, width, stem, fmt)
+            _save(sized, path, fmt)
+            written.append(path)
+    return written
+
+
+def image_summary(path: Path | BinaryIO) -> ImageSummary:
+    """
+    Upright display size, dominant color and a tiny inline JPEG for one
+    image. JPEGs are decoded at 1/8 scale, so this costs far less than
+    opening the image at full size.
+    """
+    with Image.open(path) as im:
+        if im.format == "TIFF":
+            im.load()  # applies the orientation itself, see _upright_resized
+            w, h = im.size
+        else:
+            w, h = im.size
+            if im.getexif().get(ExifTags.Base.Orientation, 1) in (5, 6, 7, 8):
+                w, h = h, w
+        small = _upright_resized(im, PLACEHOLDER_W).convert("RGB")
+
+    palette = small.quantize(colors=4)
+    _, index = max(palette.getcolors())
+    r, g, b = palette.getpalette()[index * 3:index * 3 + 3]
+
+    buf = BytesIO()
+    small.save(buf, format="JPEG", quality=PLACEHOLDER_QUALITY, optimize=True)
+    data = base64.b64encode(buf.getvalue()).decode("ascii")
+    return ImageSummary(w, h, f"#{r:02x}{g:02x}{b:02x}", f"data:image/jpeg;base64,{data}")
+
+
 def copy_original_to_web(src_path: Path, dst_path: Path) -> None:
     """
     Copy JPG/JPEG originals directly to web output to avoid any extra JPEG recompression.
@@ -52,50 +341,290 @@ def copy_original_to_web(src_path: Path, dst_path: Path) -> None:
     copy2(src_path, dst_path)
 
 
-def main() -> None:
-    # CHANGE THESE PATHS to match your machine/NAS mapping
-    input_dir = Path(rf"Z:\FamilyPhotos\Originals\{BATCH_NAME}")
-    out_web_dir = Path(r"Z:\FamilyPhotos\Derived\web")
-    out_thumb_dir = Path(r"Z:\FamilyPhotos\Derived\thumbs")
+def process_file(
+    src: Path,
+    out_web_dir: Path,
+    out_thumb_dir: Path,
+    known_digest: str | None = None,
+    max_pixels: int | None = None,
+    renditions_dir: Path | None = None,
+    known_renditions: tuple[str, ...] = (),
+) -> FileResult:
+    """
+    Build the web + thumb derivatives (and srcset renditions, if a
+    renditions_dir is given) for one source file. All are named
+    output_stem() (renditions rendition_stem()), so a changed source or
+    setting never overwrites a file a browser may have cached, and a file
+    already there under its name is never rebuilt.
 
-    if not input_dir.exists():
-        raise SystemExit(f"Input folder not found: {input_dir}")
+    If known_digest is given (the manifest hash for unchanged parameters)
+    and the content still matches, the existing outputs are kept, provided
+    the web and thumb files and every rendition in known_renditions (the
+    manifest's list) are still there.
 
-    files = [
-        p for p in input_dir.iterdir()
-        if p.is_file() and p.suffix.lower() in SUPPORTED_INPUT_EXTS
-    ]
-    files.sort()
+    Runs inside a worker process, so it never raises: any error is
+    returned as a failed FileResult and the rest of the batch carries on.
+    """
+    try:
+        digest = file_sha256(src)
+        stem = output_stem(src, digest)
+        web_out = out_web_dir / f"{stem}.jpg"
+        thumb_out = out_thumb_dir / f"{stem}.jpg"
+        renditions_there = renditions_dir is None or all((renditions_dir / r).exists() for r in known_renditions)
+        if digest == known_digest and web_out.exists() and thumb_out.exists() and renditions_there:
+            return FileResult(src.name, True, "unchanged (hash match)", digest, known_renditions)
 
-    if not files:
-        raise SystemExit(f"No images found in: {input_dir}")
+        extra = ""
+        renditions = ()
+        if renditions_dir is not None:
+            written = save_renditions(src, renditions_dir, max_pixels, rendition_stem(stem))
+            renditions = tuple(path.relative_to(renditions_dir).as_posix() for path in written)
+            extra = f" + {len(renditions)} renditions"
 
-    print(f"Found {len(files)} images in {input_dir}")
+        if web_out.exists() and thumb_out.exists():
+            # Same content, same settings: only the renditions (or the manifest) were behind.
+            return FileResult(src.name, True, "web + thumb kept" + extra, digest, renditions)
+
+        if src.suffix.lower() in {".jpg", ".jpeg"}:
+            # Web: copy original JPG bytes (no re-encode)
+            copy_original_to_web(src, web_out)
+            # Thumbs: generate resized JPEG (single re-encode)
+            save_jpeg_resized(src, thumb_out, THUMB_MAX_W, max_pixels)
+            return FileResult(src.name, True, "web(COPY) + thumb(ENCODE)" + extra, digest, renditions)
+
+        # Non-JPG: generate web + thumb JPEGs from source
+        save_jpeg_resized(src, web_out, WEB_MAX_W, max_pixels)
+        save_jpeg_resized(src, thumb_out, THUMB_MAX_W, max_pixels)
+        return FileResult(src.name, True, "web + thumb" + extra, digest, renditions)
+    except MemoryError:
+        return FileResult(src.name, False, "out of memory (over the worker memory budget)")
+    except Exception as e:
+        return FileResult(src.name, False, str(e))
+
+
+def limit_worker_memory(max_memory_mb: int | None) -> None:
+    """
+    Pool initializer: cap the worker's address space so an oversized scan
+    fails with MemoryError in that worker instead of waking the OOM killer.
+    No-op where the resource module is unavailable (Windows).
+    """
+    if not max_memory_mb:
+        return
+    try:
+        import resource
+    except ImportError:
+        return
+    limit = max_memory_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
 
-    for i, src in enumerate(files, start=1):
-        base_name = src.stem
-        ext = src.suffix.lower()
 
-        web_out = out_web_dir / f"{base_name}.jpg"
-        thumb_out = out_thumb_dir / f"{base_name}.jpg"
+class Command(BaseCommand):
+    help = "Generate web + thumbnail JPEGs and srcset renditions for a folder of originals."
 
+    def add_arguments(self, parser):
+        parser.add_argument("--input-dir", required=True, help="Folder of originals (e.g. Originals/batch_011)")
+        parser.add_argument("--web-dir", help="Output folder for web images (default: MEDIA_ROOT/web)")
+        parser.add_argument("--thumb-dir", help="Output folder for thumbnails (default: MEDIA_ROOT/thumbs)")
+        parser.add_argument("--workers", type=int, default=1, help="Worker processes (default: 1, no pool)")
+        parser.add_argument(
+            "--max-in-flight",
+            type=int,
+            help="Files queued to the pool at once (default: 2 x workers)",
+        )
+        parser.add_argument(
+            "--manifest",
+            help=f"Manifest database (default: {MANIFEST_NAME} next to the web folder)",
+        )
+        parser.add_argument("--force", action="store_true", help="Rebuild every file, ignoring the manifest")
+        parser.add_argument(
+            "--max-pixels",
+            type=int,
+            help="Refuse sources larger than this many pixels (e.g. 100000000)",
+        )
+        parser.add_argument(
+            "--max-memory-mb",
+            type=int,
+            help="Address-space limit per worker process (Linux/macOS; forces pool mode)",
+        )
+        parser.add_argument(
+            "--renditions-dir",
+            help="Output folder for srcset renditions (default: MEDIA_ROOT/renditions)",
+        )
+        parser.add_argument("--no-renditions", action="store_true", help="Only build web + thumb")
+
+    def handle(self, *args, **options):
+        input_dir = Path(options["input_dir"])
+        media_root = Path(settings.MEDIA_ROOT)
+        out_web_dir = Path(options["web_dir"] or media_root / "web")
+        out_thumb_dir = Path(options["thumb_dir"] or media_root / "thumbs")
+        renditions_dir = None
+        if not options["no_renditions"]:
+            renditions_dir = Path(options["renditions_dir"] or media_root / "renditions")
+        workers = options["workers"]
+        max_in_flight = options["max_in_flight"] or workers * 2
+
+        if workers < 1:
+            raise CommandError("--workers must be at least 1")
+        if max_in_flight < workers:
+            raise CommandError("--max-in-flight must be at least --workers")
+        if not input_dir.exists():
+            raise CommandError(f"Input folder not found: {input_dir}")
+
+        files = sorted(
+            p for p in input_dir.iterdir()
+            if p.is_file() and p.suffix.lower() in SUPPORTED_INPUT_EXTS
+        )
+        if not files:
+            raise CommandError(f"No images found in: {input_dir}")
+
+        manifest = DerivativeManifest(Path(options["manifest"] or out_web_dir.parent / MANIFEST_NAME))
         try:
-            if ext in {".jpg", ".jpeg"}:
-                # Web: copy original JPG bytes (no re-encode)
-                copy_original_to_web(src, web_out)
-                # Thumbs: generate resized JPEG (single re-encode)
-                save_jpeg_resized(src, thumb_out, THUMB_MAX_W)
-                print(f"[{i:03}] OK  {src.name} -> web(COPY) + thumb(ENCODE)")
+            job = {
+                "out_web_dir": out_web_dir,
+                "out_thumb_dir": out_thumb_dir,
+                "max_pixels": options["max_pixels"],
+                "renditions_dir": renditions_dir,
+            }
+            self._build(files, input_dir, job, workers, max_in_flight, manifest, options)
+        finally:
+            manifest.close()
+
+    def _build(self, files, input_dir, job, workers, max_in_flight, manifest, options):
+        """job: the keyword arguments every process_file call shares."""
+        force = options["force"]
+        max_memory_mb = options["max_memory_mb"]
+        out_web_dir, out_thumb_dir = job["out_web_dir"], job["out_thumb_dir"]
+        with_renditions = job["renditions_dir"] is not None
+        params = current_params(with_renditions)
+        known = {} if force else manifest.rows_under(input_dir)
+        # One listing per output folder instead of two stats per source.
+        web_names = {p.name for p in out_web_dir.iterdir()} if out_web_dir.exists() else set()
+        thumb_names = {p.name for p in out_thumb_dir.iterdir()} if out_thumb_dir.exists() else set()
+        rendition_files = set()
+        if with_renditions:
+            for width in RENDITION_WIDTHS:
+                folder = job["renditions_dir"] / str(width)
+                if folder.exists():
+                    rendition_files |= {f"{width}/{p.name}" for p in folder.iterdir()}
+
+        todo = []
+        stats = {}
+        up_to_date = 0
+        for src in files:
+            st = src.stat()
+            stats[src] = st
+            row = known.get(str(src.resolve()))
+            if row is None:
+                todo.append((src, None, ()))
+                continue
+            size, mtime, digest, *params_used, renditions = row
+            out_name = f"{output_stem(src, digest)}.jpg"
+            outputs_there = (
+                out_name in web_names
+                and out_name in thumb_names
+                and (not with_renditions or renditions is not None and rendition_files.issuperset(renditions))
+            )
+            if tuple(params_used) != params or not outputs_there:
+                todo.append((src, None, ()))
+            elif size == st.st_size and mtime == st.st_mtime:
+                up_to_date += 1
             else:
-                # Non-JPG: generate web + thumb JPEGs from source (same as before)
-                save_jpeg_resized(src, web_out, WEB_MAX_W)
-                save_jpeg_resized(src, thumb_out, THUMB_MAX_W)
-                print(f"[{i:03}] OK  {src.name} -> web + thumb")
-        except Exception as e:
-            print(f"[{i:03}] FAIL {src.name}: {e}")
+                todo.append((src, digest, renditions or ()))
 
-    print("Done.")
+        self.stdout.write(
+            f"Found {len(files)} images in {input_dir}: "
+            f"{up_to_date} up to date, {len(todo)} to check/build ({workers} worker(s))"
+        )
+
+        if workers == 1 and not max_memory_mb:
+            results = self._run_serial(todo, job)
+        else:
+            # The memory cap is applied per worker process, never to this one.
+            results = self._run_pool(todo, job, workers, max_in_flight, max_memory_mb)
+
+        failed = []
+        for i, ((src, *_), result) in enumerate(zip(todo, results), start=1):
+            if result.ok:
+                stem = output_stem(src, result.digest)
+                manifest.record(
+                    src,
+                    stats[src],
+                    result.digest,
+                    params,
+                    out_web_dir / f"{stem}.jpg",
+                    out_thumb_dir / f"{stem}.jpg",
+                    result.renditions,
+                )
+                self.stdout.write(f"[{i:03}] OK  {result.name} -> {result.detail}")
+            else:
+                failed.append(result)
+                self.stdout.write(self.style.WARNING(f"[{i:03}] FAIL {result.name}: {result.detail}"))
+
+        built = len(todo) - len(failed)
+        self.stdout.write(self.style.SUCCESS(
+            f"Done. {up_to_date} skipped, {built} OK, {len(failed)} failed."
+        ))
+        for result in failed:
+            self.stdout.write(f"  failed: {result.name}: {result.detail}")
+
+        present = {str(src.resolve()) for src in files}
+        orphans = sorted(source for source in known if source not in present)
+        if orphans:
+            self.stdout.write(self.style.WARNING(
+                f"{len(orphans)} derivative(s) in the manifest have no source in {input_dir} any more:"
+            ))
+            for source in orphans:
+                self.stdout.write(f"  orphan: {Path(source).name}")
+
+    def _run_serial(self, todo, job):
+        for src, digest, renditions in todo:
+            yield process_file(src, known_digest=digest, known_renditions=renditions, **job)
+
+    def _run_pool(self, todo, job, workers, max_in_flight, max_memory_mb):
+        """
+        Feed the pool at most max_in_flight files at a time and yield results
+        in input order, so progress output reads the same as a serial run.
+        """
+        pending = deque()
+        todo = iter(todo)
+
+        def new_pool():
+            return ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=limit_worker_memory,
+                initargs=(max_memory_mb,),
+            )
+
+        pool = new_pool()
+
+        def submit(item):
+            src, digest, renditions = item
+            future = pool.submit(process_file, src, known_digest=digest, known_renditions=renditions, **job)
+            pending.append((item, future))
+
+        try:
+            for item in todo:
+                submit(item)
+                if len(pending) >= max_in_flight:
+                    break
 
+            while pending:
+                item, future = pending.popleft()
+                try:
+                    yield future.result()
+                except BrokenProcessPool as e:
+                    # A worker died outright (e.g. OOM killer). Blame the oldest file,
+                    # then requeue everything else that was in flight on a fresh pool.
+                    yield FileResult(item[0].name, False, f"worker died: {e}")
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = new_pool()
+                    requeue = [queued for queued, _ in pending]
+                    pending.clear()
+                    for queued in requeue:
+                        submit(queued)
 
-if __name__ == "__main__":
-    main()
+                nxt = next(todo, None)
+                if nxt is not None:
+                    submit(nxt)
+        finally:
+            pool.shutdown(cancel_futures=True)
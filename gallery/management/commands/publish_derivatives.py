@@ -0,0 +1,129 @@
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from gallery.publish import FAILED, PART_SIZE, RETRIES, SKIPPED, LocalStore, Publisher, S3Store, derivative_uploads
+
+# Progress line every this many files.
+REPORT_EVERY = 500
+
+
+class Command(BaseCommand):
+    help = (
+        "Upload web, thumb and rendition derivatives to the bucket import_photos --base-url serves from, "
+        "skipping objects whose ETag already matches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--web-dir", help="Folder of web images (default: MEDIA_ROOT/web)")
+        parser.add_argument("--thumb-dir", help="Folder of thumbnails (default: MEDIA_ROOT/thumbs)")
+        parser.add_argument("--renditions-dir", help="Folder of srcset renditions (default: MEDIA_ROOT/renditions)")
+        parser.add_argument("--no-renditions", action="store_true", help="Only publish web + thumb")
+        parser.add_argument("--bucket", default=settings.GALLERY_PUBLISH_BUCKET, help="Bucket name")
+        parser.add_argument(
+            "--endpoint-url",
+            default=settings.GALLERY_PUBLISH_ENDPOINT_URL,
+            help="S3 API endpoint (e.g. https://<account>.r2.cloudflarestorage.com); credentials come from AWS_* env vars",
+        )
+        parser.add_argument("--prefix", default="", help="Key prefix inside the bucket (e.g. family/)")
+        parser.add_argument(
+            "--local-store",
+            help="Publish into this folder instead of a bucket (a stand-in with the same ETag rules)",
+        )
+        parser.add_argument(
+            "--local-latency-ms", type=float, default=0,
+            help="With --local-store: delay every request by this much, like a real link",
+        )
+        parser.add_argument(
+            "--local-fail-rate", type=float, default=0,
+            help="With --local-store: fail this fraction of requests (0-1), to exercise retries",
+        )
+        parser.add_argument("--workers", type=int, default=16, help="Uploads in flight at once (default: 16)")
+        parser.add_argument(
+            "--part-size-mb", type=int, default=PART_SIZE // (1024 * 1024),
+            help=(
+                "Files larger than this go up as multipart uploads of this part size "
+                "(default: 8; minimum: 5, or 1 with --local-store)"
+            ),
+        )
+        parser.add_argument("--retries", type=int, default=RETRIES, help=f"Retries per request (default: {RETRIES})")
+        parser.add_argument("--dry-run", action="store_true", help="Report what would be uploaded; upload nothing")
+
+    def handle(self, *args, **options):
+        workers = options["workers"]
+        if workers < 1:
+            raise CommandError("--workers must be at least 1")
+        if options["retries"] < 0:
+            raise CommandError("--retries can't be negative")
+        part_size = options["part_size_mb"] * 1024 * 1024
+        # S3 and R2 reject parts under 5 MB (except the last); the stand-in doesn't care.
+        min_part_size_mb = 1 if options["local_store"] else 5
+        if options["part_size_mb"] < min_part_size_mb:
+            raise CommandError(f"--part-size-mb must be at least {min_part_size_mb}")
+
+        media_root = Path(settings.MEDIA_ROOT)
+        web_dir = Path(options["web_dir"] or media_root / "web")
+        thumb_dir = Path(options["thumb_dir"] or media_root / "thumbs")
+        renditions_dir = None
+        if not options["no_renditions"]:
+            renditions_dir = Path(options["renditions_dir"] or media_root / "renditions")
+        for folder in (web_dir, thumb_dir):
+            if not folder.is_dir():
+                raise CommandError(f"Folder not found: {folder}")
+
+        if options["local_store"]:
+            store = LocalStore(
+                options["local_store"],
+                latency=options["local_latency_ms"] / 1000,
+                fail_rate=options["local_fail_rate"],
+            )
+            target = options["local_store"]
+        elif options["bucket"]:
+            try:
+                store = S3Store(options["bucket"], options["endpoint_url"], max_connections=workers)
+            except ImproperlyConfigured as exc:
+                raise CommandError(str(exc))
+            target = f"bucket {options['bucket']}"
+        else:
+            raise CommandError("Give --bucket (or GALLERY_PUBLISH_BUCKET) or --local-store")
+
+        prefix = options["prefix"]
+        uploads = derivative_uploads(web_dir, thumb_dir, renditions_dir, prefix)
+        if not uploads:
+            raise CommandError(f"No files found in {web_dir} or {thumb_dir}")
+
+        publisher = Publisher(store, workers=workers, part_size=part_size, retries=options["retries"])
+        try:
+            remote = publisher.remote_etags(prefix)
+        except Exception as exc:
+            raise CommandError(f"Could not list {target}: {exc}")
+        self.stdout.write(
+            f"Publishing {len(uploads)} files to {target} ({len(remote)} objects there already, {workers} workers)"
+        )
+
+        started = time.monotonic()
+        counts = {}
+        sent = 0
+        failed = []
+        for i, result in enumerate(publisher.run(uploads, remote, dry_run=options["dry_run"]), start=1):
+            counts[result.outcome] = counts.get(result.outcome, 0) + 1
+            if result.outcome == FAILED:
+                failed.append(result)
+                self.stdout.write(self.style.WARNING(f"FAIL {result.upload.key}: {result.detail}"))
+            elif result.outcome != SKIPPED:
+                sent += result.size
+            if i % REPORT_EVERY == 0:
+                self.stdout.write(f"  {i}/{len(uploads)} done, {sent / 1e6:.1f} MB sent")
+
+        elapsed = max(time.monotonic() - started, 1e-6)
+        verb = "would upload" if options["dry_run"] else "uploaded"
+        self.stdout.write(self.style.SUCCESS(
+            f"Done in {elapsed:.1f}s. {counts.get('uploaded', 0)} {verb} ({sent / 1e6:.1f} MB, "
+            f"{sent / 1e6 / elapsed:.1f} MB/s), {counts.get('skipped', 0)} unchanged, "
+            f"{len(failed)} failed, {publisher.retried} request(s) retried."
+        ))
+        if failed:
+            raise CommandError(f"{len(failed)} file(s) could not be published; run again to retry them.")
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from gallery import versions
+from gallery.models import Album
+
+
+class Command(BaseCommand):
+    help = "Recompute every album's photo_count and cover_thumb from the photos table."
+
+    def handle(self, *args, **options):
+        updated = Album.objects.refresh_counters()
+        versions.bump("albums")
+        self.stdout.write(self.style.SUCCESS(f"Refreshed counters for {updated} albums."))
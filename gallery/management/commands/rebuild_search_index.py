@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from gallery import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild every photo's full-text search document (see gallery.search)."
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {count} photos for search ({connection.vendor}) in {time.perf_counter() - started:.1f}s."
+        ))
@@ -0,0 +1,99 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from gallery.media import media_path
+from gallery.models import Album, Photo
+from gallery.pagination import PHOTOS_PER_PAGE
+
+# Fraction of the viewport a grid tile takes at each breakpoint (mirrors views.GRID_SIZES).
+GRID_COLUMNS = ((900, 4), (640, 3), (0, 2))
+
+
+def tile_width(viewport):
+    for min_width, columns in GRID_COLUMNS:
+        if viewport >= min_width:
+            return viewport / columns
+
+
+def pick(renditions, fmt, needed):
+    """What a browser takes from a srcset: the narrowest width covering needed px, else the widest."""
+    widths = sorted(r["w"] for r in renditions if r["fmt"] == fmt)
+    if not widths:
+        return None
+    chosen = next((w for w in widths if w >= needed), widths[-1])
+    return next(r for r in renditions if r["fmt"] == fmt and r["w"] == chosen)
+
+
+class Command(BaseCommand):
+    help = "Bytes a page of grid tiles (and each photo's detail view) costs with srcset renditions vs the old thumbs."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--viewport", type=int, default=390, help="CSS viewport width (default: 390, a phone)")
+        parser.add_argument("--dpr", type=float, default=2.0, help="Device pixel ratio (default: 2)")
+        parser.add_argument("--pages", type=int, default=3, help="Grid pages to report (default: 3)")
+        parser.add_argument("--album", help="Album id; default is the whole library, newest first")
+        parser.add_argument("--jpeg-only", action="store_true", help="Assume a browser without WebP")
+
+    def handle(self, *args, **options):
+        viewport, dpr = options["viewport"], options["dpr"]
+        fmt = "jpg" if options["jpeg_only"] else "webp"
+
+        photos = Photo.objects.order_by("-created_at", "-id").only("image_web", "image_thumb", "renditions")
+        if options["album"]:
+            album = Album.objects.filter(pk=options["album"]).first()
+            if album is None:
+                raise CommandError(f"No album {options['album']}")
+            photos = photos.filter(album=album)
+        photos = list(photos[:PHOTOS_PER_PAGE * options["pages"]])
+        if not photos:
+            raise CommandError("No photos to report on.")
+
+        grid_needed = tile_width(viewport) * dpr
+        detail_needed = viewport * dpr
+        self.stdout.write(
+            f"Viewport {viewport}px @ {dpr}x, {fmt}: grid tiles need {grid_needed:.0f}px, detail {detail_needed:.0f}px"
+        )
+        self.stdout.write(f"{'page':>4} {'tiles':>6} {'old KB':>9} {'new KB':>9} {'saved':>7} {'missing':>8}")
+
+        totals = [0, 0]
+        detail = [0, 0]
+        for number, start in enumerate(range(0, len(photos), PHOTOS_PER_PAGE), 1):
+            page = photos[start:start + PHOTOS_PER_PAGE]
+            old = new = missing = 0
+            for photo in page:
+                thumb = self.size_of(photo.image_thumb)
+                chosen = pick(photo.renditions, fmt, grid_needed)
+                chosen_size = self.size_of(chosen["url"]) if chosen else None
+                if thumb is None or chosen_size is None:
+                    missing += 1
+                    continue
+                old += thumb
+                new += chosen_size
+
+                web = self.size_of(photo.image_web)
+                chosen = pick(photo.renditions, fmt, detail_needed)
+                chosen_size = self.size_of(chosen["url"]) if chosen else None
+                if web is not None and chosen_size is not None:
+                    detail[0] += web
+                    detail[1] += chosen_size
+
+            totals[0] += old
+            totals[1] += new
+            self.stdout.write(
+                f"{number:>4} {len(page):>6} {old / 1024:>9.0f} {new / 1024:>9.0f} {self.saved(old, new):>7} {missing:>8}"
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Grid: {totals[0] / 1024:.0f} KB -> {totals[1] / 1024:.0f} KB ({self.saved(*totals)} saved). "
+            f"Detail views: {detail[0] / 1024:.0f} KB -> {detail[1] / 1024:.0f} KB ({self.saved(*detail)} saved)."
+        ))
+
+    def size_of(self, url):
+        """Size of a /media/... file under MEDIA_ROOT, or None (remote URL, or not on disk)."""
+        path = media_path(url)
+        try:
+            return path.stat().st_size if path else None
+        except OSError:
+            return None
+
+    def saved(self, old, new):
+        return f"{(old - new) / old:.0%}" if old else "-"
@@ -0,0 +1,179 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+from gallery import search, stats, versions
+from gallery.models import Album, Comment, Favorite, Photo, Tag
+from gallery.tag_index import bump_version
+
+# Everything this command creates is named with this prefix, so --clear can find it again.
+PREFIX = "seed"
+COLORS = ("#6b7b8c", "#a38b6d", "#3f5a3a", "#c9b79c", "#2e3440", "#8f6f5a")
+SIZES = ((1600, 1067), (1067, 1600), (1600, 1200), (1600, 900))
+
+
+class Command(BaseCommand):
+    help = "Fill the database with a synthetic library (albums, photos, tags, users, favorites, comments) for benchmarks."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--albums", type=int, default=100)
+        parser.add_argument("--photos", type=int, default=100_000)
+        parser.add_argument("--tags", type=int, default=500)
+        parser.add_argument("--tags-per-photo", type=int, default=3, help="Average tags on a photo (default: 3)")
+        parser.add_argument("--users", type=int, default=20)
+        parser.add_argument("--favorites", type=int, default=20, help="Favorites per user (default: 20)")
+        parser.add_argument("--comments", type=int, default=20_000)
+        parser.add_argument("--batch-size", type=int, default=5000, help="Rows per bulk INSERT (default: 5000)")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed, for repeatable libraries")
+        parser.add_argument("--clear", action="store_true", help="Delete earlier seeded data first")
+
+    def handle(self, *args, **options):
+        if options["albums"] < 1 or options["photos"] < 1 or options["users"] < 1:
+            raise CommandError("--albums, --photos and --users must be at least 1")
+        self.rng = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        started = time.perf_counter()
+
+        if options["clear"]:
+            self.clear()
+
+        users = self.make_users(options["users"])
+        tags = self.make_tags(options["tags"])
+        albums = self.make_albums(options["albums"])
+        photo_ids = self.make_photos(albums, options["photos"])
+        self.tag_photos(photo_ids, tags, options["tags_per_photo"])
+        self.make_favorites(users, photo_ids, options["favorites"])
+        self.make_comments(users, photo_ids, options["comments"])
+
+        # Everything above went through bulk_create, which sends no signals.
+        Album.objects.filter(pk__in=[a.pk for a in albums]).refresh_counters()
+        self.stdout.write(f"  {search.rebuild()} search documents")
+        stats.invalidate()
+        versions.bump("catalog")
+        versions.bump("albums")
+        bump_version()
+
+        self.stdout.write(self.style.SUCCESS(f"Seeded in {time.perf_counter() - started:.1f}s."))
+
+    def clear(self):
+        """
+        Delete earlier seed data with plain DELETEs: the per-row signal
+        handlers would cost several queries per photo, and the counters,
+        stamps and stats are all refreshed at the end anyway.
+        """
+        User = get_user_model()
+        albums = Album.objects.filter(title__startswith=f"{PREFIX.title()} album ")
+        photos = Photo.objects.filter(album__in=albums)
+        tags = Tag.objects.filter(slug__startswith=f"{PREFIX}-")
+        users = User.objects.filter(username__startswith=f"{PREFIX}-user-")
+        Through = Photo.tags.through
+
+        deleted = 0
+        with transaction.atomic():
+            for qs in (
+                Through.objects.filter(Q(photo__in=photos) | Q(tag__in=tags)),
+                Comment.objects.filter(Q(photo__in=photos) | Q(user__in=users)),
+                Favorite.objects.filter(Q(photo__in=photos) | Q(user__in=users)),
+                photos,
+                albums,
+                tags,
+            ):
+                deleted += qs._raw_delete(qs.db)
+            deleted += users.delete()[0]
+        self.stdout.write(f"Cleared {deleted} rows of earlier seed data.")
+
+    def bulk(self, model, objs):
+        created = []
+        for start in range(0, len(objs), self.batch_size):
+            with transaction.atomic():
+                created += model.objects.bulk_create(objs[start:start + self.batch_size])
+        self.stdout.write(f"  {len(objs)} {model._meta.verbose_name_plural}")
+        return created
+
+    def make_users(self, n):
+        User = get_user_model()
+        taken = set(User.objects.filter(username__startswith=f"{PREFIX}-user-").values_list("username", flat=True))
+        password = make_password(None)  # unusable: seed users never log in with a password
+        new = [
+            User(username=name, password=password)
+            for name in (f"{PREFIX}-user-{i:04d}" for i in range(n))
+            if name not in taken
+        ]
+        self.bulk(User, new)
+        return list(User.objects.filter(username__startswith=f"{PREFIX}-user-").order_by("username")[:n])
+
+    def make_tags(self, n):
+        taken = set(Tag.objects.filter(slug__startswith=f"{PREFIX}-").values_list("slug", flat=True))
+        new = [
+            Tag(name=f"{PREFIX.title()} tag {i:04d}", slug=f"{PREFIX}-tag-{i:04d}")
+            for i in range(n)
+            if f"{PREFIX}-tag-{i:04d}" not in taken
+        ]
+        self.bulk(Tag, new)
+        return list(Tag.objects.filter(slug__startswith=f"{PREFIX}-").values_list("id", flat=True)[:n])
+
+    def make_albums(self, n):
+        start = Album.objects.filter(title__startswith=f"{PREFIX.title()} album ").count()
+        return self.bulk(Album, [
+            Album(title=f"{PREFIX.title()} album {i:04d}", description="Synthetic album for benchmarks.")
+            for i in range(start, start + n)
+        ])
+
+    def make_photos(self, albums, n):
+        rng = self.rng
+        photos = []
+        for i in range(n):
+            name = f"{PREFIX}_{albums[0].pk.hex[:8]}_{i:06d}.jpg"
+            width, height = rng.choice(SIZES)
+            photos.append(Photo(
+                album=rng.choice(albums),
+                title=f"{PREFIX} photo {i}" if rng.random() < 0.5 else "",
+                year=rng.randint(1950, 2025) if rng.random() < 0.7 else None,
+                image_web=f"/media/web/{name}",
+                image_thumb=f"/media/thumbs/{name}",
+                width=width,
+                height=height,
+                dominant_color=rng.choice(COLORS),
+            ))
+        return [p.pk for p in self.bulk(Photo, photos)]
+
+    def tag_photos(self, photo_ids, tag_ids, per_photo):
+        if not tag_ids or per_photo < 1:
+            return
+        Through = Photo.tags.through
+        rng = self.rng
+        # Skewed like real libraries: a few tags are on most photos, most are rare.
+        weights = [1 / (rank + 1) for rank in range(len(tag_ids))]
+        rows = []
+        for photo_id in photo_ids:
+            k = min(len(tag_ids), rng.randint(0, per_photo * 2))
+            chosen = set(rng.choices(tag_ids, weights=weights, k=k))
+            rows.extend(Through(photo_id=photo_id, tag_id=tag_id) for tag_id in chosen)
+        self.bulk(Through, rows)
+
+    def make_favorites(self, users, photo_ids, per_user):
+        rows = []
+        for user in users:
+            for photo_id in self.rng.sample(photo_ids, min(per_user, len(photo_ids))):
+                rows.append(Favorite(user=user, photo_id=photo_id))
+        Favorite.objects.filter(user__in=users).delete()
+        self.bulk(Favorite, rows)
+
+    def make_comments(self, users, photo_ids, n):
+        rng = self.rng
+        # Comments cluster on a small share of photos.
+        popular = rng.sample(photo_ids, max(1, len(photo_ids) // 20))
+        self.bulk(Comment, [
+            Comment(
+                photo_id=rng.choice(popular),
+                user=rng.choice(users),
+                text=f"Synthetic comment {i}.",
+                is_visible=rng.random() > 0.05,
+            )
+            for i in range(n)
+        ])
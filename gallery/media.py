@@ -0,0 +1,186 @@
+"""
+Where a photo's files live, and serving the local ones. image_web,
+image_thumb and rendition URLs are either /media/... paths under
+MEDIA_ROOT or absolute URLs on the object store given to
+import_photos --base-url.
+
+make_derivatives names every file <stem>.<version>.<ext>. The version is
+a token of the source's content hash and the build settings (renditions
+add a second token for their own settings), so a file never changes
+under its name and serve() lets browsers keep it for a
+year ("immutable"). Files without a version (imported before this) are
+revalidated on each use instead.
+
+serve() runs behind LoginRequiredMiddleware like every other view, then
+hands the bytes to the front proxy when GALLERY_MEDIA_ACCEL says one is
+there:
+
+    x-accel-redirect  nginx. The response carries X-Accel-Redirect:
+                      GALLERY_MEDIA_ACCEL_PREFIX + path, which must be an
+                      internal location aliased to MEDIA_ROOT:
+
+                          location /protected-media/ {
+                              internal;
+                              alias /srv/photos/derived/;
+                          }
+
+    x-sendfile        Apache mod_xsendfile, lighttpd, Caddy: X-Sendfile
+                      with the file's absolute path.
+
+Otherwise it answers with a FileResponse, which gunicorn sends with
+sendfile(2) (no copy through Python), and honours a single byte Range.
+"""
+import hashlib
+import mimetypes
+import re
+from pathlib import Path
+from urllib.parse import quote, unquote, urlsplit
+from urllib.request import urlopen
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+FETCH_TIMEOUT = 30
+
+VERSION_LEN = 12
+_VERSIONED_STEM = re.compile(rf"^(?P<stem>.+)\.[0-9a-f]{{{VERSION_LEN}}}$")
+
+IMMUTABLE = "private, max-age=31536000, immutable"
+REVALIDATE = "private, no-cache"
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def media_path(url):
+    """File under MEDIA_ROOT for a /media/... URL, or None for anything else."""
+    parts = urlsplit(url)
+    path = unquote(parts.path)
+    if parts.netloc or not path.startswith("/media/"):
+        return None
+    return Path(settings.MEDIA_ROOT) / path[len("/media/"):]
+
+
+def open_media(url, timeout=FETCH_TIMEOUT):
+    """A binary file object for a media URL, read from disk or fetched. Raises OSError."""
+    path = media_path(url)
+    if path is not None:
+        return path.open("rb")
+    if urlsplit(url).scheme not in ("http", "https"):
+        raise FileNotFoundError(f"not a media URL: {url}")
+    return urlopen(url, timeout=timeout)
+
+
+# ---- versioned file names ----
+
+def versioned_stem(stem, digest, params):
+    """stem plus a token that changes whenever the content hash or the build parameters do."""
+    token = hashlib.sha256(f"{digest}|{params!r}".encode()).hexdigest()[:VERSION_LEN]
+    return f"{stem}.{token}"
+
+
+def unversioned_stem(stem):
+    """The source's own stem for a (possibly) versioned derivative stem."""
+    match = _VERSIONED_STEM.match(stem)
+    return match["stem"] if match else stem
+
+
+def is_versioned(name):
+    return _VERSIONED_STEM.match(Path(name).stem) is not None
+
+
+# ---- serving ----
+
+def _byte_range(request, size, etag):
+    """(start, end) inclusive for a satisfiable single Range, None to send it all, or "unsatisfiable"."""
+    header = request.META.get("HTTP_RANGE", "")
+    if not header or size == 0:
+        return None
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if if_range and if_range != etag:
+        return None  # the client's copy is stale: send the whole new file
+    match = _RANGE.match(header.replace(" ", ""))
+    if not match or match.groups() == ("", ""):
+        return None  # several ranges, or garbled: a full 200 is always allowed
+    first, last = match.groups()
+    if first:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    else:
+        start, end = max(size - int(last), 0), size - 1  # the last N bytes
+    if start > end or start >= size:
+        return "unsatisfiable"
+    return start, end
+
+
+class _Slice:
+    """Reads at most length bytes from an open file."""
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def serve(request, path):
+    """The file at path under MEDIA_ROOT, offloaded to the proxy where configured."""
+    try:
+        full_path = Path(safe_join(settings.MEDIA_ROOT, path))
+    except SuspiciousFileOperation:
+        raise Http404("No such file.")
+    try:
+        st = full_path.stat()
+    except OSError:
+        raise Http404("No such file.")
+    if not full_path.is_file():
+        raise Http404("No such file.")
+
+    etag = quote_etag(f"{st.st_mtime_ns:x}-{st.st_size:x}")
+    cache_control = IMMUTABLE if is_versioned(full_path.name) else REVALIDATE
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(st.st_mtime))
+    if not_modified is not None:
+        not_modified["Cache-Control"] = cache_control
+        return not_modified
+
+    content_type = mimetypes.guess_type(full_path.name)[0] or "application/octet-stream"
+    accel = settings.GALLERY_MEDIA_ACCEL
+    if accel == "x-accel-redirect":
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = settings.GALLERY_MEDIA_ACCEL_PREFIX + quote(path)
+    elif accel == "x-sendfile":
+        response = HttpResponse(content_type=content_type)
+        response["X-Sendfile"] = str(full_path)
+    elif accel:
+        raise ImproperlyConfigured("GALLERY_MEDIA_ACCEL must be x-accel-redirect, x-sendfile or empty")
+    else:
+        byte_range = _byte_range(request, st.st_size, etag)
+        if byte_range == "unsatisfiable":
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{st.st_size}"
+            return response
+        file = full_path.open("rb")
+        if byte_range is None:
+            response = FileResponse(file, content_type=content_type)
+        else:
+            start, end = byte_range
+            file.seek(start)
+            # To the end of the file the real file goes out, so sendfile still applies.
+            body = file if end == st.st_size - 1 else _Slice(file, end - start + 1)
+            response = FileResponse(body, status=206, content_type=content_type)
+            response["Content-Range"] = f"bytes {start}-{end}/{st.st_size}"
+            response["Content-Length"] = str(end - start + 1)
+        response["Accept-Ranges"] = "bytes"
+
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(st.st_mtime)
+    response["Cache-Control"] = cache_control
+    return response
@@ -1,7 +1,17 @@
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
 from django.conf import settings
+from django.db import connections
 from django.shortcuts import redirect
 from django.urls import reverse
+from django.utils.deprecation import MiddlewareMixin
 from urllib.parse import urlencode
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from . import profiling
+from .timing import timings
 
 EXEMPT_PREFIXES = (
     "/accounts/login/",
@@ -13,21 +23,175 @@ EXEMPT_PREFIXES = (
     "/accounts/reset/done/",
 )
 
-class LoginRequiredMiddleware:
-    def __init__(self, get_response):
-        self.get_response = get_response
+# Every middleware here runs natively under WSGI and ASGI (see Django's
+# "Asynchronous support" middleware docs): one sync-only middleware would
+# cost every ASGI request a thread for its whole duration.
 
-    def __call__(self, request):
+
+def _resolved_user(user):
+    async def auser():
+        return user
+    return auser
+
+
+class LoginRequiredMiddleware(MiddlewareMixin):
+    """
+    Also resolves request.user for every request (off the event loop under
+    ASGI), so async views and the conditional-GET validators can read it
+    without a query.
+    """
+
+    def process_request(self, request):
         path = request.path
 
-        if request.user.is_authenticated:
-            return self.get_response(request)
+        user = request.user
+        # AuthenticationMiddleware's auser() would look the user up again.
+        request.auser = _resolved_user(user)
+
+        if user.is_authenticated:
+            return None
 
         # Allow exempt paths
         if any(path.startswith(p) for p in EXEMPT_PREFIXES):
-            return self.get_response(request)
+            return None
 
         # Redirect to login with ?next=
         login_url = settings.LOGIN_URL
         query = urlencode({"next": path})
         return redirect(f"{login_url}?{query}")
+
+
+class StaticFilesMiddleware:
+    """
+    WhiteNoise, which is sync-only, consulted only for STATIC_URL paths so
+    the rest of an ASGI request never leaves the event loop because of it.
+    """
+
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            self.whitenoise = WhiteNoiseMiddleware(async_to_sync(get_response))
+        else:
+            self.whitenoise = WhiteNoiseMiddleware(get_response)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.whitenoise(request)
+
+    async def __acall__(self, request):
+        if request.path_info.startswith(settings.STATIC_URL):
+            return await sync_to_async(self.whitenoise)(request)
+        return await self.get_response(request)
+
+
+class _QueryTimer:
+    """execute_wrapper that counts queries and the time spent in them."""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.queries += 1
+
+
+class RequestTimingMiddleware:
+    """
+    Time every request, count its queries, report both in a Server-Timing
+    header and feed gallery.timing. Costs two perf_counter() calls per
+    query and a histogram update per request, so it can stay on.
+    """
+
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        db = _QueryTimer()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            self._wrap_connections(stack, db)
+            response = self.get_response(request)
+        return self._finish(request, response, start, db)
+
+    async def __acall__(self, request):
+        db = _QueryTimer()
+        start = time.perf_counter()
+        stack = ExitStack()
+        # Connections are per thread: install the wrapper in the thread the
+        # async ORM runs this request's queries in.
+        await sync_to_async(self._wrap_connections)(stack, db)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self._finish(request, response, start, db)
+
+    def _wrap_connections(self, stack, db):
+        for alias in settings.DATABASES:
+            stack.enter_context(connections[alias].execute_wrapper(db))
+
+    def _finish(self, request, response, start, db):
+        wall_ms = (time.perf_counter() - start) * 1000
+        db_ms = db.seconds * 1000
+
+        if settings.GALLERY_SERVER_TIMING:
+            response["Server-Timing"] = (
+                f'app;dur={wall_ms:.1f}, db;dur={db_ms:.1f};desc="{db.queries} queries"'
+            )
+
+        match = getattr(request, "resolver_match", None)
+        name = match.view_name if match else "<unresolved>"
+        timings.record(name, request.path, response.status_code, wall_ms, db.queries, db_ms)
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Run the rest of the request under cProfile when gallery.profiling says
+    so. Must come after AuthenticationMiddleware: only staff can ask.
+    """
+
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        trigger = profiling.requested(request)
+        if trigger and not request.user.is_staff:
+            trigger = None
+        trigger = trigger or profiling.sampled()
+        if trigger is None:
+            return self.get_response(request)
+        return profiling.run_profiled(request, self.get_response, trigger)
+
+    async def __acall__(self, request):
+        trigger = profiling.requested(request)
+        if trigger and not (await request.auser()).is_staff:
+            trigger = None
+        trigger = trigger or profiling.sampled()
+        if trigger is None:
+            return await self.get_response(request)
+        return await profiling.arun_profiled(request, self.get_response, trigger)
@@ -0,0 +1,39 @@
+# Generated by Django 6.0 on 2026-10-18 20:42
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Album = apps.get_model("gallery", "Album")
+    Photo = apps.get_model("gallery", "Photo")
+    photos = Photo.objects.filter(album=OuterRef("pk")).order_by()
+    Album.objects.update(
+        photo_count=Coalesce(Subquery(photos.values("album").annotate(n=Count("pk")).values("n")), 0),
+        cover_thumb=Coalesce(
+            Subquery(photos.order_by("created_at", "id").values("image_thumb")[:1]),
+            Value(""),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0005_photo_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='album',
+            name='cover_thumb',
+            field=models.CharField(blank=True, editable=False, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='photo_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 6.0 on 2026-10-18 21:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0009_requestprofile'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['created_at'], name='gallery_alb_created_d2c887_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['photo', 'is_visible', 'created_at'], name='gallery_com_photo_i_292ec9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['created_at'], name='gallery_com_created_d84091_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(fields=['created_at', 'id'], name='gallery_pho_created_7fbb07_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(fields=['album', 'created_at', 'id'], name='gallery_pho_album_i_a474b3_idx'),
+        ),
+        # The composite indexes above lead with these columns.
+        migrations.AlterField(
+            model_name='comment',
+            name='photo',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='comments', to='gallery.photo'),
+        ),
+        migrations.AlterField(
+            model_name='photo',
+            name='album',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='photos', to='gallery.album'),
+        ),
+    ]
@@ -0,0 +1,104 @@
+# Generated by Django 6.0 on 2026-10-18 21:20
+
+from django.db import migrations
+
+# Not model fields: see gallery.search. Nothing is created on other databases.
+POSTGRESQL = [
+    ("ALTER TABLE gallery_photo ADD COLUMN search_vector tsvector",
+     "ALTER TABLE gallery_photo DROP COLUMN search_vector"),
+    ("CREATE INDEX gallery_photo_search_gin ON gallery_photo USING gin (search_vector)",
+     "DROP INDEX IF EXISTS gallery_photo_search_gin"),
+]
+
+SQLITE = [
+    # id INTEGER PRIMARY KEY keeps rowids stable across VACUUM, which the FTS index relies on.
+    ("""CREATE TABLE gallery_photo_search (
+            id INTEGER PRIMARY KEY,
+            photo_id char(32) NOT NULL UNIQUE,
+            title TEXT NOT NULL,
+            tags TEXT NOT NULL,
+            album TEXT NOT NULL,
+            comments TEXT NOT NULL
+        )""",
+     "DROP TABLE gallery_photo_search"),
+    ("""CREATE VIRTUAL TABLE gallery_photo_fts USING fts5(
+            title, tags, album, comments,
+            content='gallery_photo_search', content_rowid='id',
+            tokenize='porter unicode61 remove_diacritics 2'
+        )""",
+     "DROP TABLE gallery_photo_fts"),
+]
+
+
+# The documents as gallery.search builds them, frozen here so this migration
+# keeps working when that module or the models change. Tables come from the
+# historical models.
+POSTGRESQL_FILL = [
+    """UPDATE {photo} p SET search_vector =
+        setweight(to_tsvector('english', p.title), 'A')
+        || setweight(to_tsvector('english', coalesce((
+            SELECT string_agg(t.name, ' ') FROM {tag} t JOIN {photo_tags} pt ON pt.tag_id = t.id
+            WHERE pt.photo_id = p.id), '')), 'A')
+        || setweight(to_tsvector('english', a.title || ' ' || a.description), 'B')
+        || setweight(to_tsvector('english', coalesce((
+            SELECT string_agg(c.text, ' ') FROM {comment} c
+            WHERE c.photo_id = p.id AND c.is_visible), '')), 'C')
+    FROM {album} a
+    WHERE a.id = p.album_id""",
+]
+
+SQLITE_FILL = [
+    """INSERT INTO gallery_photo_search (photo_id, title, tags, album, comments)
+    SELECT p.id, p.title,
+        coalesce((
+            SELECT group_concat(t.name, ' ') FROM {tag} t JOIN {photo_tags} pt ON pt.tag_id = t.id
+            WHERE pt.photo_id = p.id), ''),
+        a.title || ' ' || a.description,
+        coalesce((
+            SELECT group_concat(c.text, ' ') FROM {comment} c
+            WHERE c.photo_id = p.id AND c.is_visible), '')
+    FROM {photo} p JOIN {album} a ON a.id = p.album_id
+    ORDER BY p.created_at, p.id""",
+    "INSERT INTO gallery_photo_fts (gallery_photo_fts) VALUES ('rebuild')",
+]
+
+
+def statements(schema_editor):
+    return {"postgresql": POSTGRESQL, "sqlite": SQLITE}.get(schema_editor.connection.vendor, [])
+
+
+def fill_statements(apps, schema_editor):
+    Photo = apps.get_model("gallery", "Photo")
+    tables = {
+        "photo": Photo._meta.db_table,
+        "photo_tags": Photo.tags.through._meta.db_table,
+        "tag": apps.get_model("gallery", "Tag")._meta.db_table,
+        "album": apps.get_model("gallery", "Album")._meta.db_table,
+        "comment": apps.get_model("gallery", "Comment")._meta.db_table,
+    }
+    fill = {"postgresql": POSTGRESQL_FILL, "sqlite": SQLITE_FILL}.get(schema_editor.connection.vendor, [])
+    return [sql.format(**tables) for sql in fill]
+
+
+def create(apps, schema_editor):
+    for forward, _ in statements(schema_editor):
+        schema_editor.execute(forward)
+    with schema_editor.connection.cursor() as cursor:
+        for sql in fill_statements(apps, schema_editor):
+            cursor.execute(sql)
+
+
+def drop(apps, schema_editor):
+    for _, backward in reversed(statements(schema_editor)):
+        schema_editor.execute(backward)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gallery', '0010_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create, drop),
+    ]
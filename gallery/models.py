@@ -1,23 +1,53 @@
 import uuid
 from django.conf import settings
 from django.db import models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 from django.utils.text import slugify
 
 
+class AlbumQuerySet(models.QuerySet):
+    def refresh_counters(self):
+        """Recompute photo_count and cover_thumb for these albums in one UPDATE."""
+        photos = Photo.objects.filter(album=OuterRef("pk")).order_by()
+        return self.update(
+            photo_count=Coalesce(
+                Subquery(photos.values("album").annotate(n=Count("pk")).values("n")),
+                0,
+            ),
+            cover_thumb=Coalesce(
+                Subquery(photos.order_by("created_at", "id").values("image_thumb")[:1]),
+                Value(""),
+            ),
+        )
+
+
 class Album(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     title = models.CharField(max_length=200)
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Denormalized for album_list; kept current by gallery.signals and import_photos.
+    photo_count = models.PositiveIntegerField(default=0, editable=False)
+    cover_thumb = models.CharField(max_length=500, blank=True, editable=False)
+
+    objects = AlbumQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at"]),  # album_list, home
+        ]
+
     def __str__(self) -> str:
         return self.title
 
 
 class Photo(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    album = models.ForeignKey(Album, on_delete=models.CASCADE, related_name="photos")
+    # Indexed by (album, created_at, id) below.
+    album = models.ForeignKey(Album, on_delete=models.CASCADE, related_name="photos", db_index=False)
 
     title = models.CharField(max_length=200, blank=True)
     year = models.IntegerField(null=True, blank=True)
@@ -27,18 +57,52 @@ class Photo(models.Model):
         permissions = [
             ("can_modify_tags", "Can add/remove tags on photos"),
         ]
+        # Every photo list is ordered by (created_at, id), the keyset pagination order.
+        indexes = [
+            models.Index(fields=["created_at", "id"]),  # photo_browser, home, the tag index build
+            models.Index(fields=["album", "created_at", "id"]),  # album_detail, neighbors, album covers
+        ]
     
     image_web = models.CharField(max_length=500)
     image_thumb = models.CharField(max_length=500)
+    # SHA-256 of the web derivative, used to spot the same picture imported twice.
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    # Extra widths/formats from make_derivatives, e.g. [{"w": 400, "fmt": "webp", "url": "..."}].
+    renditions = models.JSONField(default=list, blank=True, editable=False)
+    # Upright size of image_web plus a color and tiny inline JPEG to paint before it loads.
+    width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    dominant_color = models.CharField(max_length=7, blank=True, editable=False)
+    placeholder = models.TextField(blank=True, editable=False)
 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored album so a move can update both albums' counters.
+        instance._loaded_album_id = instance.__dict__.get("album_id")
+        return instance
+
     def __str__(self) -> str:
         return self.title or str(self.id)
     
     def get_absolute_url(self):
         return reverse("photo_detail", args=[self.id])
 
+    def srcset(self, fmt):
+        """srcset value for one rendition format ("" if there are none)."""
+        entries = sorted((r["w"], r["url"]) for r in self.renditions if r["fmt"] == fmt)
+        return ", ".join(f"{url} {w}w" for w, url in entries)
+
+    @property
+    def jpeg_srcset(self):
+        return self.srcset("jpg")
+
+    @property
+    def webp_srcset(self):
+        return self.srcset("webp")
+
 
 class Favorite(models.Model):
     user = models.ForeignKey(
@@ -67,13 +131,20 @@ class Favorite(models.Model):
 
 
 class Comment(models.Model):
-    photo = models.ForeignKey(Photo, on_delete=models.CASCADE, related_name="comments")
+    # Indexed by (photo, is_visible, created_at) below.
+    photo = models.ForeignKey(Photo, on_delete=models.CASCADE, related_name="comments", db_index=False)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
 
     text = models.TextField()
     is_visible = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["photo", "is_visible", "created_at"]),  # photo_detail
+            models.Index(fields=["created_at"]),  # recent_comments
+        ]
+
     def __str__(self) -> str:
         return f"{self.user} on {self.photo}"
 
@@ -87,3 +158,22 @@ class Tag(models.Model):
             super().save(*args, **kwargs)
     def __str__(self) -> str:
         return self.name
+
+
+class RequestProfile(models.Model):
+    """One cProfile'd request; the stats file lives in GALLERY_PROFILE_DIR (see gallery.profiling)."""
+
+    TRIGGERS = [("param", "?profile=1"), ("header", "X-Gallery-Profile"), ("sample", "Sampled")]
+
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    view_name = models.CharField(max_length=200, blank=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+    status_code = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    trigger = models.CharField(max_length=10, choices=TRIGGERS)
+    file_name = models.CharField(max_length=100)
+
+    def __str__(self) -> str:
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
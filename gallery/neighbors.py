@@ -0,0 +1,73 @@
+"""
+Previous/next photo for photo_detail, in the order of the grid the user
+came from. photo_detail only knows that grid from its next= URL:
+
+    album_detail    that album, oldest first
+    photo_browser   the tag filter in the URL (or every photo), newest first
+
+Album neighbors are two keyset lookups on (album, created_at, id). Browser
+neighbors come from the in-process tag index, so only the neighbor rows
+themselves are fetched. Any other next= (home, favorites, none) has no
+neighbors.
+"""
+from urllib.parse import parse_qs, urlsplit
+
+from django.db.models import Q
+from django.urls import Resolver404, resolve
+
+from .models import Photo, Tag
+from .tag_index import tag_index
+
+# Enough for the links and for warming the neighbors' stage images.
+NEIGHBOR_FIELDS = ("id", "title", "image_web", "renditions")
+
+
+def _album_neighbors(photo):
+    in_album = Photo.objects.filter(album_id=photo.album_id).only(*NEIGHBOR_FIELDS)
+    key = (photo.created_at, photo.pk)
+    previous = (
+        in_album.filter(Q(created_at__lt=key[0]) | Q(created_at=key[0], pk__lt=key[1]))
+        .order_by("-created_at", "-pk").first()
+    )
+    following = (
+        in_album.filter(Q(created_at__gt=key[0]) | Q(created_at=key[0], pk__gt=key[1]))
+        .order_by("created_at", "pk").first()
+    )
+    return previous, following
+
+
+def _browser_neighbors(photo, query):
+    selected = query.get("tags", [])
+    untagged = query.get("untagged") == ["1"]
+    tag_ids = []
+    if selected:
+        slug_ids = dict(Tag.objects.filter(slug__in=selected).values_list("slug", "id"))
+        tag_ids = [slug_ids.get(slug) for slug in selected]
+
+    newer_id, older_id = tag_index.neighbors(photo.pk, tag_ids, untagged)
+    ids = [pk for pk in (newer_id, older_id) if pk is not None]
+    if not ids:
+        return None, None
+    rows = Photo.objects.only(*NEIGHBOR_FIELDS).in_bulk(ids)
+    return rows.get(newer_id), rows.get(older_id)
+
+
+def neighbors(photo, next_url):
+    """(previous, next) Photo for photo_detail in next_url's order; either may be None."""
+    if not next_url:
+        return None, None
+    parts = urlsplit(next_url)
+    if parts.netloc:
+        return None, None
+    try:
+        match = resolve(parts.path)
+    except Resolver404:
+        return None, None
+
+    if match.url_name == "album_detail":
+        if match.kwargs["album_id"] != photo.album_id:
+            return None, None
+        return _album_neighbors(photo)
+    if match.url_name == "photo_browser":
+        return _browser_neighbors(photo, parse_qs(parts.query))
+    return None, None
@@ -0,0 +1,108 @@
+import base64
+import binascii
+import uuid
+from datetime import datetime
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+# Photos on one page of photo_browser and search results.
+PHOTOS_PER_PAGE = 40
+
+# Below this many rows an exact count is cheap enough everywhere.
+ESTIMATE_ABOVE = 10_000
+
+
+def encode_cursor(obj) -> str:
+    """Opaque token for an object's position in (created_at, id) order."""
+    raw = f"{obj.created_at.isoformat()}|{obj.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """Return (created_at, id) for a token, or None if it is missing or garbled."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+        created_at, pk = raw.split("|")
+        return datetime.fromisoformat(created_at), uuid.UUID(pk)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        return None
+
+
+class KeysetPage:
+    def __init__(self, object_list, has_next, has_previous):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.object_list[-1]) if self.has_next else ""
+
+    @property
+    def previous_cursor(self):
+        return encode_cursor(self.object_list[0]) if self.has_previous else ""
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+def keyset_page(queryset, per_page, after=None, before=None):
+    """
+    One page of queryset, newest first, positioned by cursor rather than
+    OFFSET: every page is an index range scan on (created_at, id), so
+    page 500 costs the same as page 1.
+
+    after/before are decoded cursors (see decode_cursor).
+    """
+    if before:
+        created_at, pk = before
+        rows = list(
+            queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, pk__gt=pk))
+            .order_by("created_at", "pk")[:per_page + 1]
+        )
+        if len(rows) > per_page:
+            return KeysetPage(rows[:per_page][::-1], has_next=True, has_previous=True)
+        # Walked back to the start: show a full first page instead of a short one.
+
+    newest_first = queryset.order_by("-created_at", "-pk")
+    if after and not before:
+        created_at, pk = after
+        newest_first = newest_first.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk)
+        )
+    rows = list(newest_first[:per_page + 1])
+    return KeysetPage(
+        rows[:per_page],
+        has_next=len(rows) > per_page,
+        has_previous=bool(after and not before),
+    )
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    OFFSET paginator for admin changelists over big tables. An unfiltered
+    list on PostgreSQL takes its size from the planner's row estimate, since
+    count(*) there reads the whole table; filtered lists (and SQLite, where
+    count(*) walks an index) are counted exactly.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == "postgresql" and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            # reltuples is -1 until the table is first analyzed.
+            if row and row[0] >= ESTIMATE_ABOVE:
+                return int(row[0])
+        return super().count
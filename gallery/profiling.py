@@ -0,0 +1,160 @@
+"""
+cProfile for single production requests.
+
+A request is profiled when a staff user asks for it (?profile=1 or an
+X-Gallery-Profile: 1 header) or when it is picked by sampling, one in
+GALLERY_PROFILE_SAMPLE_RATE requests (0 turns sampling off). The profile
+covers everything inside ProfilingMiddleware: the view, the ORM and template
+rendering. ProfilingMiddleware ignores anyone else's ?profile=1.
+
+Each profile is a pstats file in GALLERY_PROFILE_DIR plus a RequestProfile
+row for the admin. Only the newest GALLERY_PROFILE_KEEP are kept.
+
+cProfile can only run one profiler per process at a time, so a request that
+would start a second one while another is running is not profiled.
+"""
+import cProfile
+import io
+import logging
+import pstats
+import random
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PARAM = "profile"
+HEADER = "HTTP_X_GALLERY_PROFILE"
+
+_running = threading.Lock()
+
+
+def requested(request):
+    """ "param" or "header" if the request asks to be profiled. The caller checks for staff."""
+    if request.GET.get(PARAM) == "1":
+        return "param"
+    if request.META.get(HEADER) == "1":
+        return "header"
+    return None
+
+
+def sampled():
+    """ "sample" for one request in GALLERY_PROFILE_SAMPLE_RATE, else None."""
+    rate = settings.GALLERY_PROFILE_SAMPLE_RATE
+    if rate and random.randrange(rate) == 0:
+        return "sample"
+    return None
+
+
+def profile_directory():
+    path = Path(settings.GALLERY_PROFILE_DIR)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def run_profiled(request, get_response, trigger):
+    """Call get_response under cProfile and record the result. Returns the response."""
+    if not _running.acquire(blocking=False):
+        return get_response(request)
+    try:
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            response = get_response(request)
+        finally:
+            profiler.disable()
+        duration_ms = (time.perf_counter() - start) * 1000
+    finally:
+        _running.release()
+
+    _save(request, response, profiler, trigger, duration_ms)
+    return response
+
+
+async def arun_profiled(request, get_response, trigger):
+    """
+    run_profiled() for the ASGI stack. cProfile sees every thread and
+    coroutine in the process, so under load the profile also holds other
+    requests' work interleaved with this one.
+    """
+    if not _running.acquire(blocking=False):
+        return await get_response(request)
+    try:
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            response = await get_response(request)
+        finally:
+            profiler.disable()
+        duration_ms = (time.perf_counter() - start) * 1000
+    finally:
+        _running.release()
+
+    await sync_to_async(_save)(request, response, profiler, trigger, duration_ms)
+    return response
+
+
+def _save(request, response, profiler, trigger, duration_ms):
+    # The request has already succeeded: a full disk or a database error
+    # here must not turn it into a 500.
+    try:
+        _record(request, response, profiler, trigger, duration_ms)
+    except Exception:
+        logger.exception("Could not save the profile of %s %s", request.method, request.path)
+
+
+def _record(request, response, profiler, trigger, duration_ms):
+    from .models import RequestProfile
+
+    file_name = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.prof"
+    profiler.dump_stats(profile_directory() / file_name)
+
+    match = getattr(request, "resolver_match", None)
+    user = getattr(request, "user", None)
+    RequestProfile.objects.create(
+        method=request.method,
+        path=request.get_full_path()[:500],
+        view_name=match.view_name if match else "",
+        user=user if user is not None and user.is_authenticated else None,
+        status_code=response.status_code,
+        duration_ms=duration_ms,
+        trigger=trigger,
+        file_name=file_name,
+    )
+    _rotate()
+
+
+def _rotate():
+    from .models import RequestProfile
+
+    stale = list(RequestProfile.objects.order_by("-created_at")[settings.GALLERY_PROFILE_KEEP:])
+    if stale:
+        delete_profiles(stale)
+
+
+def delete_profiles(profiles):
+    """Delete RequestProfile rows together with their stats files."""
+    from .models import RequestProfile
+
+    directory = profile_directory()
+    for profile in profiles:
+        (directory / profile.file_name).unlink(missing_ok=True)
+    RequestProfile.objects.filter(pk__in=[p.pk for p in profiles]).delete()
+
+
+def top_functions(file_name, limit=40, sort="cumulative"):
+    """pstats' listing of the top `limit` functions by `sort`, as text."""
+    path = profile_directory() / file_name
+    if not path.exists():
+        return f"{path} is gone (rotated out or deleted)."
+    out = io.StringIO()
+    stats = pstats.Stats(str(path), stream=out)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return out.getvalue()
@@ -0,0 +1,337 @@
+"""
+Uploading derivatives to the object store that import_photos --base-url
+points at (Cloudflare R2, or any S3-compatible service).
+
+Each file goes to the key import_photos will link to: web/<name>,
+thumbs/<name>, renditions/<width>/<name>, under an optional prefix.
+Publisher lists what the bucket already holds once (a thousand keys per
+request, not a HEAD per file), then uploads from a thread pool so many
+requests are on the wire at once; a single PUT of a 400 KB JPEG mostly
+waits on the round trip, and one at a time never fills an uplink.
+
+An object is skipped when its ETag matches the one the store would give
+the local file: the MD5 of the bytes for a plain PUT, and for a multipart
+upload the MD5 of the parts' MD5s plus "-<parts>". Files over part_size go
+up as a multipart upload of part_size pieces, so the two always agree.
+Every request is retried with exponential backoff while the store calls
+the error transient (timeouts, 5xx, throttling).
+
+A store is anything with the methods S3Store has: etags, put,
+start_multipart, put_part, finish_multipart, abort_multipart and
+is_transient. LocalStore keeps objects in a folder with the same
+semantics, so publishing can be run and checked with no network.
+"""
+import base64
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import NamedTuple
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .media import is_versioned
+
+logger = logging.getLogger(__name__)
+
+PART_SIZE = 8 * 1024 * 1024
+RETRIES = 5
+BACKOFF = 0.5       # seconds before the first retry, doubled after each
+BACKOFF_MAX = 20.0
+
+# The bucket is public: versioned names never change, the rest may.
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "public, max-age=3600"
+
+UPLOADED, SKIPPED, FAILED = "uploaded", "skipped", "failed"
+
+
+def local_etag(path, part_size=PART_SIZE):
+    """The ETag the store gives path once Publisher has uploaded it."""
+    digests = []
+    with open(path, "rb") as f:
+        while data := f.read(part_size):
+            digests.append(hashlib.md5(data))
+    if len(digests) <= 1:
+        return (digests[0] if digests else hashlib.md5()).hexdigest()
+    return multipart_etag(d.hexdigest() for d in digests)
+
+
+def multipart_etag(part_etags):
+    part_etags = list(part_etags)
+    combined = hashlib.md5(b"".join(bytes.fromhex(e) for e in part_etags))
+    return f"{combined.hexdigest()}-{len(part_etags)}"
+
+
+def _content_md5(data):
+    return base64.b64encode(hashlib.md5(data).digest()).decode()
+
+
+# ---- stores ----
+
+class S3Store:
+    """A bucket on R2 or another S3-compatible service, through boto3."""
+
+    def __init__(self, bucket, endpoint_url=None, max_connections=16):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError as exc:
+            raise ImproperlyConfigured("Publishing to a bucket needs boto3 (pip install boto3).") from exc
+        self.bucket = bucket
+        # One client for every thread, with a connection each; Publisher does the retrying.
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url or None,
+            config=Config(max_pool_connections=max_connections, retries={"total_max_attempts": 1}),
+        )
+
+    def etags(self, prefix):
+        found = {}
+        pages = self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=prefix)
+        for page in pages:
+            for obj in page.get("Contents", ()):
+                found[obj["Key"]] = obj["ETag"].strip('"')
+        return found
+
+    def put(self, key, data, content_type, cache_control):
+        response = self.client.put_object(
+            Bucket=self.bucket, Key=key, Body=data, ContentMD5=_content_md5(data),
+            ContentType=content_type, CacheControl=cache_control,
+        )
+        return response["ETag"].strip('"')
+
+    def start_multipart(self, key, content_type, cache_control):
+        response = self.client.create_multipart_upload(
+            Bucket=self.bucket, Key=key, ContentType=content_type, CacheControl=cache_control,
+        )
+        return response["UploadId"]
+
+    def put_part(self, key, upload_id, number, data):
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=number,
+            Body=data, ContentMD5=_content_md5(data),
+        )
+        return response["ETag"].strip('"')
+
+    def finish_multipart(self, key, upload_id, part_etags):
+        parts = [{"PartNumber": n, "ETag": f'"{etag}"'} for n, etag in enumerate(part_etags, start=1)]
+        response = self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts},
+        )
+        return response["ETag"].strip('"')
+
+    def abort_multipart(self, key, upload_id):
+        self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+
+    def is_transient(self, exc):
+        from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+
+        if isinstance(exc, ClientError):
+            status = exc.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+            code = exc.response.get("Error", {}).get("Code", "")
+            return status >= 500 or status == 429 or code in ("SlowDown", "RequestTimeout")
+        return isinstance(exc, (ConnectionError, HTTPClientError))
+
+
+class LocalStore:
+    """
+    A bucket in a folder: objects at root/<key>, ETag and headers in
+    root/.meta/<key>.json, multipart parts in root/.uploads until finished.
+    latency (seconds) is slept on every request and fail_rate of requests
+    raise ConnectionError, to stand in for a real link.
+    """
+
+    def __init__(self, root, latency=0.0, fail_rate=0.0):
+        self.root = Path(root)
+        self.latency = latency
+        self.fail_rate = fail_rate
+
+    def _request(self):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.fail_rate and random.random() < self.fail_rate:
+            raise ConnectionError("simulated network failure")
+
+    def _meta_path(self, key):
+        return self.root / ".meta" / f"{key}.json"
+
+    def _write(self, path, chunks):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        with tmp.open("wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp, path)
+
+    def _store(self, key, chunks, etag, content_type, cache_control):
+        self._write(self.root / key, chunks)
+        meta = {"etag": etag, "content_type": content_type, "cache_control": cache_control}
+        self._write(self._meta_path(key), [json.dumps(meta).encode()])
+        return etag
+
+    def etags(self, prefix):
+        self._request()
+        meta_root = self.root / ".meta"
+        found = {}
+        for meta in meta_root.rglob("*.json"):
+            key = meta.relative_to(meta_root).as_posix()[:-len(".json")]
+            if key.startswith(prefix) and (self.root / key).is_file():
+                found[key] = json.loads(meta.read_text())["etag"]
+        return found
+
+    def put(self, key, data, content_type, cache_control):
+        self._request()
+        return self._store(key, [data], hashlib.md5(data).hexdigest(), content_type, cache_control)
+
+    def start_multipart(self, key, content_type, cache_control):
+        self._request()
+        upload_id = uuid.uuid4().hex
+        info = {"key": key, "content_type": content_type, "cache_control": cache_control}
+        self._write(self.root / ".uploads" / upload_id / "upload.json", [json.dumps(info).encode()])
+        return upload_id
+
+    def put_part(self, key, upload_id, number, data):
+        self._request()
+        self._write(self.root / ".uploads" / upload_id / f"{number:05}", [data])
+        return hashlib.md5(data).hexdigest()
+
+    def finish_multipart(self, key, upload_id, part_etags):
+        self._request()
+        folder = self.root / ".uploads" / upload_id
+        info = json.loads((folder / "upload.json").read_text())
+        parts = [folder / f"{n:05}" for n in range(1, len(part_etags) + 1)]
+        etag = self._store(
+            key, (p.read_bytes() for p in parts), multipart_etag(part_etags),
+            info["content_type"], info["cache_control"],
+        )
+        self.abort_multipart(key, upload_id)
+        return etag
+
+    def abort_multipart(self, key, upload_id):
+        folder = self.root / ".uploads" / upload_id
+        for part in folder.glob("*"):
+            part.unlink()
+        if folder.exists():
+            folder.rmdir()
+
+    def is_transient(self, exc):
+        return isinstance(exc, (ConnectionError, TimeoutError))
+
+
+# ---- publishing ----
+
+class Upload(NamedTuple):
+    path: Path
+    key: str
+
+
+class Result(NamedTuple):
+    upload: Upload
+    outcome: str  # UPLOADED, SKIPPED or FAILED
+    size: int
+    detail: str = ""
+
+
+def derivative_uploads(web_dir, thumb_dir, renditions_dir=None, prefix=""):
+    """Upload for every derivative file, keyed the way import_photos builds --base-url URLs."""
+    folders = [(Path(web_dir), "web"), (Path(thumb_dir), "thumbs")]
+    if renditions_dir is not None:
+        renditions_dir = Path(renditions_dir)
+        if renditions_dir.is_dir():
+            folders += [(d, f"renditions/{d.name}") for d in sorted(renditions_dir.iterdir()) if d.name.isdigit()]
+    uploads = []
+    for folder, key_folder in folders:
+        if not folder.is_dir():
+            continue
+        for path in sorted(folder.iterdir()):
+            if path.is_file() and not path.name.startswith("."):
+                uploads.append(Upload(path, f"{prefix}{key_folder}/{path.name}"))
+    return uploads
+
+
+class Publisher:
+    def __init__(self, store, workers=16, part_size=PART_SIZE, retries=RETRIES):
+        self.store = store
+        self.workers = workers
+        self.part_size = part_size
+        self.retries = retries
+        self._retried = 0
+        self._lock = threading.Lock()
+
+    @property
+    def retried(self):
+        """Requests that failed and were tried again, over every run."""
+        return self._retried
+
+    def _call(self, method, *args):
+        for attempt in range(self.retries + 1):
+            try:
+                return method(*args)
+            except Exception as exc:
+                if attempt == self.retries or not self.store.is_transient(exc):
+                    raise
+                with self._lock:
+                    self._retried += 1
+                # Full jitter, so workers that failed together don't come back together.
+                time.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF * 2 ** attempt)))
+
+    def remote_etags(self, prefix=""):
+        return self._call(self.store.etags, prefix)
+
+    def run(self, uploads, remote=None, dry_run=False):
+        """
+        Yield a Result per upload as each finishes. remote is {key: ETag}
+        from remote_etags(); it is listed here when not given.
+        """
+        if remote is None:
+            remote = self.remote_etags(os.path.commonprefix([u.key for u in uploads]) if uploads else "")
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(self._publish, u, remote.get(u.key), dry_run): u for u in uploads}
+            try:
+                for future in as_completed(futures):
+                    yield future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def _publish(self, upload, remote_etag, dry_run):
+        try:
+            size = upload.path.stat().st_size
+            if remote_etag is not None and remote_etag == local_etag(upload.path, self.part_size):
+                return Result(upload, SKIPPED, size)
+            if not dry_run:
+                self._upload(upload, size)
+            return Result(upload, UPLOADED, size)
+        except Exception as exc:
+            logger.debug("Publishing %s failed", upload.key, exc_info=True)
+            return Result(upload, FAILED, 0, f"{type(exc).__name__}: {exc}")
+
+    def _upload(self, upload, size):
+        content_type = mimetypes.guess_type(upload.path.name)[0] or "application/octet-stream"
+        cache_control = IMMUTABLE if is_versioned(upload.path.name) else REVALIDATE
+        if size <= self.part_size:
+            self._call(self.store.put, upload.key, upload.path.read_bytes(), content_type, cache_control)
+            return
+
+        upload_id = self._call(self.store.start_multipart, upload.key, content_type, cache_control)
+        try:
+            part_etags = []
+            with upload.path.open("rb") as f:
+                while data := f.read(self.part_size):
+                    number = len(part_etags) + 1
+                    part_etags.append(self._call(self.store.put_part, upload.key, upload_id, number, data))
+            self._call(self.store.finish_multipart, upload.key, upload_id, part_etags)
+        except BaseException:
+            try:
+                self.store.abort_multipart(upload.key, upload_id)
+            except Exception:
+                logger.warning("Could not abort multipart upload %s of %s", upload_id, upload.key)
+            raise
@@ -0,0 +1,326 @@
+"""
+Full-text search over photos.
+
+A photo's document is its title and tag names (weighted highest), its
+album's title and description, and the text of its visible comments
+(lowest). Where it is kept depends on the database:
+
+    PostgreSQL  gallery_photo.search_vector, a weighted tsvector with a GIN
+                index (added by migration 0011, not a model field, so photo
+                queries never load it)
+    SQLite      gallery_photo_search, one plain row of text per photo, and
+                gallery_photo_fts, an FTS5 index over it (external content,
+                joined back on rowid)
+
+gallery.signals calls reindex() for the photos a change touches once the
+transaction commits. Code that writes without signals (bulk_create,
+update(), raw deletes) calls reindex() or rebuild() itself; the
+rebuild_search_index command rebuilds everything.
+
+search() ranks with ts_rank_cd / bm25 (or, for very common words, lists
+newest first) and pages with an opaque cursor instead of OFFSET.
+"""
+import base64
+import binascii
+import re
+import uuid
+from datetime import datetime
+
+from django.db import connection, transaction
+from django.db.models.expressions import RawSQL
+
+from .models import Photo
+
+CONFIG = "english"
+MAX_TERMS = 8
+# See search(). Counting this many matches is cheap; ranking them is not.
+RANK_LIMIT = 5000
+RANKED, NEWEST = "ranked", "newest"
+# Largest IN (...) list per statement; SQLite caps bound parameters.
+CHUNK = 500
+
+# Subqueries shared by both backends; {where} in the statements below picks the photos.
+_TAGS = (
+    "(SELECT {agg} FROM gallery_tag t JOIN gallery_photo_tags pt ON pt.tag_id = t.id"
+    " WHERE pt.photo_id = p.id)"
+)
+_COMMENTS = "(SELECT {agg} FROM gallery_comment c WHERE c.photo_id = p.id AND c.is_visible)"
+
+_POSTGRESQL_UPDATE = f"""
+    UPDATE gallery_photo p SET search_vector =
+        setweight(to_tsvector('{CONFIG}', p.title), 'A')
+        || setweight(to_tsvector('{CONFIG}', coalesce({_TAGS.format(agg="string_agg(t.name, ' ')")}, '')), 'A')
+        || setweight(to_tsvector('{CONFIG}', a.title || ' ' || a.description), 'B')
+        || setweight(to_tsvector('{CONFIG}', coalesce({_COMMENTS.format(agg="string_agg(c.text, ' ')")}, '')), 'C')
+    FROM gallery_album a
+    WHERE a.id = p.album_id {{where}}
+"""
+
+# Every search statement returns (photo id, key1, key2) in ascending key
+# order; a cursor is the last row's keys. {after} narrows to rows past it.
+_POSTGRESQL_COUNT = f"""
+    SELECT count(*) FROM (
+        SELECT 1 FROM gallery_photo WHERE search_vector @@ to_tsquery('{CONFIG}', %s) LIMIT %s
+    ) matches
+"""
+
+_POSTGRESQL_RANKED = f"""
+    SELECT id, score, id FROM (
+        SELECT p.id, -ts_rank_cd(p.search_vector, q) AS score
+        FROM gallery_photo p, to_tsquery('{CONFIG}', %s) q
+        WHERE p.search_vector @@ q
+    ) ranked
+    {{after}}
+    ORDER BY score, id
+    LIMIT %s
+"""
+_POSTGRESQL_RANKED_AFTER = "WHERE score > %s OR (score = %s AND id > %s)"
+
+# Newest first, walking the (created_at, id) index and testing each row.
+_POSTGRESQL_NEWEST = f"""
+    SELECT id, created_at, id FROM gallery_photo
+    WHERE search_vector @@ to_tsquery('{CONFIG}', %s) {{after}}
+    ORDER BY created_at DESC, id DESC
+    LIMIT %s
+"""
+_POSTGRESQL_NEWEST_AFTER = "AND (created_at, id) < (%s, %s)"
+
+_POSTGRESQL_MATCHING = f"""
+    SELECT id FROM gallery_photo
+    WHERE search_vector @@ to_tsquery('{CONFIG}', %s)
+    ORDER BY created_at DESC, id DESC
+    LIMIT %s
+"""
+
+_SQLITE_FILL = f"""
+    INSERT INTO gallery_photo_search (photo_id, title, tags, album, comments)
+    SELECT p.id, p.title,
+        coalesce({_TAGS.format(agg="group_concat(t.name, ' ')")}, ''),
+        a.title || ' ' || a.description,
+        coalesce({_COMMENTS.format(agg="group_concat(c.text, ' ')")}, '')
+    FROM gallery_photo p JOIN gallery_album a ON a.id = p.album_id
+    WHERE 1 {{where}}
+    ORDER BY p.created_at, p.id
+"""
+
+_SQLITE_COUNT = """
+    SELECT count(*) FROM (
+        SELECT 1 FROM gallery_photo_fts WHERE gallery_photo_fts MATCH %s LIMIT %s
+    ) matches
+"""
+
+# bm25 weights follow the columns: title, tags, album, comments.
+_SQLITE_RANKED = """
+    SELECT photo_id, score, photo_id FROM (
+        SELECT s.photo_id, bm25(gallery_photo_fts, 10.0, 8.0, 3.0, 1.0) AS score
+        FROM gallery_photo_fts JOIN gallery_photo_search s ON s.id = gallery_photo_fts.rowid
+        WHERE gallery_photo_fts MATCH %s
+    ) ranked
+    {after}
+    ORDER BY score, photo_id
+    LIMIT %s
+"""
+_SQLITE_RANKED_AFTER = "WHERE score > %s OR (score = %s AND photo_id > %s)"
+
+# FTS5 reads rowids in descending order without sorting. Rows are filled in
+# (created_at, id) order and a re-indexed photo gets a new rowid, so this is
+# newest first, with recently edited photos moved up.
+_SQLITE_NEWEST = """
+    SELECT s.photo_id, -gallery_photo_fts.rowid, gallery_photo_fts.rowid
+    FROM gallery_photo_fts JOIN gallery_photo_search s ON s.id = gallery_photo_fts.rowid
+    WHERE gallery_photo_fts MATCH %s {after}
+    ORDER BY gallery_photo_fts.rowid DESC
+    LIMIT %s
+"""
+_SQLITE_NEWEST_AFTER = "AND gallery_photo_fts.rowid < %s"
+
+_SQLITE_MATCHING = """
+    SELECT s.photo_id
+    FROM gallery_photo_fts JOIN gallery_photo_search s ON s.id = gallery_photo_fts.rowid
+    WHERE gallery_photo_fts MATCH %s
+    ORDER BY gallery_photo_fts.rowid DESC
+    LIMIT %s
+"""
+
+_SQLITE_FTS_ROWS = "rowid, title, tags, album, comments"
+
+
+def _db_id(photo_id):
+    return Photo._meta.pk.get_db_prep_value(photo_id, connection)
+
+
+def _chunks(photo_ids):
+    photo_ids = list(dict.fromkeys(photo_ids))
+    for start in range(0, len(photo_ids), CHUNK):
+        chunk = photo_ids[start:start + CHUNK]
+        yield ", ".join(["%s"] * len(chunk)), [_db_id(pk) for pk in chunk]
+
+
+def is_supported():
+    """Whether this database has a search index (see the module docstring)."""
+    return connection.vendor in ("postgresql", "sqlite")
+
+
+# ---- keeping the index current ----
+
+def reindex(photo_ids):
+    """Rebuild the search document of these photos (dropping any that no longer exist)."""
+    if not is_supported():
+        return
+    with transaction.atomic(), connection.cursor() as cursor:
+        for placeholders, params in _chunks(photo_ids):
+            if connection.vendor == "postgresql":
+                cursor.execute(_POSTGRESQL_UPDATE.format(where=f"AND p.id IN ({placeholders})"), params)
+                continue
+            # External-content FTS5: remove the old rows' terms before replacing the rows.
+            cursor.execute(
+                f"INSERT INTO gallery_photo_fts (gallery_photo_fts, {_SQLITE_FTS_ROWS})"
+                f" SELECT 'delete', {_SQLITE_FTS_ROWS} FROM gallery_photo_search WHERE photo_id IN ({placeholders})",
+                params,
+            )
+            cursor.execute(f"DELETE FROM gallery_photo_search WHERE photo_id IN ({placeholders})", params)
+            cursor.execute(_SQLITE_FILL.format(where=f"AND p.id IN ({placeholders})"), params)
+            cursor.execute(
+                f"INSERT INTO gallery_photo_fts ({_SQLITE_FTS_ROWS})"
+                f" SELECT {_SQLITE_FTS_ROWS} FROM gallery_photo_search WHERE photo_id IN ({placeholders})",
+                params,
+            )
+
+
+def reindex_album(album_id):
+    reindex(Photo.objects.filter(album_id=album_id).values_list("id", flat=True))
+
+
+def rebuild():
+    """Rebuild every photo's search document. Returns the number of photos indexed."""
+    if not is_supported():
+        return 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(_POSTGRESQL_UPDATE.format(where=""))
+            return cursor.rowcount
+        cursor.execute("DELETE FROM gallery_photo_search")
+        cursor.execute(_SQLITE_FILL.format(where=""))
+        count = cursor.rowcount
+        cursor.execute("INSERT INTO gallery_photo_fts (gallery_photo_fts) VALUES ('rebuild')")
+        return count
+
+
+# ---- querying ----
+
+def terms(text):
+    """The words of a search box entry, lower-cased; punctuation and operators are dropped."""
+    return re.findall(r"\w+", text.lower())[:MAX_TERMS]
+
+
+def _match_expression(words):
+    # Every word must match, the last one as a prefix (for search-as-you-type).
+    if connection.vendor == "postgresql":
+        return " & ".join(words[:-1] + [f"{words[-1]}:*"])
+    return " ".join([f'"{w}"' for w in words[:-1]] + [f'"{words[-1]}"*'])
+
+
+def matching(queryset, text, limit=RANK_LIMIT):
+    """
+    queryset narrowed to the photos search() would find for text, unranked.
+    Only the newest limit matches are kept, so a common word costs a
+    bounded IN (...) list rather than a probe per photo.
+    """
+    words = terms(text)
+    if not words:
+        return queryset.none()
+    sql = _POSTGRESQL_MATCHING if connection.vendor == "postgresql" else _SQLITE_MATCHING
+    return queryset.filter(pk__in=RawSQL(sql, [_match_expression(words), limit]))
+
+
+def encode_cursor(*values):
+    raw = "|".join(str(v) for v in values)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """The values of a search cursor, as strings, or None if it is missing or garbled."""
+    if not token:
+        return None
+    try:
+        values = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode().split("|")
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        return None
+    return values if len(values) == 3 and values[0] in (RANKED, NEWEST) else None
+
+
+class SearchPage:
+    def __init__(self, object_list, next_cursor, ranked):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.ranked = ranked
+
+    @property
+    def has_next(self):
+        return bool(self.next_cursor)
+
+
+def _statement(order, after):
+    """SQL and the cursor's parameters for one order ("ranked" / "newest") on this database."""
+    postgresql = connection.vendor == "postgresql"
+    if order == RANKED:
+        sql, clause = (
+            (_POSTGRESQL_RANKED, _POSTGRESQL_RANKED_AFTER) if postgresql
+            else (_SQLITE_RANKED, _SQLITE_RANKED_AFTER)
+        )
+        if after:
+            score, pk = float(after[0]), _db_id(uuid.UUID(after[1]))
+            return sql.format(after=clause), [score, score, pk]
+    elif postgresql:
+        sql, clause = _POSTGRESQL_NEWEST, _POSTGRESQL_NEWEST_AFTER
+        if after:
+            return sql.format(after=clause), [datetime.fromisoformat(after[0]), uuid.UUID(after[1])]
+    else:
+        sql, clause = _SQLITE_NEWEST, _SQLITE_NEWEST_AFTER
+        if after:
+            return sql.format(after=clause), [int(after[1])]
+    return sql.format(after=""), []
+
+
+def search(text, per_page, after=None):
+    """
+    One page of photos matching every word in text, best first. after is
+    a decoded cursor (see decode_cursor). Photos come with their album.
+
+    A query matching more than RANK_LIMIT photos is not ranked: scoring
+    every match is what makes a search slow, and words on that many photos
+    say little about which is best. Those come newest first.
+    """
+    words = terms(text)
+    if not words or not is_supported():
+        return SearchPage([], "", True)
+    match = _match_expression(words)
+
+    with connection.cursor() as cursor:
+        if after:
+            order = after[0]  # keep paging the way the first page was ordered
+        else:
+            cursor.execute(
+                _POSTGRESQL_COUNT if connection.vendor == "postgresql" else _SQLITE_COUNT,
+                [match, RANK_LIMIT + 1],
+            )
+            order = RANKED if cursor.fetchone()[0] <= RANK_LIMIT else NEWEST
+        try:
+            sql, after_params = _statement(order, after[1:] if after else None)
+        except ValueError:
+            return SearchPage([], "", order == RANKED)
+        cursor.execute(sql, [match, *after_params, per_page + 1])
+        rows = cursor.fetchall()
+
+    to_pk = Photo._meta.pk.to_python
+    found = Photo.objects.select_related("album").in_bulk([to_pk(row[0]) for row in rows[:per_page]])
+    photos = [found[to_pk(row[0])] for row in rows[:per_page] if to_pk(row[0]) in found]
+    next_cursor = ""
+    if len(rows) > per_page:
+        _, key1, key2 = rows[per_page - 1]
+        if isinstance(key1, datetime):
+            key1 = key1.isoformat()
+        elif isinstance(key1, float):
+            key1 = repr(key1)
+        next_cursor = encode_cursor(order, key1, to_pk(key2) if order == RANKED else key2)
+    return SearchPage(photos, next_cursor, order == RANKED)
@@ -0,0 +1,151 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import search, stats, versions
+from .models import Album, Comment, Favorite, Photo, Tag
+from .tag_index import tag_index
+
+
+# Index updates wait for the transaction to commit, so a rolled-back edit
+# never shows up in the tag filters.
+
+@receiver(post_save, sender=Photo)
+def photo_saved(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: tag_index.photo_created(instance.pk, instance.created_at))
+        Album.objects.filter(pk=instance.album_id).update(photo_count=F("photo_count") + 1)
+        Album.objects.filter(pk=instance.album_id, cover_thumb="").update(cover_thumb=instance.image_thumb)
+        # The same instance may be moved and saved again later.
+        instance._loaded_album_id = instance.album_id
+        return
+
+    old_album_id = getattr(instance, "_loaded_album_id", None)
+    if old_album_id is not None and old_album_id != instance.album_id:
+        # Moved to another album.
+        Album.objects.filter(pk__in=[old_album_id, instance.album_id]).refresh_counters()
+    instance._loaded_album_id = instance.album_id
+
+
+@receiver(post_delete, sender=Photo)
+def photo_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: tag_index.photo_deleted(instance.pk))
+    albums = Album.objects.filter(pk=instance.album_id)
+    if albums.filter(cover_thumb=instance.image_thumb).exists():
+        albums.refresh_counters()
+    else:
+        albums.update(photo_count=F("photo_count") - 1)
+
+
+@receiver(post_delete, sender=Tag)
+def tag_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: tag_index.tag_cleared(instance.pk))
+
+
+@receiver(m2m_changed, sender=Photo.tags.through)
+def photo_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # reverse=False: photo.tags.add(...) -> instance is a Photo, pk_set are tag ids.
+    # reverse=True:  tag.photos.add(...) -> instance is a Tag, pk_set are photo ids.
+    if action == "post_add":
+        if reverse:
+            photo_ids, tag_ids = set(pk_set), {instance.pk}
+        else:
+            photo_ids, tag_ids = {instance.pk}, set(pk_set)
+        transaction.on_commit(lambda: tag_index.tags_added(photo_ids, tag_ids))
+    elif action == "post_remove":
+        if reverse:
+            photo_ids, tag_ids = set(pk_set), {instance.pk}
+        else:
+            photo_ids, tag_ids = {instance.pk}, set(pk_set)
+        transaction.on_commit(lambda: tag_index.tags_removed(photo_ids, tag_ids))
+    elif action == "post_clear":
+        if reverse:
+            transaction.on_commit(lambda: tag_index.tag_cleared(instance.pk))
+        else:
+            transaction.on_commit(lambda: tag_index.tags_removed({instance.pk}))
+
+
+def stats_changed(sender, created=True, **kwargs):
+    # Only creates and deletes move the home page counts / latest lists.
+    if created:
+        transaction.on_commit(stats.invalidate)
+
+
+for model in (Album, Photo, Tag, Comment):
+    post_save.connect(stats_changed, sender=model, dispatch_uid=f"stats_saved_{model.__name__}")
+    post_delete.connect(stats_changed, sender=model, dispatch_uid=f"stats_deleted_{model.__name__}")
+
+
+def catalog_changed(sender, action="post_", **kwargs):
+    # Any photo/tag edit can change what a grid fragment renders.
+    if action.startswith("post_"):
+        transaction.on_commit(lambda: versions.bump("catalog"))
+
+
+for model in (Photo, Tag):
+    post_save.connect(catalog_changed, sender=model, dispatch_uid=f"catalog_saved_{model.__name__}")
+    post_delete.connect(catalog_changed, sender=model, dispatch_uid=f"catalog_deleted_{model.__name__}")
+m2m_changed.connect(catalog_changed, sender=Photo.tags.through, dispatch_uid="catalog_tags_changed")
+
+
+@receiver([post_save, post_delete], sender=Favorite)
+def favorites_changed(sender, instance, **kwargs):
+    key = versions.favorites_key(instance.user_id)
+    transaction.on_commit(lambda: versions.bump(key))
+
+
+@receiver([post_save, post_delete], sender=Album)
+def albums_changed(sender, **kwargs):
+    transaction.on_commit(lambda: versions.bump("albums"))
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def comments_changed(sender, instance, **kwargs):
+    key = versions.comments_key(instance.photo_id)
+    transaction.on_commit(lambda: versions.bump(key))
+
+
+# ---- search documents (see gallery.search) ----
+# Re-read from the database after the commit, like the tag index above.
+
+def _reindex_on_commit(photo_ids):
+    transaction.on_commit(lambda: search.reindex(photo_ids))
+
+
+@receiver([post_save, post_delete], sender=Photo)
+def photo_search_changed(sender, instance, **kwargs):
+    _reindex_on_commit([instance.pk])
+
+
+@receiver(post_save, sender=Album)
+def album_search_changed(sender, instance, created, **kwargs):
+    if not created:
+        transaction.on_commit(lambda: search.reindex_album(instance.pk))
+
+
+@receiver(post_save, sender=Tag)
+def tag_search_changed(sender, instance, created, **kwargs):
+    if not created:
+        _reindex_on_commit(list(instance.photos.values_list("id", flat=True)))
+
+
+@receiver(pre_delete, sender=Tag)
+def tag_search_deleting(sender, instance, **kwargs):
+    # The photo_tags rows go with the tag and send no m2m_changed.
+    _reindex_on_commit(list(instance.photos.values_list("id", flat=True)))
+
+
+@receiver(m2m_changed, sender=Photo.tags.through)
+def photo_tags_search_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ("post_add", "post_remove"):
+        _reindex_on_commit(list(pk_set) if reverse else [instance.pk])
+    elif action == "pre_clear" and reverse:
+        _reindex_on_commit(list(instance.photos.values_list("id", flat=True)))
+    elif action == "post_clear" and not reverse:
+        _reindex_on_commit([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def comment_search_changed(sender, instance, **kwargs):
+    _reindex_on_commit([instance.photo_id])
@@ -0,0 +1,90 @@
+"""
+Cached numbers for the home page.
+
+The counts and "recently added" lists are built once and kept in the
+default cache until a model save/delete (see gallery.signals) or an import
+invalidates them. Hits and misses are counted in the cache as well, so the
+rate covers every worker sharing it.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from .models import Album, Comment, Photo, Tag
+
+STATS_KEY = "gallery:home:stats"
+HITS_KEY = "gallery:home:stats:hits"
+MISSES_KEY = "gallery:home:stats:misses"
+# Safety net in case an invalidation is missed (e.g. a raw SQL edit).
+STATS_TTL = 60 * 60
+LATEST_PHOTO_FIELDS = ("id", "image_thumb", "renditions", "width", "height", "dominant_color", "placeholder")
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def _estimated_counts(models):
+    """Row estimates from pg_class; only meaningful on PostgreSQL after ANALYZE."""
+    tables = [m._meta.db_table for m in models]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT relname, reltuples::bigint FROM pg_class WHERE relname = ANY(%s)",
+            [tables],
+        )
+        found = dict(cursor.fetchall())
+    # reltuples is -1 for a never-analyzed table.
+    return [max(found.get(t, 0), 0) for t in tables]
+
+
+def _build():
+    models = (Album, Photo, Tag, Comment)
+    if settings.GALLERY_STATS_ESTIMATES and connection.vendor == "postgresql":
+        counts = _estimated_counts(models)
+    else:
+        counts = [m.objects.count() for m in models]
+
+    return {
+        "counts": dict(zip(("albums", "photos", "tags", "comments"), counts)),
+        "latest_albums": list(Album.objects.order_by("-created_at").values("id", "title")[:5]),
+        "latest_photos": [
+            {
+                "id": p.id,
+                "image_thumb": p.image_thumb,
+                "jpeg_srcset": p.jpeg_srcset,
+                "webp_srcset": p.webp_srcset,
+                "width": p.width,
+                "height": p.height,
+                "dominant_color": p.dominant_color,
+                "placeholder": p.placeholder,
+            }
+            for p in Photo.objects.order_by("-created_at").only(*LATEST_PHOTO_FIELDS)[:12]
+        ],
+    }
+
+
+def site_stats():
+    data = cache.get(STATS_KEY)
+    if data is None:
+        _bump(MISSES_KEY)
+        data = _build()
+        cache.set(STATS_KEY, data, STATS_TTL)
+    else:
+        _bump(HITS_KEY)
+    return data
+
+
+def invalidate():
+    cache.delete(STATS_KEY)
+
+
+def hit_rate():
+    """(hits, misses, ratio) since the counters were last cleared."""
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return hits, misses, (hits / total if total else 0.0)
@@ -0,0 +1,241 @@
+"""
+In-process inverted index for the photo_browser tag filters.
+
+Every photo gets a dense ordinal in (created_at, id) order and every tag a
+bitmap of the ordinals it is on (a plain Python int, so AND / OR / NOT are
+single big-integer operations). "Must match all selected tags" becomes an
+AND of a few bitmaps, "untagged" is everything minus the OR of all tag
+bitmaps, and a page is the highest set bits below the cursor. Only that
+page's rows are then fetched from the database.
+
+The index is built lazily on first use in each process and kept current by
+the signal handlers in gallery.signals. Every change, here or elsewhere
+(another worker, a management command, bulk_create), increments the
+"tag_index" counter in gallery.versions. A process that applied a change
+itself keeps its index only if the increment took the counter from the
+value it was built at to exactly one more; anything else means another
+process changed something too, and it rebuilds.
+"""
+import threading
+from bisect import bisect_left, bisect_right
+
+from . import versions
+
+VERSION_NAME = "tag_index"
+
+
+def bump_version():
+    """Tell every process its index is stale. Returns the new counter value."""
+    return versions.increment(VERSION_NAME)
+
+
+def _top_bits(bits, n):
+    """Positions of the n highest set bits, highest first, plus what is left."""
+    out = []
+    while bits and len(out) < n:
+        b = bits.bit_length() - 1
+        out.append(b)
+        bits ^= 1 << b
+    return out, bits
+
+
+def _bottom_bits(bits, n):
+    """Positions of the n lowest set bits, lowest first, plus what is left."""
+    out = []
+    while bits and len(out) < n:
+        low = bits & -bits
+        out.append(low.bit_length() - 1)
+        bits ^= low
+    return out, bits
+
+
+class TagIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._version = None
+        self._keys = None        # ordinal -> (created_at, id), ascending
+        self._ordinal = {}       # photo id -> ordinal
+        self._all = 0            # bitmap of live photos
+        self._tags = {}          # tag id -> bitmap
+
+    # ---- building ----
+
+    def _current(self):
+        version = versions.counter(VERSION_NAME)
+        if self._keys is None or version != self._version:
+            self._build(version)
+
+    def _build(self, version):
+        from .models import Photo
+
+        keys = list(Photo.objects.order_by("created_at", "id").values_list("created_at", "id"))
+        ordinal = {pk: i for i, (_, pk) in enumerate(keys)}
+
+        tags = {}
+        through = Photo.tags.through.objects.values_list("photo_id", "tag_id")
+        for photo_id, tag_id in through.iterator(chunk_size=5000):
+            i = ordinal.get(photo_id)
+            if i is not None:
+                tags[tag_id] = tags.get(tag_id, 0) | (1 << i)
+
+        self._keys = keys
+        self._ordinal = ordinal
+        self._all = (1 << len(keys)) - 1
+        self._tags = tags
+        self._version = version
+
+    def clear(self):
+        """Forget the index; the next read rebuilds it (tests, between databases)."""
+        with self._lock:
+            self._keys = None
+
+    def _apply(self, change):
+        """
+        Run an incremental update and increment the counter. Unless nobody
+        else incremented it since this index was built, the index is dropped
+        and rebuilt on the next read instead.
+        """
+        with self._lock:
+            new_version = bump_version()
+            up_to_date = self._keys is not None and new_version == self._version + 1
+            if up_to_date and change() is not False:
+                self._version = new_version
+            else:
+                self._keys = None
+
+    # ---- queries ----
+
+    def match(self, tag_ids, untagged=False):
+        """
+        Bitmap of photos carrying every tag in tag_ids (None entries, i.e.
+        unknown slugs, match nothing), restricted to untagged photos if asked.
+        """
+        with self._lock:
+            self._current()
+            return self._match(tag_ids, untagged)
+
+    def page(self, bits, per_page, after=None, before=None):
+        """
+        Photo ids for one page of a match() bitmap, newest first, using the
+        same (created_at, id) cursors as pagination.keyset_page.
+
+        Returns (ids, has_next, has_previous). The bitmap's ordinals only
+        mean anything until the next rebuild; use match_page() to match and
+        page in one go.
+        """
+        with self._lock:
+            self._current()
+            return self._page(bits, per_page, after, before)
+
+    def match_page(self, tag_ids, untagged, per_page, after=None, before=None):
+        """
+        match() and page() against the same build of the index, so a rebuild
+        in between can't renumber the bitmap under the page.
+
+        Returns (ids, has_next, has_previous, total matches).
+        """
+        with self._lock:
+            self._current()
+            bits = self._match(tag_ids, untagged)
+            return (*self._page(bits, per_page, after, before), bits.bit_count())
+
+    def _match(self, tag_ids, untagged):
+        bits = self._all
+        for tag_id in tag_ids:
+            bits &= self._tags.get(tag_id, 0)
+        if untagged:
+            tagged = 0
+            for tag_bits in self._tags.values():
+                tagged |= tag_bits
+            bits &= ~tagged
+        return bits
+
+    def _page(self, bits, per_page, after, before):
+        keys = self._keys
+
+        if before:
+            pos = bisect_right(keys, tuple(before))
+            found, rest = _bottom_bits(bits >> pos << pos, per_page)
+            if rest:
+                return [keys[i][1] for i in reversed(found)], True, True
+            # Walked back to the start: show a full first page instead.
+            after = None
+
+        if after:
+            pos = bisect_left(keys, tuple(after))
+            bits &= (1 << pos) - 1
+
+        found, rest = _top_bits(bits, per_page)
+        return [keys[i][1] for i in found], bool(rest), bool(after)
+
+    def neighbors(self, photo_id, tag_ids=(), untagged=False):
+        """
+        The photos either side of photo_id among match(tag_ids, untagged),
+        in newest-first order: (newer id, older id), either may be None.
+        """
+        with self._lock:
+            self._current()
+            bits = self._match(tag_ids, untagged)
+            i = self._ordinal.get(photo_id)
+            if i is None:
+                return None, None
+            older = bits & ((1 << i) - 1)
+            newer = bits >> (i + 1)
+            older_id = self._keys[older.bit_length() - 1][1] if older else None
+            newer_id = self._keys[i + (newer & -newer).bit_length()][1] if newer else None
+            return newer_id, older_id
+
+    # ---- incremental updates (called from gallery.signals) ----
+
+    def photo_created(self, photo_id, created_at):
+        def change():
+            if self._keys and (created_at, photo_id) < self._keys[-1]:
+                return False  # out of order; let the next read rebuild
+            self._ordinal[photo_id] = len(self._keys)
+            self._all |= 1 << len(self._keys)
+            self._keys.append((created_at, photo_id))
+
+        self._apply(change)
+
+    def photo_deleted(self, photo_id):
+        def change():
+            i = self._ordinal.pop(photo_id, None)
+            if i is not None:
+                # Tag bitmaps keep the stale bit; every query starts from _all.
+                self._all &= ~(1 << i)
+
+        self._apply(change)
+
+    def tags_added(self, photo_ids, tag_ids):
+        def change():
+            for photo_id in photo_ids:
+                i = self._ordinal.get(photo_id)
+                if i is None:
+                    return False
+                for tag_id in tag_ids:
+                    self._tags[tag_id] = self._tags.get(tag_id, 0) | (1 << i)
+
+        self._apply(change)
+
+    def tags_removed(self, photo_ids, tag_ids=None):
+        """Remove tag_ids from the photos; tag_ids=None means every tag (clear())."""
+        def change():
+            for photo_id in photo_ids:
+                i = self._ordinal.get(photo_id)
+                if i is None:
+                    continue
+                mask = ~(1 << i)
+                for tag_id in (self._tags if tag_ids is None else tag_ids):
+                    if tag_id in self._tags:
+                        self._tags[tag_id] &= mask
+
+        self._apply(change)
+
+    def tag_cleared(self, tag_id):
+        def change():
+            self._tags.pop(tag_id, None)
+
+        self._apply(change)
+
+
+tag_index = TagIndex()
@@ -0,0 +1,41 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from gallery.models import Photo
+from gallery.tag_index import tag_index
+
+LOCMEM = "django.core.cache.backends.locmem.LocMemCache"
+
+
+@override_settings(CACHES={
+    "default": {"BACKEND": LOCMEM, "LOCATION": "gallery-tests"},
+    "versions": {"BACKEND": LOCMEM, "LOCATION": "gallery-tests-versions"},
+})
+class SeededTestCase(TestCase):
+    """
+    A small seed_gallery library (more than one admin changelist page of
+    photos and comments) and a superuser, with caches that start empty in
+    every test.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            "seed_gallery", albums=4, photos=250, tags=12, users=3, favorites=5, comments=250,
+            stdout=StringIO(),
+        )
+        cls.user = get_user_model().objects.create_superuser("tester", "tester@example.com", "pw")
+        cls.photo = Photo.objects.filter(comments__isnull=False, tags__isnull=False).order_by("-created_at").first()
+        cls.album = cls.photo.album
+        cls.tag = cls.photo.tags.order_by("id").first()
+
+    def setUp(self):
+        for alias in ("default", "versions"):
+            caches[alias].clear()
+        # The counter it was built at just went back to 0 with the cache.
+        tag_index.clear()
+        self.client.force_login(self.user)
@@ -0,0 +1,84 @@
+from unittest import mock
+
+from django.db import connection
+from django.urls import reverse
+
+from gallery.models import Comment, Photo
+from gallery.pagination import EstimatedCountPaginator
+
+from .base import SeededTestCase
+
+# Session and user, then the page: as a superuser there are no permission queries.
+REQUEST_QUERIES = 2
+# A count and one page of rows (the photo's album and the comment's photo and
+# user are joined in), however many rows the table holds.
+CHANGELIST_QUERIES = REQUEST_QUERIES + 2
+
+
+@mock.patch("gallery.pagination.ESTIMATE_ABOVE", 100)
+class AdminQueryTests(SeededTestCase):
+    """
+    Query counts for the changelists and change forms of the tables that
+    grow with the library. ESTIMATE_ABOVE is lowered under the fixture's
+    size, so on PostgreSQL the unfiltered lists take the planner estimate.
+    """
+
+    def setUp(self):
+        super().setUp()
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(f"ANALYZE {Photo._meta.db_table}, {Comment._meta.db_table}")
+
+    def get(self, url, queries):
+        # Once to fill per-process caches (content types), as in a running server.
+        self.client.get(url)
+        with self.assertNumQueries(queries):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def assert_changelist(self, response, count):
+        cl = response.context["cl"]
+        self.assertIsInstance(cl.paginator, EstimatedCountPaginator)
+        self.assertEqual(cl.result_count, count)
+        self.assertIsNone(cl.full_result_count)  # show_full_result_count=False: no second count
+
+    def test_photo_changelist(self):
+        url = reverse("admin:gallery_photo_changelist")
+        response = self.get(url, CHANGELIST_QUERIES)
+        self.assert_changelist(response, Photo.objects.count())
+        self.assertGreater(response.context["cl"].paginator.num_pages, 2)
+        self.get(f"{url}?p=2", CHANGELIST_QUERIES)
+
+    def test_photo_changelist_search(self):
+        response = self.get(
+            f"{reverse('admin:gallery_photo_changelist')}?q={self.album.title}", CHANGELIST_QUERIES
+        )
+        # Full-text matching: other albums' titles share words with this one.
+        cl = response.context["cl"]
+        self.assertIsNone(cl.full_result_count)
+        self.assertGreaterEqual(cl.result_count, self.album.photos.count())
+        self.assertLess(cl.result_count, Photo.objects.count())
+
+    def test_photo_change(self):
+        # The photo and its tags, the album choices, and the selected tags again for the widget.
+        self.get(reverse("admin:gallery_photo_change", args=[self.photo.pk]), REQUEST_QUERIES + 4)
+
+    def test_comment_changelist(self):
+        url = reverse("admin:gallery_comment_changelist")
+        response = self.get(url, CHANGELIST_QUERIES)
+        self.assert_changelist(response, Comment.objects.count())
+        self.assertGreater(response.context["cl"].paginator.num_pages, 2)
+        self.get(f"{url}?p=2", CHANGELIST_QUERIES)
+
+    def test_comment_changelist_search(self):
+        user = self.photo.comments.first().user
+        response = self.get(
+            f"{reverse('admin:gallery_comment_changelist')}?q={user.username}", CHANGELIST_QUERIES
+        )
+        self.assert_changelist(response, Comment.objects.filter(user=user).count())
+
+    def test_comment_change(self):
+        # The comment, its user and photo, and the autocomplete widgets' selected photo and user.
+        comment = self.photo.comments.first()
+        self.get(reverse("admin:gallery_comment_change", args=[comment.pk]), REQUEST_QUERIES + 5)
@@ -0,0 +1,79 @@
+from django.urls import reverse
+
+from gallery.models import Tag
+
+from .base import SeededTestCase
+
+# Session and user lookups; the 304 itself is decided from version stamps.
+NOT_MODIFIED_QUERIES = 2
+
+
+class ConditionalGetTests(SeededTestCase):
+    def pages(self):
+        return {
+            "album_list": reverse("album_list"),
+            "album_detail": reverse("album_detail", args=[self.album.pk]),
+            "photo_detail": reverse("photo_detail", args=[self.photo.pk]),
+            "photo_browser": reverse("photo_browser"),
+            "photo_browser?tags": f"{reverse('photo_browser')}?tags={self.tag.slug}",
+        }
+
+    def etags(self):
+        etags = {}
+        for name, url in self.pages().items():
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, name)
+            etags[name] = response["ETag"]
+        return etags
+
+    def test_revalidation_is_not_modified(self):
+        for name, url in self.pages().items():
+            with self.subTest(name):
+                response = self.client.get(url)
+                etag, last_modified = response["ETag"], response["Last-Modified"]
+
+                with self.assertNumQueries(NOT_MODIFIED_QUERIES):
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+
+                with self.assertNumQueries(NOT_MODIFIED_QUERIES):
+                    response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+                self.assertEqual(response.status_code, 304)
+
+    def test_first_page_of_a_session_revalidates(self):
+        # The first response creates the CSRF cookie; its ETag must already include it.
+        for name, url in self.pages().items():
+            with self.subTest(name):
+                self.client.logout()
+                self.client.cookies.clear()
+                self.client.force_login(self.user)
+                etag = self.client.get(url)["ETag"]
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_comment_changes_photo_detail(self):
+        before = self.etags()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("photo_detail", args=[self.photo.pk]), {"text": "Nice one"})
+        self.assertEqual(response.status_code, 302)
+        after = self.etags()
+        self.assertNotEqual(before["photo_detail"], after["photo_detail"])
+
+    def test_favorite_changes_every_page(self):
+        before = self.etags()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("toggle_favorite", args=[self.photo.pk]))
+        self.assertEqual(response.status_code, 302)
+        after = self.etags()
+        for name in before:
+            self.assertNotEqual(before[name], after[name], name)
+
+    def test_tag_edit_changes_every_page(self):
+        other = Tag.objects.exclude(photos=self.photo).order_by("id").first()
+        tags = [*self.photo.tags.values_list("id", flat=True), other.pk]
+        before = self.etags()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("edit_photo_tags", args=[self.photo.pk]), {"tags": tags})
+        self.assertEqual(response.status_code, 302)
+        after = self.etags()
+        for name in before:
+            self.assertNotEqual(before[name], after[name], name)
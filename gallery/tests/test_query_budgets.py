@@ -0,0 +1,34 @@
+from io import StringIO
+
+from gallery.management.commands import bench_views
+
+from .base import SeededTestCase
+
+
+class QueryBudgetTests(SeededTestCase):
+    """The bench_views harness as a test: every URL within its QUERY_BUDGETS entry, caches cold."""
+
+    def setUp(self):
+        super().setUp()
+        self.bench = bench_views.Command(stdout=StringIO())
+        self.bench.setup(self.user.username)
+        self.bench.client = self.client
+        self.cases = list(self.bench.cases())
+
+    def test_every_url_has_a_budget(self):
+        names = {name for name, *_ in self.cases}
+        self.assertEqual(names - set(bench_views.QUERY_BUDGETS), set(), "URLs without a budget")
+        self.assertEqual(set(bench_views.QUERY_BUDGETS) - names, set(), "budgets for URLs that are gone")
+
+    def test_cold_queries_within_budget(self):
+        for _, method, url, data in self.cases:
+            self.bench.request(method, url, data)  # build the tag index, fill content types, etc.
+
+        for name, method, url, data in self.cases:
+            self.bench.make_cold()
+            status, queries, _ = self.bench.request(method, url, data)
+            if name in bench_views.TOGGLES:
+                self.bench.request(method, url, data)  # leave the favorite as it was
+            with self.subTest(name, url=url):
+                self.assertLess(status, 400)
+                self.assertLessEqual(queries, bench_views.QUERY_BUDGETS[name])
@@ -0,0 +1,89 @@
+"""
+EXPLAIN every statement the gallery URLs run with cold caches and fail if
+a plan reads a whole table and then sorts it: an index the query needs is
+missing, and the page gets slower as the library grows.
+"""
+import re
+from io import StringIO
+from unittest import skipUnless
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from gallery.management.commands import bench_views
+from gallery.tag_index import bump_version
+
+from .base import SeededTestCase
+
+EXPLAINED = ("SELECT", "WITH", "UPDATE", "DELETE")
+
+SQLITE_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)$")
+SQLITE_SORT = re.compile(r"^USE TEMP B-TREE FOR .*ORDER BY")
+POSTGRESQL_SCAN = re.compile(r"Seq Scan on (\w+)")
+POSTGRESQL_SORT = re.compile(r"^\s*(?:->\s+)?Sort\b")
+
+
+def explain(sql):
+    """The plan for one captured statement, as text lines."""
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute("EXPLAIN QUERY PLAN " + sql)
+            return [row[-1] for row in cursor.fetchall()]
+        # Only a missing index should produce a Seq Scan, not a small table's cheap plan.
+        cursor.execute("SET enable_seqscan = off")
+        try:
+            cursor.execute("EXPLAIN " + sql)
+            return [row[0] for row in cursor.fetchall()]
+        finally:
+            cursor.execute("RESET enable_seqscan")
+
+
+def scan_and_sort(plan):
+    """Tables read in full by a plan that also sorts, or [] if it doesn't do both."""
+    scan, sort = {
+        "sqlite": (SQLITE_SCAN, SQLITE_SORT),
+        "postgresql": (POSTGRESQL_SCAN, POSTGRESQL_SORT),
+    }[connection.vendor]
+    tables = [m.group(1) for line in plan for m in [scan.search(line.strip())] if m]
+    if tables and any(sort.search(line) for line in plan):
+        return tables
+    return []
+
+
+class QueryPlanTests(SeededTestCase):
+    def assert_no_scan_and_sort(self):
+        bench = bench_views.Command(stdout=StringIO())
+        bench.setup(self.user.username)
+        bench.client = self.client
+        bump_version()  # the first filtered request rebuilds the tag index, so its query is checked too
+
+        seen = set()
+        for name, method, url, data in bench.cases():
+            bench.make_cold()
+            with CaptureQueriesContext(connection) as ctx:
+                response = bench.fetch(method, url, data)
+            # Before the next request: request_started clears the log ctx reads from.
+            statements = [q["sql"] for q in ctx if q["sql"].lstrip().upper().startswith(EXPLAINED)]
+            if name in bench_views.TOGGLES:
+                bench.fetch(method, url, data)  # leave the favorite as it was
+            self.assertLess(response.status_code, 400, f"{name}: {url}")
+
+            for sql in statements:
+                if sql in seen:
+                    continue
+                seen.add(sql)
+                plan = explain(sql)
+                with self.subTest(name, sql=sql[:200]):
+                    self.assertEqual(
+                        scan_and_sort(plan), [],
+                        "full scan plus a sort:\n    " + "\n    ".join(plan),
+                    )
+        self.assertTrue(seen)
+
+    @skipUnless(connection.vendor == "sqlite", "SQLite plans")
+    def test_sqlite(self):
+        self.assert_no_scan_and_sort()
+
+    @skipUnless(connection.vendor == "postgresql", "PostgreSQL plans")
+    def test_postgresql(self):
+        self.assert_no_scan_and_sort()
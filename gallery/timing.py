@@ -0,0 +1,143 @@
+"""
+Rolling per-view latency numbers, kept in process memory.
+
+RequestTimingMiddleware (gallery.middleware) calls record() once per
+request with the wall time, query count and DB time. Each view name gets a
+histogram over fixed, geometrically spaced buckets, so recording is a
+bisect and a few integer additions, and p50/p95/p99 come from the bucket
+counts (to within one bucket, about 15%). Buckets live in one-minute
+windows and only the last WINDOWS of them are reported, so the numbers
+follow the current traffic rather than everything since start-up.
+
+Every worker process keeps its own numbers; snapshot() says which pid
+they came from.
+"""
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+WINDOW_SECONDS = 60
+WINDOWS = 10
+SLOW_LOG_SIZE = 50
+
+# Bucket upper bounds in ms: 0.5ms to ~2 minutes, 15% apart.
+BOUNDS = []
+_b = 0.5
+while _b < 120_000:
+    BOUNDS.append(round(_b, 3))
+    _b *= 1.15
+del _b
+
+
+class _ViewWindow:
+    __slots__ = ("buckets", "count", "total_ms", "max_ms", "queries", "db_ms")
+
+    def __init__(self):
+        self.buckets = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.queries = 0
+        self.db_ms = 0.0
+
+
+def _percentile(stats, fraction):
+    """Upper bound of the bucket holding the given rank, capped at the slowest request seen."""
+    rank = max(1, round(stats.count * fraction))
+    seen = 0
+    for i, n in enumerate(stats.buckets):
+        seen += n
+        if seen >= rank:
+            break
+    bound = BOUNDS[i] if i < len(BOUNDS) else stats.max_ms
+    return round(min(bound, stats.max_ms), 1)
+
+
+class RequestTimings:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._windows = deque(maxlen=WINDOWS)  # (window number, {view name: _ViewWindow})
+        self._slow = deque(maxlen=SLOW_LOG_SIZE)
+
+    def record(self, name, path, status, wall_ms, queries, db_ms):
+        window = int(time.monotonic() // WINDOW_SECONDS)
+        with self._lock:
+            if not self._windows or self._windows[-1][0] != window:
+                self._windows.append((window, {}))
+            views = self._windows[-1][1]
+            stats = views.get(name)
+            if stats is None:
+                stats = views[name] = _ViewWindow()
+            stats.buckets[bisect_left(BOUNDS, wall_ms)] += 1
+            stats.count += 1
+            stats.total_ms += wall_ms
+            stats.queries += queries
+            stats.db_ms += db_ms
+            if wall_ms > stats.max_ms:
+                stats.max_ms = wall_ms
+
+        if wall_ms >= settings.GALLERY_SLOW_REQUEST_MS:
+            self._slow.append({
+                "at": time.time(),
+                "view": name,
+                "path": path,
+                "status": status,
+                "ms": round(wall_ms, 1),
+                "queries": queries,
+                "db_ms": round(db_ms, 1),
+            })
+            logger.warning(
+                "Slow request: %s %s took %.0f ms (%d queries, %.0f ms in the DB)",
+                name, path, wall_ms, queries, db_ms,
+            )
+
+    def snapshot(self):
+        """Per-view numbers over the last WINDOWS windows, slowest p95 first."""
+        oldest = int(time.monotonic() // WINDOW_SECONDS) - WINDOWS + 1
+        merged = {}
+        with self._lock:
+            for window, views in self._windows:
+                if window < oldest:
+                    continue
+                for name, stats in views.items():
+                    total = merged.setdefault(name, _ViewWindow())
+                    total.buckets = [a + b for a, b in zip(total.buckets, stats.buckets)]
+                    total.count += stats.count
+                    total.total_ms += stats.total_ms
+                    total.queries += stats.queries
+                    total.db_ms += stats.db_ms
+                    total.max_ms = max(total.max_ms, stats.max_ms)
+            slow = list(self._slow)
+
+        views = [
+            {
+                "view": name,
+                "requests": s.count,
+                "mean_ms": round(s.total_ms / s.count, 1),
+                "p50_ms": _percentile(s, 0.50),
+                "p95_ms": _percentile(s, 0.95),
+                "p99_ms": _percentile(s, 0.99),
+                "max_ms": round(s.max_ms, 1),
+                "queries_per_request": round(s.queries / s.count, 1),
+                "db_ms_per_request": round(s.db_ms / s.count, 1),
+            }
+            for name, s in merged.items()
+        ]
+        views.sort(key=lambda v: v["p95_ms"], reverse=True)
+        return {
+            "pid": os.getpid(),
+            "window_seconds": WINDOW_SECONDS * WINDOWS,
+            "slow_request_ms": settings.GALLERY_SLOW_REQUEST_MS,
+            "views": views,
+            "slow_requests": slow[::-1],
+        }
+
+
+timings = RequestTimings()
@@ -10,7 +10,14 @@ urlpatterns = [
     path("photo/<uuid:photo_id>/favorite/", views.toggle_favorite, name="toggle_favorite"),
     path("favorites/", views.favorites, name="favorites"),
     path("comments/", views.recent_comments, name="recent_comments"),
+    path("search/", views.search_photos, name="search"),
     path("uploading_photos/", views.uploading_photos, name="uploading_photos"),
     path("photo/<uuid:photo_id>/tags/", views.edit_photo_tags, name="edit_photo_tags"),
+    path("staff/timings/", views.request_timings, name="request_timings"),
+    path("api/photo/<uuid:photo_id>/favorite/", views.api_toggle_favorite, name="api_toggle_favorite"),
+    path("api/favorites/", views.api_favorites, name="api_favorites"),
+    path("album/<uuid:album_id>/download/", views.album_download, name="album_download"),
+    path("photos/download/", views.photo_browser_download, name="photo_browser_download"),
+    path("favorites/download/", views.favorites_download, name="favorites_download"),
 
 ]
\ No newline at end of file
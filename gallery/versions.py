@@ -0,0 +1,89 @@
+"""
+Named version stamps kept in the shared "versions" cache.
+
+A stamp is a token that changes whenever the data it describes changes,
+so anything derived from that data (a rendered fragment, an in-process
+index, an ETag) can be keyed on it and never needs explicit invalidation.
+Tokens start with the time they were issued, which doubles as a
+Last-Modified value. Stamps in use:
+
+    catalog           photos, tags and tag assignments
+    albums            album rows (title, description, counters)
+    comments:<id>     one photo's comments
+    favorites:<id>    one user's favorites
+
+Counters are the same idea where a holder must tell its own change from
+someone else's: increment() is the cache's atomic incr, so whoever gets
+n + 1 back from n knows nobody else changed anything in between.
+
+    tag_index         see gallery.tag_index
+"""
+import time
+import uuid
+from datetime import datetime, timezone
+
+from django.core.cache import caches
+from django.utils.connection import ConnectionProxy
+
+# A cache of their own (settings.CACHES["versions"]), so culling fragments can't evict them.
+cache = ConnectionProxy(caches, "versions")
+
+KEY_PREFIX = "gallery:version:"
+COUNTER_PREFIX = "gallery:counter:"
+
+
+def _new_token():
+    return f"{time.time_ns()}-{uuid.uuid4().hex[:12]}"
+
+
+def get(name):
+    key = KEY_PREFIX + name
+    version = cache.get(key)
+    if version is None:
+        # Never set, or evicted: agree on a fresh token (add() won't overwrite a racing one).
+        cache.add(key, _new_token(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump(name):
+    version = _new_token()
+    cache.set(KEY_PREFIX + name, version, None)
+    return version
+
+
+def counter(name):
+    key = COUNTER_PREFIX + name
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, 0, None)
+        value = cache.get(key)
+    return value
+
+
+def increment(name):
+    """Add one to the counter and return the new value, atomically where the cache backend is."""
+    key = COUNTER_PREFIX + name
+    while True:
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # Never set, or evicted. Start it over; a racing add() wins and we incr that.
+            if cache.add(key, 1, None):
+                return 1
+
+
+def issued_at(version):
+    """When a token was issued, as an aware datetime (None for a token without a time)."""
+    try:
+        return datetime.fromtimestamp(int(version.split("-", 1)[0]) / 1e9, tz=timezone.utc)
+    except ValueError:
+        return None
+
+
+def favorites_key(user_id):
+    return f"favorites:{user_id}"
+
+
+def comments_key(photo_id):
+    return f"comments:{photo_id}"
@@ -1,56 +1,180 @@
+import asyncio
+import json
+import uuid
 from urllib import request
-from django.shortcuts import get_object_or_404, render, redirect
+from asgiref.sync import sync_to_async
+from django.http import Http404, JsonResponse
+from django.shortcuts import aget_object_or_404, get_object_or_404, render, redirect
 from .models import Album, Photo, Tag, Comment, Favorite
 from django.db.models import Count, Q
-from django.core.paginator import Paginator
+from django.conf import settings
+from django.core.cache import cache
 from django.contrib.auth.decorators import login_required
 from django.db.models import Exists, OuterRef
+from django.utils.text import slugify
+from django.middleware.csrf import get_token
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_POST
+import hashlib
 from django.contrib.auth.decorators import permission_required
+from django.contrib.admin.views.decorators import staff_member_required
 from .forms import PhotoTagsForm, CreateTagForm
+from .neighbors import neighbors
+from .pagination import PHOTOS_PER_PAGE, KeysetPage, decode_cursor, keyset_page
+from .stats import hit_rate as stats_hit_rate, site_stats
+from .tag_index import tag_index
+from .timing import timings
+from . import favorites as favorite_writes  # the favorites view takes the plain name
+from . import downloads, media, search, versions
 import logging
 from django.contrib import messages
 from django.db import IntegrityError
 
 logger = logging.getLogger(__name__)
 
+# The cached total is keyed on the catalog version; the TTL only bounds disk use.
+PHOTO_COUNT_TTL = 60 * 60
+# Rendered grid fragments are keyed on version stamps, so this only bounds disk use.
+GRID_CACHE_TTL = 60 * 60
+# Rendered width of a .grid tile (2/3/4 columns, see base.html), for srcset.
+GRID_SIZES = "(min-width: 900px) 25vw, (min-width: 640px) 33vw, 50vw"
 
 
+def grid_cache_key(request, per_user=False):
+    """
+    Vary-on value for a {% cache %}'d photo grid: the page URL (filters,
+    cursor, and the next= links inside the tiles), the catalog version, and
+    for grids that show favorite stars, the user and their favorites version.
+    """
+    parts = [versions.get("catalog"), request.get_full_path()]
+    if per_user:
+        parts += [str(request.user.pk), versions.get(versions.favorites_key(request.user.pk))]
+    return "|".join(parts)
+
+
+# ---- Conditional GET ----
+# Validators are built only from version stamps in the cache, so deciding on
+# a 304 costs no database queries beyond the session/user lookup.
+
+def _page_stamps(request, names):
+    stamps = [versions.get(name) for name in names]
+    if request.user.is_authenticated:
+        stamps.append(versions.get(versions.favorites_key(request.user.pk)))
+    return stamps
+
+
+def _etag_for(*names):
+    def etag(request, *args, **kwargs):
+        parts = _page_stamps(request, [n.format(**kwargs) for n in names])
+        # The page embeds the username and a CSRF token, so a new login must miss.
+        # get_token() first: on a session's first request the template would
+        # otherwise create the CSRF secret after this hash was taken.
+        get_token(request)
+        parts += [str(request.user.pk), request.META["CSRF_COOKIE"], request.get_full_path()]
+        return hashlib.md5("|".join(parts).encode()).hexdigest()
+    return etag
+
+
+def _last_modified_for(*names):
+    def last_modified(request, *args, **kwargs):
+        stamps = _page_stamps(request, [n.format(**kwargs) for n in names])
+        issued = [versions.issued_at(v) for v in stamps]
+        return None if None in issued else max(issued)
+    return last_modified
+
+
+def conditional(*names):
+    """
+    ETag / Last-Modified for a page that only changes when the named
+    stamps (plus the user's favorites) do. Names may use the URL kwargs,
+    e.g. "comments:{photo_id}".
+
+    no-cache makes the browser revalidate every time rather than guess a
+    freshness lifetime from Last-Modified; private keeps shared caches out.
+    """
+    def decorator(view):
+        view = condition(etag_func=_etag_for(*names), last_modified_func=_last_modified_for(*names))(view)
+        return cache_control(private=True, no_cache=True)(view)
+    return decorator
+
+
+# ---- Async views ----
+# album_detail, photo_detail, photo_browser, favorites, recent_comments and
+# search_photos are async, so an ASGI worker is free while they wait on the
+# database. Templates still render in a thread (arender): context processors
+# and lazy querysets (left lazy so a {% cache %} hit skips them) touch the
+# ORM, which may not run on the event loop. Under WSGI Django runs them in a private
+# event loop, so the same code serves both.
+
+arender = sync_to_async(render)
+
+
+async def _alist(queryset):
+    return [obj async for obj in queryset]
+
+
+@conditional("albums", "catalog")
 def album_list(request):
     albums = Album.objects.order_by("-created_at")
     return render(request, "gallery/album_list.html", {"albums": albums})
 
 
-def album_detail(request, album_id):
-    album = get_object_or_404(Album, id=album_id)
+@conditional("albums", "catalog")
+async def album_detail(request, album_id):
+    album = await aget_object_or_404(Album, id=album_id)
     photos = album.photos.order_by("created_at")
-    return render(request, "gallery/album_detail.html", {"album": album, "photos": photos})
+    return await arender(request, "gallery/album_detail.html", {
+        "album": album,
+        "photos": photos,
+        "grid_key": grid_cache_key(request),
+        "grid_ttl": GRID_CACHE_TTL,
+        "grid_sizes": GRID_SIZES,
+    })
 
 
-def photo_detail(request, photo_id):
-    photo = get_object_or_404(Photo, id=photo_id)
-    is_favorited = Favorite.objects.filter(user=request.user, photo=photo).exists()
+@conditional("catalog", "comments:{photo_id}")
+async def photo_detail(request, photo_id):
+    user = await request.auser()
     next_url = request.GET.get("next", "")
     if request.method == "POST":
+        photo = await aget_object_or_404(Photo, id=photo_id)
         text = (request.POST.get("text") or "").strip()
         if text:
-            Comment.objects.create(photo=photo, user=request.user, text=text)
+            await Comment.objects.acreate(photo=photo, user=user, text=text)
         return redirect("photo_detail", photo_id=photo.id)
 
-    comments = photo.comments.filter(is_visible=True).order_by("-created_at")
-    return render(request, "gallery/photo_detail.html", {"photo": photo, "comments": comments, "is_favorited": is_favorited,"next_url": next_url,})
+    # All three only need the id from the URL, so none waits for another.
+    photo, is_favorited, comments = await asyncio.gather(
+        Photo.objects.prefetch_related("tags").filter(id=photo_id).afirst(),
+        Favorite.objects.filter(user=user, photo_id=photo_id).aexists(),
+        _alist(
+            Comment.objects.filter(photo_id=photo_id, is_visible=True)
+            .select_related("user")
+            .order_by("-created_at")
+        ),
+    )
+    if photo is None:
+        raise Http404("No Photo matches the given query.")
+    # Needs the photo's album and position, so it can't join the gather.
+    previous, following = await sync_to_async(neighbors)(photo, next_url)
+    return await arender(request, "gallery/photo_detail.html", {
+        "photo": photo,
+        "comments": comments,
+        "is_favorited": is_favorited,
+        "next_url": next_url,
+        "previous": previous,
+        "following": following,
+    })
 
 @login_required
 def toggle_favorite(request, photo_id):
     if request.method != "POST":
         return redirect("photo_detail", photo_id=photo_id)
 
-    photo = get_object_or_404(Photo, id=photo_id)
-
-    fav = Favorite.objects.filter(user=request.user, photo=photo).first()
-    if fav:
-        fav.delete()
-    else:
-        Favorite.objects.create(user=request.user, photo=photo)
+    try:
+        favorite_writes.toggle(request.user.pk, photo_id)
+    except Photo.DoesNotExist:
+        raise Http404("No Photo matches the given query.")
     next_url = request.POST.get("next") or request.GET.get("next")
     if next_url:
         return redirect(next_url)
@@ -58,77 +182,130 @@ def toggle_favorite(request, photo_id):
     return redirect("photo_detail", photo_id=photo_id)
 
 
-def photo_browser(request):
+# ---- Favorites JSON API ----
+# For fetch() from the grids; the forms above stay as the no-JS fallback.
+
+@login_required
+@require_POST
+def api_toggle_favorite(request, photo_id):
+    try:
+        favorited = favorite_writes.toggle(request.user.pk, photo_id)
+    except Photo.DoesNotExist:
+        return JsonResponse({"error": "No such photo."}, status=404)
+    return JsonResponse({"photo": str(photo_id), "favorited": favorited})
+
+
+@login_required
+@require_POST
+def api_favorites(request):
+    """
+    Favorite or unfavorite many photos at once. Body:
+    {"action": "add" | "remove", "photos": [photo ids]}
+    """
+    try:
+        body = json.loads(request.body)
+        action = body["action"]
+        photo_ids = [uuid.UUID(str(pk)) for pk in body["photos"]]
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({"error": 'Expected {"action": ..., "photos": [ids]}.'}, status=400)
+    if action not in ("add", "remove"):
+        return JsonResponse({"error": 'action must be "add" or "remove".'}, status=400)
+    if len(photo_ids) > favorite_writes.MAX_BULK:
+        return JsonResponse({"error": f"At most {favorite_writes.MAX_BULK} photos per request."}, status=400)
+
+    changed = getattr(favorite_writes, action)(request.user.pk, photo_ids)
+    return JsonResponse({"action": action, "requested": len(photo_ids), "changed": changed})
+
+
+async def _photo_count():
+    # The total is only a label: count once per catalog version, not on every page view.
+    key = "photo_browser:count:" + versions.get("catalog")
+    total = await cache.aget(key)
+    if total is None:
+        total = await Photo.objects.acount()
+        await cache.aset(key, total, PHOTO_COUNT_TTL)
+    return total
+
+
+@conditional("catalog")
+async def photo_browser(request):
+    user = await request.auser()
     selected = request.GET.getlist("tags")
     untagged = request.GET.get("untagged") == "1"
+    after = decode_cursor(request.GET.get("after"))
+    before = decode_cursor(request.GET.get("before"))
 
     photos = (
         Photo.objects
         .select_related("album")
         .prefetch_related("tags")
-        .order_by("-created_at")
     )
 
-    if untagged:
-        photos = photos.filter(tags__isnull=True)
-
-    if selected:
-        photos = (
-            photos.filter(tags__slug__in=selected)
-            .annotate(
-                matched=Count(
-                    "tags",
-                    filter=Q(tags__slug__in=selected),
-                    distinct=True,
-                )
-            )
-            .filter(matched=len(selected))
-        )
-
-    photos = photos.distinct()
-    
-    if request.user.is_authenticated:
+    if user.is_authenticated:
         photos = photos.annotate(
             is_favorited=Exists(
-                Favorite.objects.filter(user=request.user, photo_id=OuterRef("pk"))
+                Favorite.objects.filter(user=user, photo_id=OuterRef("pk"))
             )
         )
 
-    # Pagination
-    paginator = Paginator(photos, 40)  # show 48 photos per page
-    page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
+    if selected or untagged:
+        all_tags = await _alist(Tag.objects.order_by("name"))
+        # Resolve the filter from the in-memory tag index and only fetch this page's rows.
+        slug_ids = {t.slug: t.pk for t in all_tags}
+        ids, has_next, has_previous, total = await sync_to_async(tag_index.match_page)(
+            [slug_ids.get(slug) for slug in selected], untagged, PHOTOS_PER_PAGE, after, before,
+        )
+        page_obj = KeysetPage(
+            await _alist(photos.filter(pk__in=ids).order_by("-created_at", "-pk")),
+            has_next,
+            has_previous,
+        )
+    else:
+        # Keyset pagination: ?after=/?before= carry an opaque (created_at, id) cursor.
+        all_tags, total, page_obj = await asyncio.gather(
+            _alist(Tag.objects.order_by("name")),
+            _photo_count(),
+            sync_to_async(keyset_page)(photos, PHOTOS_PER_PAGE, after=after, before=before),
+        )
 
-    all_tags = Tag.objects.order_by("name")
+    params = request.GET.copy()
+    for key in ("after", "before", "page"):
+        params.pop(key, None)
 
-    return render(
+    return await arender(
         request,
         "gallery/photo_browser.html",
         {
             "photos": page_obj.object_list,
             "page_obj": page_obj,
+            "total": total,
+            "filter_qs": params.urlencode(),
             "all_tags": all_tags,
             "selected": set(selected),
             "untagged": untagged,
+            "grid_key": grid_cache_key(request, per_user=True),
+            "grid_ttl": GRID_CACHE_TTL,
+            "grid_sizes": GRID_SIZES,
         },
     )
 
 
 def home(request):
-    stats = {
-        "albums": Album.objects.count(),
-        "photos": Photo.objects.count(),
-        "tags": Tag.objects.count(),
-        "comments": Comment.objects.count(),
+    data = site_stats()
+    context = {
+        "stats": data["counts"],
+        "latest_albums": data["latest_albums"],
+        "latest_photos": data["latest_photos"],
+        "grid_sizes": GRID_SIZES,
     }
-    latest_albums = Album.objects.order_by("-created_at")[:5]
-    latest_photos = Photo.objects.order_by("-created_at")[:12]
+    if request.user.is_staff:
+        context["stats_cache"] = dict(zip(("hits", "misses", "rate"), stats_hit_rate()))
+    return render(request, "gallery/home.html", context)
 
-    return render(request, "gallery/home.html", {
-        "stats": stats,
-        "latest_albums": latest_albums,
-        "latest_photos": latest_photos,
-    })
+@staff_member_required
+def request_timings(request):
+    """This worker's per-view latency percentiles and recent slow requests (see gallery.timing)."""
+    return JsonResponse(timings.snapshot())
 
 def uploading_photos(request):
     return render(request, "gallery/uploading_photos.html", {
@@ -136,9 +313,9 @@ def uploading_photos(request):
 
 
 @login_required
-def favorites(request):
+async def favorites(request):
     photos = (
-        Photo.objects.filter(favorited_by__user=request.user)
+        Photo.objects.filter(favorited_by__user=await request.auser())
         .select_related("album")
         .prefetch_related("tags")
         .order_by("-favorited_by__created_at")
@@ -147,16 +324,69 @@ def favorites(request):
     next_url = request.POST.get("next") or request.GET.get("next")
     if next_url:
         return redirect(next_url)
-    return render(request, "gallery/favorites.html", {"photos": photos})
+    return await arender(request, "gallery/favorites.html", {
+        "photos": photos,
+        "grid_key": grid_cache_key(request, per_user=True),
+        "grid_ttl": GRID_CACHE_TTL,
+        "grid_sizes": GRID_SIZES,
+    })
 
 
-def recent_comments(request):
-    comments = (
+async def recent_comments(request):
+    comments = await _alist(
         Comment.objects
         .select_related("photo", "user")
         .order_by("-created_at")[:100]
     )
-    return render(request, "gallery/recent_comments.html", {"comments": comments})
+    return await arender(request, "gallery/recent_comments.html", {"comments": comments})
+
+
+async def search_photos(request):
+    query = request.GET.get("q", "").strip()
+    page = await sync_to_async(search.search)(
+        query, PHOTOS_PER_PAGE, after=search.decode_cursor(request.GET.get("after"))
+    )
+    return await arender(request, "gallery/search.html", {
+        "query": query,
+        "photos": page.object_list,
+        "page_obj": page,
+        "grid_sizes": GRID_SIZES,
+    })
+
+
+def media_file(request, path):
+    """A file under MEDIA_ROOT (see gallery.media for caching and proxy offload)."""
+    return media.serve(request, path)
+
+
+# ---- ZIP downloads ----
+# Sync views: the archive streams from a generator (see gallery.downloads).
+
+def album_download(request, album_id):
+    album = get_object_or_404(Album, id=album_id)
+    photos = album.photos.order_by("created_at", "id")
+    return downloads.zip_response(request, photos, slugify(album.title) or "album")
+
+
+def photo_browser_download(request):
+    """The photos photo_browser shows for the same ?tags= / ?untagged=1, newest first."""
+    selected = request.GET.getlist("tags")
+    untagged = request.GET.get("untagged") == "1"
+    photos = Photo.objects.order_by("-created_at", "-id")
+    if selected or untagged:
+        slug_ids = dict(Tag.objects.filter(slug__in=selected).values_list("slug", "id"))
+        ids, _, _, _ = tag_index.match_page(
+            [slug_ids.get(slug) for slug in selected], untagged, settings.GALLERY_DOWNLOAD_MAX_PHOTOS + 1,
+        )
+        photos = photos.filter(pk__in=ids)
+    name = "-".join(["photos", *selected, *(["untagged"] if untagged else [])])
+    return downloads.zip_response(request, photos, name)
+
+
+@login_required
+def favorites_download(request):
+    photos = Photo.objects.filter(favorited_by__user=request.user).order_by("-favorited_by__created_at")
+    return downloads.zip_response(request, photos, "favorites")
 
 
 @permission_required("gallery.can_modify_tags", raise_exception=True)